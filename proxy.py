@@ -7,15 +7,39 @@ import requests
 import os
 import shutil
 import json
+import time
+import threading
 import argparse
+import atexit
+import uuid
+import queue
+import hashlib
 import multiprocessing
 import traceback
 import logging                      # Needed to remove terminal flask log 
 from flask_cors import CORS
 import src.pytherminal as pytherminal
-import src.device    as device
 import src.utils     as utils
 import src.lan       as lan
+import src.upstream  as upstream
+import src.aioproxy  as aioproxy
+import src.prefork   as prefork
+import src.streaming as streaming
+import src.cache     as cache
+import src.embedcache as embedcache
+import src.singleflight as singleflight
+import src.batching as batching
+import src.backends as backends
+import src.health as health
+import src.admission as admission
+import src.ratelimit as ratelimit
+import src.usage as usage
+import src.metrics as metrics
+import src.logwriter as logwriter
+import src.logindex as logindex
+import src.routes as routes
+import src.telemetry as telemetry
+import src.dashboard as dashboard
 from rich.pretty import pprint
 from datetime import datetime, timezone, timedelta
 from typing import Optional
@@ -26,34 +50,65 @@ from flask import Flask, render_template, request, send_from_directory, Response
 OLLAMA_PROXY_RELEASE="0.0.1"
 OLLAMA_MIN_RELEASE="0.5.5"
 
-# List of endpoints that are allowed to be accessed by the different types of users
-# All users have access to that endpoints. This endpoints are necessary for the proxy to start and function properly. 
-anonymous_allowed_endpoints=  ["api/tags", "v1/models", "api/version"]
-
-# Only users with a valid token can access that endpoints
-user_allowed_endpoints= ["api/show", 
-                         "api/version",
-                         "api/ps",
-                         "api/generate",
-                         "api/chat",
-                         "api/embed",
-                         "v1/chat/completions",
-                         "v1/completions",
-                         "v1/models",
-                         "v1/models/",
-                         "v1/embeddings",
-                         "info/device",
-                         "info/ps"
-                        ]
-# Only users with a valid admin token can access that endpoints
-admin_allowed_endpoints=["api/create", "api/copy", "api/delete", "api/pull", "api/push",
-                         "info/admin_api/"]
+# Policy of every endpoint: role required to call it, log level of a granted call (0 is not logged), seconds its answers
+# are kept in the metadata cache, read timeout (None for --read_timeout) and priority in the admission queue.
+# Patterns are exact paths, paths ending with * (prefix) or with {name} parts (one path segment).
+# Routes of the --routes_file file are added to this table, or replace the route with the same pattern.
+route_policies=[
+    # All users have access to that endpoints. This endpoints are necessary for the proxy to start and function properly. 
+    routes.RoutePolicy("api/tags",              "anonymous", log_level=0, cache_ttl=30),
+    routes.RoutePolicy("v1/models",             "anonymous", log_level=0, cache_ttl=30),
+    routes.RoutePolicy("api/version",           "anonymous", cache_ttl=300),
+    routes.RoutePolicy("info/snapshot",         "anonymous", log_level=0),
+    # Only users with a valid token can access that endpoints
+    routes.RoutePolicy("api/show",              "user", log_level=0, cache_ttl=300),
+    routes.RoutePolicy("api/ps",                "user", log_level=0, cache_ttl=2),
+    routes.RoutePolicy("v1/models/{model}",     "user", log_level=0, cache_ttl=30),
+    routes.RoutePolicy("api/generate",          "user"),
+    routes.RoutePolicy("api/chat",              "user"),
+    routes.RoutePolicy("api/embed",             "user"),
+    routes.RoutePolicy("v1/chat/completions",   "user"),
+    routes.RoutePolicy("v1/completions",        "user"),
+    routes.RoutePolicy("v1/embeddings",         "user"),
+    routes.RoutePolicy("info/device",           "user"),
+    routes.RoutePolicy("info/device/history",   "user"),
+    routes.RoutePolicy("info/ps",               "user"),
+    routes.RoutePolicy("info/events",           "user"),
+    # Only users with a valid admin token can access that endpoints
+    routes.RoutePolicy("api/create",            "admin"),
+    routes.RoutePolicy("api/blobs/{digest}",    "admin"),
+    routes.RoutePolicy("api/copy",              "admin"),
+    routes.RoutePolicy("api/delete",            "admin"),
+    routes.RoutePolicy("api/pull",              "admin"),
+    routes.RoutePolicy("api/push",              "admin"),
+    routes.RoutePolicy("info/admin_api/*",      "admin"),
+]
+
+# Admin endpoints that change the installed models: the metadata cache is cleared when they are called
+metadata_invalidating_endpoints=["api/create", "api/copy", "api/delete", "api/pull"]
+# Endpoints that never stream their answer: forwarded as simple POST calls even without a stream parameter
+non_streamed_endpoints=["api/show", "api/embed", "api/embeddings", "v1/embeddings", "api/copy", "api/delete"]
+# Endpoints answered from the embedding cache, input by input
+embedding_endpoints=["api/embed", "v1/embeddings"]
+# Read-only POST endpoints: identical concurrent calls share one upstream call, like GET calls
+idempotent_post_endpoints=["api/show"]
+# Endpoints whose deterministic requests (seed set or temperature 0) can be answered from the generation cache
+generation_endpoints=["api/generate", "api/chat", "v1/chat/completions", "v1/completions"]
+# Endpoints that run a model on Ollama: their calls go through the admission control (in-flight limits and fair queue)
+admission_endpoints=generation_endpoints+embedding_endpoints+["api/embeddings"]
+# With several backends: endpoints answered by every backend, with the function merging their answers
+merged_endpoints={"api/tags": backends.merge_tags, "api/ps": backends.merge_ps}
+# With several backends: admin endpoints sent to every backend holding the model
+broadcast_endpoints=["api/copy", "api/delete"]
+# Fields left out of /info/snapshot: raw values and timings changing at each health probe or device sample, not shown by the dashboard
+snapshot_skipped_fields={"latency", "checked_at", "raw", "ram_info", "cpu_load", "getDeviceInfoTime"}
 
 class InfollamaUser:
-    def __init__(self, user_type: str, user_name: str, token: str):
+    def __init__(self, user_type: str, user_name: str, token: str, limits: dict|None = None):
         self.user_type=user_type
         self.user_name=user_name
         self.token=token
+        self.limits=limits or {}
     def __str__(self):
         return f"User: {self.user_name}, Type: {self.user_type}"
     def to_dict(self):
@@ -61,13 +116,32 @@ class InfollamaUser:
     def to_dict_no_token(self):
         return {"user_type": self.user_type, "user_name": self.user_name, "token": "***"}
 
+class InfollamaUserIndex:
+    """Users of the user file indexed by token and by name, with the rate limits of each user type.
+    Never modified once built: a reload builds a new index that replaces the old one in a single assignment
+    """
+    def __init__(self, users: list|None = None, type_limits: dict|None = None, signature=None):
+        self.users=users or []
+        self.type_limits=type_limits or {}
+        self.signature=signature            # (mtime, size) of the user file when it was read
+        self.by_token: dict[str, InfollamaUser]={}
+        self.by_name: dict[str, InfollamaUser]={}
+        for user in self.users:
+            # The first line of a token or a name wins, as when the users were searched in the file order
+            self.by_token.setdefault(user.token, user)
+            self.by_name.setdefault(user.user_name, user)
 
 
 class InfollamaAccess:
-    def __init__(self, user_name: str, is_authorised: bool, desc: str):
+    def __init__(self, user_name: str, is_authorised: bool, desc: str, user_type: str = ""):
         self.user_name=user_name
         self.is_authorised=is_authorised
         self.desc=desc
+        self.user_type=user_type
+        self.retry_after=0                  # seconds to wait when the call is rate limited
+        self.request_id=None                # id of the call in the access log, set by authorize()
+        self.route=None                     # policy of the endpoint (routes.RoutePolicy), set by check_user_access()
+        self.ip=None
     def __str__(self):
         if (self.is_authorised):
             return f"Access to {self.user_name} is authorised ({self.desc})"
@@ -81,6 +155,7 @@ class InfollamaPing:
         self.ollama_version=""
         self.proxy_version=OLLAMA_PROXY_RELEASE
         self.config: Optional[InfollamaConfig] = None
+        self.backends: list[dict] = []
     def __str__(self):
         return f"Ping status: {self.ping}, User: {self.user}, Ollama version: {self.ollama_version}, Config: {self.config}"
     def to_dict(self):        
@@ -89,19 +164,78 @@ class InfollamaPing:
             'proxy_version': self.proxy_version,
             'ollama_version': self.ollama_version,
             'user': self.user.to_dict_no_token(),
-            'config': self.config.to_dict()
+            'config': self.config.to_dict() if self.config is not None else None,
+            'backends': self.backends
         }
 
+class InfollamaResponse:
+    """Answer of a forwarded call, independent of the web engine (Flask or asyncio) that sends it back.
+    The upstream body is kept as raw bytes and only parsed if a feature needs its content.
+    """
+    def __init__(self, status: int, body: bytes = b"", content_type: str = "application/json", headers: dict|None = None):
+        self.status=status
+        self.body=body
+        self.content_type=content_type
+        self.headers=headers or {}
+        self.usage=None                     # token usage read in the answer of a model call
+        self._json=None
+    def __str__(self):
+        return f"Response status: {self.status}, Content-Type: {self.content_type}, {len(self.body)} bytes"
+    def json(self):
+        """Parse the body (once) and return it"""
+        if self._json is None:
+            self._json=json.loads(self.body)
+        return self._json
+
 class InfollamaConfig: 
-    def __init__(self, base_url, host, port, cors_policy, user_file, log_file, anonymous_access=False, log_level="ALL"):
+    def __init__(self, base_url, host, port, cors_policy, user_file, log_file, anonymous_access=False, log_level="ALL", pool_size=32, keep_alive=60, stream_mode="lines", cache_size=256, embed_cache_size=10000, embed_cache_file="", gen_cache_size=0, gen_cache_skip_users=None, gen_cache_skip_endpoints=None, embed_batch_window=0, embed_batch_size=64, 
+                 health_interval=10, circuit_threshold=3, circuit_reset=30, connect_timeout=5, read_timeout=300, 
+                 max_in_flight=0, max_per_user=0, max_queue=1000, queue_timeout=300, fair_weights=None, log_queue_size=10000, log_overflow="drop", 
+                 access_log_file="", log_format="both", log_max_size=100, log_rotate="daily", log_keep=14, 
+                 access_index_file="", log_index_days=30, users_reload=2, routes_file="", device_interval=5, device_history=17280, dashboard_interval=2):
         self.base_url=base_url
         self.host=host
         self.port=port
         self.cors_policy=cors_policy
         self.user_file=user_file
+        self.users_reload=users_reload
+        self.routes_file=routes_file
+        self.device_interval=device_interval
+        self.device_history=device_history
+        self.dashboard_interval=dashboard_interval
         self.log_level=log_level
         self.log_file=log_file
         self.anonymous_access=anonymous_access  
+        self.pool_size=pool_size
+        self.keep_alive=keep_alive
+        self.stream_mode=stream_mode
+        self.cache_size=cache_size
+        self.embed_cache_size=embed_cache_size
+        self.embed_cache_file=embed_cache_file
+        self.gen_cache_size=gen_cache_size
+        self.gen_cache_skip_users=gen_cache_skip_users or []
+        self.gen_cache_skip_endpoints=gen_cache_skip_endpoints or []
+        self.embed_batch_window=embed_batch_window
+        self.embed_batch_size=embed_batch_size
+        self.health_interval=health_interval
+        self.circuit_threshold=circuit_threshold
+        self.circuit_reset=circuit_reset
+        self.connect_timeout=connect_timeout
+        self.read_timeout=read_timeout
+        self.max_in_flight=max_in_flight
+        self.max_per_user=max_per_user
+        self.max_queue=max_queue
+        self.queue_timeout=queue_timeout
+        self.fair_weights=fair_weights or {}
+        self.log_queue_size=log_queue_size
+        self.log_overflow=log_overflow
+        self.access_log_file=access_log_file
+        self.log_format=log_format
+        self.log_max_size=log_max_size
+        self.log_rotate=log_rotate
+        self.log_keep=log_keep
+        self.access_index_file=access_index_file
+        self.log_index_days=log_index_days
         self.lan_ip=lan.get_lan_ip()
     def __str__(self):
         return f"Base URL: {self.base_url}, Host: {self.host}, Port: {self.port}, Cors Policy: {self.cors_policy}, User File: {self.user_file}, anonymous_access: {self.anonymous_access} Log Level: {self.log_level}, Lan IP: {self.lan_ip}, log_file: {self.log_file}, log_size: {self.log_size}"
@@ -116,30 +250,129 @@ class InfollamaConfig:
             'lan_ip': self.lan_ip,
             "anonymous_access": self.anonymous_access  ,
             'log_file': self.log_file,
+            'pool_size': self.pool_size,
+            'keep_alive': self.keep_alive,
+            'stream_mode': self.stream_mode,
+            'cache_size': self.cache_size,
+            'embed_cache_size': self.embed_cache_size,
+            'embed_cache_file': self.embed_cache_file,
+            'gen_cache_size': self.gen_cache_size,
+            'embed_batch_window': self.embed_batch_window,
+            'embed_batch_size': self.embed_batch_size,
+            'health_interval': self.health_interval,
+            'circuit_threshold': self.circuit_threshold,
+            'circuit_reset': self.circuit_reset,
+            'connect_timeout': self.connect_timeout,
+            'read_timeout': self.read_timeout,
+            'max_in_flight': self.max_in_flight,
+            'max_per_user': self.max_per_user,
+            'max_queue': self.max_queue,
+            'queue_timeout': self.queue_timeout,
+            'log_queue_size': self.log_queue_size,
+            'log_overflow': self.log_overflow,
+            'access_log_file': self.access_log_file,
+            'log_format': self.log_format,
+            'log_max_size': self.log_max_size,
+            'log_rotate': self.log_rotate,
+            'log_keep': self.log_keep,
+            'log_index_days': self.log_index_days,
+            'users_reload': self.users_reload,
+            'routes_file': self.routes_file,
+            'device_interval': self.device_interval,
+            'device_history': self.device_history,
+            'dashboard_interval': self.dashboard_interval,
         }
     def get_log_size(self):
         return os.path.getsize(self.log_file)
 
 class InfollamaProxy:
-    def __init__(self, base_url, host, port, cors_policy, user_file, log_file="proxy.log", anonymous_access=False, log_level="ALL"):
-        base_url=base_url.rstrip('/').rstrip('/')
-        if (base_url.startswith("http://") or base_url.startswith("https://")):
-            self.base_url = base_url
-        else:
-            self.base_url = "http://" + base_url
+    def __init__(self, base_url, host, port, cors_policy, user_file, log_file="proxy.log", anonymous_access=False, log_level="ALL", pool_size=32, keep_alive=60, stream_mode="lines", cache_size=256, embed_cache_size=10000, embed_cache_file="", gen_cache_size=0, gen_cache_skip_users=None, gen_cache_skip_endpoints=None, embed_batch_window=0, embed_batch_size=64, 
+                 health_interval=10, circuit_threshold=3, circuit_reset=30, connect_timeout=5, read_timeout=300, 
+                 max_in_flight=0, max_per_user=0, max_queue=1000, queue_timeout=300, fair_weights=None, log_queue_size=10000, log_overflow="drop", 
+                 access_log_file="", log_format="both", log_max_size=100, log_rotate="daily", log_keep=14, 
+                 access_index_file="", log_index_days=30, users_reload=2, routes_file="", device_interval=5, device_history=17280, dashboard_interval=2):
+        # base_url can list several Ollama servers separated by commas: calls are balanced between them
+        base_urls=[]
+        for url in base_url.split(","):
+            url=url.strip().rstrip('/')
+            if url=="":
+                continue
+            if not (url.startswith("http://") or url.startswith("https://")):
+                url="http://" + url
+            base_urls.append(url)
+        self.base_url=base_urls[0]
         self.localhost="localhost"
-        self.config=InfollamaConfig(base_url, host, port, cors_policy, user_file, log_file, anonymous_access=anonymous_access, log_level=log_level)
-        self.ollama_base_url=base_url
+        self.config=InfollamaConfig(base_url, host, port, cors_policy, user_file, log_file, anonymous_access=anonymous_access, log_level=log_level, pool_size=pool_size, keep_alive=keep_alive, stream_mode=stream_mode, cache_size=cache_size, embed_cache_size=embed_cache_size, embed_cache_file=embed_cache_file, 
+                                    gen_cache_size=gen_cache_size, gen_cache_skip_users=gen_cache_skip_users, gen_cache_skip_endpoints=gen_cache_skip_endpoints, 
+                                    embed_batch_window=embed_batch_window, embed_batch_size=embed_batch_size, health_interval=health_interval, 
+                                    circuit_threshold=circuit_threshold, circuit_reset=circuit_reset, connect_timeout=connect_timeout, read_timeout=read_timeout,
+                                    max_in_flight=max_in_flight, max_per_user=max_per_user, max_queue=max_queue, queue_timeout=queue_timeout, fair_weights=fair_weights,
+                                    log_queue_size=log_queue_size, log_overflow=log_overflow, access_log_file=access_log_file, log_format=log_format, 
+                                    log_max_size=log_max_size, log_rotate=log_rotate, log_keep=log_keep, access_index_file=access_index_file, log_index_days=log_index_days, 
+                                    users_reload=users_reload, routes_file=routes_file, device_interval=device_interval, 
+                                    device_history=device_history, dashboard_interval=dashboard_interval)
+        self.ollama_base_url=self.base_url
         self.host=host
         self.port=port
         self.server = Flask("infollama_proxy")
+        # Pooled keep-alive connections to the Ollama server, shared by every forwarding path
+        self.upstream=upstream.UpstreamClient(pool_size=pool_size, keep_alive=keep_alive, timeout=(connect_timeout, read_timeout))
+        self.backends=backends.BackendPool(base_urls, self.fetch_backend, failure_threshold=circuit_threshold, reset_timeout=circuit_reset)
+        # Background probe of api/version on every backend, started in the serving process
+        self.health=health.HealthChecker(self.backends, self.probe_backend, interval=health_interval)
+        self.rate_limiter=ratelimit.RateLimiter()
+        # Route policies compiled once: role, log level, cache, timeout and priority of every endpoint
+        self.routes=routes.RouteTable(route_policies+self.read_routes_file(routes_file))
+        self.usage_stats=usage.UsageStats()
+        self.metrics=metrics.Metrics()
+        # Opt-in admission control of the model calls: global and per-user in-flight limits, weighted fair queue
+        self.admission=admission.AdmissionController(max_in_flight=max_in_flight, max_per_user=max_per_user, max_queue=max_queue) if max_in_flight>0 or max_per_user>0 else None
+        self.stream_stats=streaming.StreamStats()
+        self.metadata_cache=cache.TTLCache(max_size=cache_size)
+        self.singleflight=singleflight.SingleFlight()
+        self.embedding_cache=embedcache.EmbeddingCache(max_items=embed_cache_size, disk_path=embed_cache_file) if embed_cache_size>0 else None
+        # Opt-in cache of deterministic generations, bounded in MB
+        self.generation_cache=cache.SizedLRUCache(max_bytes=gen_cache_size*1024*1024) if gen_cache_size>0 else None
+        # Opt-in micro-batching of the concurrent embedding calls sent to Ollama
+        self.embedding_batcher=batching.EmbeddingBatcher(lambda endpoint, json_data, params: self.send("POST", endpoint, json_data, params),
+                                                         lambda answer: InfollamaResponse(200, json.dumps(answer).encode(), "application/json"),
+                                                         window_ms=embed_batch_window, max_inputs=embed_batch_size) if embed_batch_window>0 else None
         self.ollama_version=None
         self.ollama_running=False
         self.env_vars=dict()
         self.user_file: str=user_file
-        self.users= []
+        # Users of the user file, replaced as a whole when the file changes on disk
+        self.user_index=InfollamaUserIndex()
+        self.user_file_checked=0.0          # time.monotonic() of the last check of the user file
+        self.user_file_lock=threading.Lock()
+        self.log_sink=None          # Queue receiving the log lines when the log file is written by another process (pre-fork mode)
+        self.log_sink_lock=threading.Lock()
+        self.log_sink_dropped=0     # lines dropped because the queue to the supervisor was full
+        # Log lines are written in batches by a background thread for each log file (Apache events and JSONL access log),
+        # the queued lines are written on exit
+        self.log_writers: dict[str, logwriter.LogWriter]={}
+        # SQLite index of the access log records, filled by the access log writer and read by /info/admin_api/logs
+        self.log_index=logindex.LogIndex(access_index_file, retention_days=log_index_days) if access_log_file and access_index_file and log_format!="apache" and log_index_days>0 else None
+        for name, path in (("events", log_file if log_format!="jsonl" else ""), ("access", access_log_file if log_format!="apache" else "")):
+            if path:
+                on_write=self.log_index.add_lines if name=="access" and self.log_index is not None else None
+                self.log_writers[name]=logwriter.LogWriter(path, max_queue=log_queue_size, overflow=log_overflow, max_size=int(log_max_size*1024*1024), 
+                                                           rotate_daily=log_rotate=="daily", keep=log_keep, on_write=on_write)
+                atexit.register(self.log_writers[name].close)
+        self.worker_id=None
+        self.metrics_dir=None               # directory of the metrics snapshots of the pre-fork workers
         self.get_ollama_env_var()
+        # Background sampling of the device telemetry, started in the serving process. The first sample reads the static facts
+        self.device_sampler=telemetry.DeviceSampler(log_file, interval=device_interval, history_size=device_history)
         self.device=self.update_device_info()
+        # Dashboard updates pushed to the /info pages by /info/events, polled by one thread while a page is open
+        self.dashboard=dashboard.DashboardFeed({"ping": self.get_dashboard_ping, "models": self.get_dashboard_models, "ps": self.get_dashboard_ps, 
+                                                "device": self.device_sampler.get_snapshot}, interval=dashboard_interval) if dashboard_interval>0 else None
+        # Calls of /info/snapshot, and those answered 304 Not Modified
+        self.snapshot_lock=threading.Lock()
+        self.snapshots=0
+        self.snapshots_not_modified=0
+        self.snapshot_device=(None, b"null")    # (sample time, device part of /info/snapshot), replaced as a whole
         
         if cors_policy == "*":
             CORS(self.server)  # Enable CORS for all origins
@@ -147,6 +380,14 @@ class InfollamaProxy:
             if cors_policy != "":
                 CORS(self.server, resources={"/": {"origins": self.cors_policy}})
 
+    @property
+    def users(self) -> list:
+        return self.user_index.users
+
+    @property
+    def type_limits(self) -> dict:
+        return self.user_index.type_limits
+
     def __getattr__(self, name):
         if hasattr(InfollamaProxy, name):
             return getattr(InfollamaProxy, name)
@@ -165,10 +406,10 @@ class InfollamaProxy:
     
     def update_device_info(self) -> dict:
         """Get device information"""
-        device_info = device.get_device_info(self.config.log_file)
+        device_info = self.device_sampler.sample()
         return device_info
     
-    def log_event(self, user="internal", method="GET", url="", http_status=200, log_level=0, event="") -> None:
+    def log_event(self, user="internal", method="GET", url="", http_status=200, log_level=0, event="", ip=None) -> None:
         """ Log an event to the console and the log_file file
             Use the log level to detect the severity of the event
         """
@@ -209,24 +450,93 @@ class InfollamaProxy:
         if url.startswith("/") is False:
             url="/"+url
         
-        ip=self.get_user_ip()
+        if ip is None:
+            ip=self.get_user_ip()
 
         try:
-            with open(self.config.log_file, "a") as log_file:
-                http_version="HTTP/1.1"                
-                current_date = datetime.now().strftime("%d/%b/%Y:%H:%M:%S")
-                log_file.write(f"{ip} - {user} [{current_date}] \"{method} {url} {http_version}\" {http_status}\t{event}".strip()+"\n")
+            http_version="HTTP/1.1"                
+            current_date = datetime.now().strftime("%d/%b/%Y:%H:%M:%S")
+            line=f"{ip} - {user} [{current_date}] \"{method} {url} {http_version}\" {http_status}\t{event}".strip()+"\n"
+            self.write_log("events", line)
         except Exception as e:
             print(f"Error logging event: {e}")
         
 
+    def write_log(self, name: str, line: str) -> None:
+        """Send a line to the writer of the events log or of the access log, or to the supervisor in pre-fork mode"""
+        if self.log_sink is not None:
+            self.put_log_sink((name, line))
+            return
+        writer=self.log_writers.get(name)
+        if writer is not None:
+            writer.write(line)
+
+    def put_log_sink(self, item: tuple) -> None:
+        """Send a log line to the supervisor without waiting. When the queue is full, the new line or the oldest one
+        is dropped, as set by --log_overflow
+        """
+        try:
+            self.log_sink.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+        except ValueError:
+            # Queue closed: the worker is stopping
+            return
+        with self.log_sink_lock:
+            self.log_sink_dropped+=1
+        if self.config.log_overflow=="drop_oldest":
+            try:
+                # The oldest lines may still be in this worker's feeder buffer, so wait a little for them
+                self.log_sink.get(timeout=0.1)
+                self.log_sink.put_nowait(item)
+            except (queue.Empty, queue.Full):
+                pass
+
+    def log_access(self, request_id, user_name, user_type, ip, method, endpoint, model, status, latency, bytes_in=0, bytes_out=0, found=None, ttft=None) -> None:
+        """Write one JSON line per answered call in the access log (only the failed calls with the ERROR level)"""
+        if self.config.log_format=="apache" or self.config.log_level=="NEVER" or (self.config.log_level=="ERROR" and status<400):
+            return
+        record={"time": datetime.now(timezone.utc).isoformat(timespec="milliseconds"), "request_id": request_id or uuid.uuid4().hex, 
+                "ip": ip, "user": user_name, "user_type": user_type, "method": method, "endpoint": endpoint, "model": model if isinstance(model, str) else None,
+                "status": status, "latency": round(latency, 4), "ttft": round(ttft, 4) if ttft is not None else None, "bytes_in": bytes_in, "bytes_out": bytes_out,
+                "prompt_tokens": found.get("prompt_tokens") if found else None, "completion_tokens": found.get("completion_tokens") if found else None}
+        self.write_log("access", json.dumps(record, separators=(",", ":"))+"\n")
+
+    def query_logs(self, params: dict) -> dict:
+        """Query the access log index: a page of records, or the totals per user, endpoint, model or status with group_by.
+        Raise ValueError on a wrong parameter
+        """
+        if params.get("group_by"):
+            return self.log_index.aggregate(params["group_by"], params)
+        return self.log_index.query(params)
+
+    def get_device_history(self, params: dict) -> dict:
+        """Return the device telemetry between since and until (epoch seconds, ISO dates, or negative seconds from now)
+        downsampled to points values. Raise ValueError on a wrong parameter
+        """
+        times=[]
+        for name in ("since", "until"):
+            value=logindex.parse_time(params.get(name))
+            times.append(time.time()+value if value is not None and value<0 else value)
+        return self.device_sampler.history.query(times[0], times[1], int(params.get("points") or 100))
+
+    def get_request_id(self, headers) -> str:
+        """Return the X-Request-Id header sent by the client, or a new id"""
+        request_id=headers.get("X-Request-Id") if headers is not None else None
+        return request_id[:64] if request_id else uuid.uuid4().hex
+
     def load_user_file(self) -> None:
-        """Load the user file from the self.user_file file formated as type_of_user:user_name:token
+        """Load the user file from the self.user_file file formated as type_of_user:user_name:token[:limits]
         typeof user can be admin or user
         user_name is a string with letters or numbers
         toke is a secret string starting with pro_ followed by a random text string of 10 characters
+        limits are optional rate limits of the user: rps=model calls per second,tpm=model tokens per minute
         Example: admin:john_doe:pro_1234567890
-        users found are stored in self.users as a InfollamaUser object
+        Example: user:jane_doe:pro_0987654321:rps=2,tpm=60000
+        Rate limits of a user type are set with limits:type_of_user:limits
+        Example: limits:user:rps=5,tpm=100000
+        users found are stored in self.user_index, indexed by token and by name
         """
 
         # Check if user_file exists to copy default values
@@ -236,19 +546,71 @@ class InfollamaProxy:
                 shutil.copy2("./users.default.conf", "users.conf") 
 
         try:
-            # read the file line by line and create a list of InfollamaUser objects
-            with open(self.user_file, 'r') as file:
-                lines = file.readlines()
-                for line in lines:
-                    parts = line.strip().split(':')
-                    if len(parts) == 3 and parts[0] in ['admin', 'user']:
-                        user_type, user_name, token = parts[0], parts[1], parts[2]
-                        self.users.append(InfollamaUser(user_type=user_type, user_name=user_name, token=token))                        
+            self.user_index=self.read_user_file()
         except FileNotFoundError:
             pytherminal.console(f"[error]User file {self.user_file} not found. No users defined![/error]", False)
+        self.user_file_checked=time.monotonic()
+
+    def read_user_file(self) -> InfollamaUserIndex:
+        """Read the user file into a new index of the users"""
+        users=[]
+        type_limits={}
+        with open(self.user_file, 'r') as file:
+            signature=self.get_user_file_signature(file.fileno())
+            # read the file line by line and create a list of InfollamaUser objects
+            for line in file:
+                parts = line.strip().split(':')
+                if len(parts) == 3 and parts[0]=="limits":
+                    type_limits[parts[1]]=ratelimit.parse_limits(parts[2])
+                elif len(parts) in (3, 4) and parts[0] in ['admin', 'user']:
+                    user_type, user_name, token = parts[0], parts[1], parts[2]
+                    limits=ratelimit.parse_limits(parts[3]) if len(parts)==4 else None
+                    users.append(InfollamaUser(user_type=user_type, user_name=user_name, token=token, limits=limits))
+        return InfollamaUserIndex(users, type_limits, signature)
+
+    def get_user_file_signature(self, path_or_fd) -> tuple|None:
+        """Return the modification time and the size of the user file, None if it does not exist"""
+        try:
+            stat=os.stat(path_or_fd)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
 
-
-        
+    def check_user_file(self) -> None:
+        """Reload the users when the user file changed on disk, checked at most every users_reload seconds.
+        One thread reads the file while the others keep on using the current index
+        """
+        if self.config.users_reload<=0 or time.monotonic()-self.user_file_checked<self.config.users_reload:
+            return
+        if not self.user_file_lock.acquire(blocking=False):
+            return
+        try:
+            self.user_file_checked=time.monotonic()
+            signature=self.get_user_file_signature(self.user_file)
+            if signature is None or signature==self.user_index.signature:
+                return
+            try:
+                user_index=self.read_user_file()
+            except (OSError, ValueError) as e:
+                pytherminal.console(f"[error]User file {self.user_file} not reloaded: {e}[/error]", False)
+                return
+            self.user_index=user_index
+            pytherminal.console(f"[info]User file {self.user_file} reloaded: {len(user_index.users)} users[/info]", False)
+            self.log_event(event=f"User file {self.user_file} reloaded: {len(user_index.users)} users", log_level=5)
+        finally:
+            self.user_file_lock.release()
+
+    def read_routes_file(self, routes_file: str) -> list:
+        """Read the routes of the routes file, formated as pattern:role[:log=0,cache=30,timeout=600,priority=2]"""
+        if not routes_file:
+            return []
+        try:
+            return routes.read_policies(routes_file)
+        except FileNotFoundError:
+            pytherminal.console(f"[error]Routes file {routes_file} not found. Default routes are used![/error]", False)
+        except ValueError as e:
+            pytherminal.console(f"[error]Routes file {routes_file} not valid: {e}. Default routes are used![/error]", False)
+        return []
 
     def get_user(self, token: str) -> InfollamaUser:
         """Return an InfollamaUser object based on the token"""
@@ -256,9 +618,10 @@ class InfollamaProxy:
             return InfollamaUser("administrator", "openbar", "")
         if (token is None): 
             return InfollamaUser("anonymous", "anonymous", "")
-        for user in self.users:
-            if user.token == token:
-                return user
+        self.check_user_file()
+        user=self.user_index.by_token.get(token)
+        if user is not None:
+            return user
         return InfollamaUser("anonymous", "anonymous", "")
     
     def get_token(self, headers = None) -> str:
@@ -274,24 +637,22 @@ class InfollamaProxy:
 
     def check_user_access(self, headers: str, endpoint: str) -> InfollamaAccess:
         """Check if the token is associated to a user who has access to the specified endpoint"""
+        route=self.routes.match(endpoint)
         if self.config.anonymous_access is True:
-            return InfollamaAccess(self.get_user("").user_name, True, "No access control defined by config. Returns openbar user")
+            user=self.get_user("")
+            r=InfollamaAccess(user.user_name, True, "No access control defined by config. Returns openbar user", user.user_type)
+            r.route=route
+            return r
 
         token=self.get_token(headers)
         user=self.get_user(token)
-        # Check wich endpoints are allowed for the user type
-        if user.user_type=="anonymous":
-            allowed_endpoints=anonymous_allowed_endpoints
-        elif user.user_type=="user":
-            allowed_endpoints=anonymous_allowed_endpoints+user_allowed_endpoints
-        elif user.user_type=="admin":
-            allowed_endpoints=anonymous_allowed_endpoints+user_allowed_endpoints+admin_allowed_endpoints
-
-        if endpoint not in allowed_endpoints:
-            r=InfollamaAccess(user.user_name, False, f"Endpoint {endpoint} is not allowed for user named {user.user_name}, type {user.user_type}")
+        # Check the role required by the route of the endpoint
+        if route is None or not route.allows(user.user_type):
+            r=InfollamaAccess(user.user_name, False, f"Endpoint {endpoint} is not allowed for user named {user.user_name}, type {user.user_type}", user.user_type)
             return r
         else:
-            r=InfollamaAccess(user.user_name, True, f"Access to Endpoint {endpoint} granted to user named {user.user_name}, type {user.user_type}")
+            r=InfollamaAccess(user.user_name, True, f"Access to Endpoint {endpoint} granted to user named {user.user_name}, type {user.user_type}", user.user_type)
+            r.route=route
             return r
 
     def get_user_ip(self) -> str:
@@ -301,16 +662,145 @@ class InfollamaProxy:
         except Exception as e:
             return "0.0.0.0"
     
-    def get_info_ps(self, headers) -> dict:
+    def get_info_ps(self, headers, ip=None) -> dict:
         """Get running models with computed informations"""
         try:
-            ps = self.get("api/ps", headers)
-            for model in ps["models"]:
-                model["expires_in"] = utils.get_diff_date(model.get("expires_at"))
-            return ps
+            ps = self.forward("GET", "api/ps", headers, ip=ip).json()
+            # Copies: the parsed JSON may be shared with the cached response
+            return dict(ps, models=[dict(model, expires_in=utils.get_diff_date(model.get("expires_at"))) for model in ps["models"]])
         except Exception as e:
             return {"error get_info_ps()": str(e)}
 
+    def get_info_device(self) -> dict|None:
+        """Return the latest sample of the device information"""
+        try:
+            self.device=self.device_sampler.get_snapshot()
+        except Exception as e:
+            traceback.print_exc()
+            print("[b]Error get_device_info():[/b]", e)
+            print("[b]Try to update your install with this command:\n pip install -U pip setuptools wheel[/b]")
+            self.device=None
+        return self.device
+
+    def get_info_device_body(self) -> bytes:
+        """Return the latest sample of the device information, serialized in JSON"""
+        return self.device_sampler.get_body()
+
+    def get_dashboard_ping(self) -> dict:
+        """State of Ollama and of the backends pushed to the dashboards, the same for every user"""
+        response=self.get_cached("GET", "api/tags")
+        ping=response.status==200 and bool(response.body)
+        if ping:
+            self.get_ollama_version(use_cache=True)
+        return {"ping": ping, "proxy_version": OLLAMA_PROXY_RELEASE, "ollama_version": self.ollama_version if ping else None, "backends": self.backends.get_health()}
+
+    def get_dashboard_models(self) -> dict|None:
+        """Installed models pushed to the dashboards, None if Ollama does not answer"""
+        response=self.get_cached("GET", "api/tags")
+        return response.json() if response.status==200 else None
+
+    def get_dashboard_ps(self) -> dict|None:
+        """Running models pushed to the dashboards, with their expiration in minutes, None if Ollama does not answer"""
+        response=self.get_cached("GET", "api/ps")
+        if response.status!=200:
+            return None
+        ps=response.json()
+        # Copies: the parsed JSON is shared by every caller of the cached response
+        return dict(ps, models=[dict(model, expires_in=utils.get_diff_date(model.get("expires_at"))) for model in ps.get("models", [])])
+
+    def can_read(self, user: InfollamaUser, endpoint: str) -> bool:
+        """Return True if the user can call endpoint, without building an InfollamaAccess"""
+        route=self.routes.match(endpoint)
+        return self.config.anonymous_access is True or (route is not None and route.allows(user.user_type))
+
+    def get_dashboard_snapshot(self, headers, if_none_match: str|None = None) -> InfollamaResponse:
+        """Dashboard of the /info pages in one call: ping, installed models, running models and device.
+        The running models and the device are null for the users who can not read /info/ps and /info/device.
+        The ETag is a hash of the body: called again with it in If-None-Match, the answer is 304 without body if the body is the same
+        """
+        access=self.check_user_access(headers, "info/snapshot")
+        if not access.is_authorised:
+            return InfollamaResponse(403, b'{"error": "Forbidden"}')
+        user=self.get_user("" if self.config.anonymous_access is True else self.get_token(headers))
+        ping=self.get_dashboard_ping()
+        ping["user"]=user.to_dict_no_token()
+        ping["config"]=self.config.to_dict() if ping["ping"] else None
+        # Timings of the health checks: they change at each probe and are not shown by the dashboard
+        ping["backends"]=[{name: value for name, value in backend.items() if name not in snapshot_skipped_fields} for backend in ping["backends"]]
+        parts=[(b"ping", json.dumps(ping, default=str).encode()), (b"models", json.dumps(self.get_dashboard_models()).encode())]
+        parts.append((b"ps", json.dumps(self.get_dashboard_ps() if self.can_read(user, "info/ps") else None).encode()))
+        device=b"null"
+        if self.can_read(user, "info/device"):
+            try:
+                device=self.get_snapshot_device()
+            except Exception as e:
+                print("[b]Error get_device_info():[/b]", e)
+        parts.append((b"device", device))
+        body=b"{"+b", ".join(b'"'+name+b'": '+part for name, part in parts)+b"}"
+        etag='"'+hashlib.blake2b(body, digest_size=16).hexdigest()+'"'
+        # The answer depends on the token: a shared cache must not give it to another user
+        response_headers={"ETag": etag, "Cache-Control": "no-cache", "Vary": "Authorization"}
+        not_modified=bool(if_none_match) and (if_none_match.strip()=="*" or etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")])
+        with self.snapshot_lock:
+            self.snapshots+=1
+            self.snapshots_not_modified+=not_modified
+        if not_modified:
+            return InfollamaResponse(304, b"", headers=response_headers)
+        return InfollamaResponse(200, body, headers=response_headers)
+
+    def get_snapshot_device(self) -> bytes:
+        """Latest device sample for /info/snapshot, without the raw values and the timings that change at each sample
+        and are not shown by the dashboard. Serialized once per sample
+        """
+        snapshot, body, sampled_at=self.device_sampler.get_latest()
+        cached=self.snapshot_device
+        if cached[0]==sampled_at:
+            return cached[1]
+        device=json.dumps({name: value for name, value in snapshot.items() if name not in snapshot_skipped_fields}, default=str).encode()
+        self.snapshot_device=(sampled_at, device)
+        return device
+
+    def get_event_headers(self, headers, cookies) -> dict:
+        """Headers checked for /info/events: a browser EventSource can not send the Authorization header,
+        the token is read from the proxy-token cookie of the web UI
+        """
+        if headers.get("Authorization") or not cookies.get("proxy-token"):
+            return headers
+        return {"Authorization": "Bearer "+cookies.get("proxy-token")}
+
+    def iter_dashboard_events(self):
+        """Server-Sent Events of the dashboard parts, sent when they change. Blocks the thread of the subscriber"""
+        changed=threading.Event()
+        subscription=self.dashboard.subscribe(changed.set)
+        try:
+            yield dashboard.format_retry()
+            while True:
+                for name, body in self.dashboard.get_changes(subscription):
+                    yield dashboard.format_event(name, body)
+                if not changed.wait(dashboard.KEEP_ALIVE):
+                    yield dashboard.format_keep_alive()
+                changed.clear()
+        finally:
+            self.dashboard.unsubscribe(subscription)
+
+    def ping(self, headers, ip=None) -> dict:
+        """ Ping the Ollama server to check if it's running and get user/token information """
+        user=self.get_user(self.get_token(headers))
+        ping=InfollamaPing(False, user)
+        ping.backends=self.backends.get_health()
+        try:
+            response = self.forward("GET", "api/tags", headers, ip=ip)
+            if response.status==200 and response.body:
+                ping.ping=True
+                ping.config=self.config
+                ping.ollama_version=self.ollama_version
+                self.get_ollama_version(use_cache=True) # To update version number
+                return ping.to_dict()
+            else:
+                return ping.to_dict()
+        except requests.RequestException as e:
+            return ping.to_dict()
+
     def get_ollama_env_var(self) -> None:
         """Get the Ollama environment variables from the system"""
         return None # Return None as we don't need to get the environment variables from the system
@@ -322,77 +812,688 @@ class InfollamaProxy:
             pass
 
 
-    def create_url(self, endpoint: str) -> str:
-        """Create a URL for the Ollama API, with base_url and endpoint"""
+    def create_url(self, endpoint: str, backend: backends.Backend|None = None) -> str:
+        """Create a URL for the Ollama API, with base_url (of backend if set) and endpoint"""
         if (endpoint.startswith("/")):
             endpoint = endpoint[1:]
-        return f"{self.ollama_base_url}/{endpoint}"
-    
-    def get(self, endpoint, headers, **kwargs):
-        """Send a GET request to the Ollama API if the token access to endpoint is validated"""
+        base_url=backend.base_url if backend is not None else self.ollama_base_url
+        return f"{base_url}/{endpoint}"
 
-        if endpoint =="":
-            return "<script>window.location.href='/info';</script>"
+    def get_model_name(self, json_data) -> str|None:
+        """Return the model targeted by a POST call, used to choose its backend"""
+        if not isinstance(json_data, dict):
+            return None
+        return json_data.get("model") or json_data.get("name") or json_data.get("source")
+
+    def fetch_backend(self, backend: backends.Backend, endpoint: str) -> dict|None:
+        """Read a JSON answer of one backend, used to know the models it holds"""
+        try:
+            response=self.upstream.get(self.create_url(endpoint, backend), timeout=2)
+            return response.json() if response.status_code==200 else None
+        except (requests.RequestException, ValueError):
+            return None
 
+    def probe_backend(self, backend: backends.Backend) -> dict:
+        """Health probe of one backend: its api/version answer"""
+        response=self.upstream.get(self.create_url("api/version", backend), timeout=(self.config.connect_timeout, 5))
+        response.raise_for_status()
+        return response.json()
+    
+    def authorize(self, method, endpoint, headers, event="", ip=None) -> InfollamaAccess:
+        """Check the access to endpoint and the rate limits of the user, and log the call. Shared by every web engine"""
         access=self.check_user_access(headers, endpoint)
+        access.request_id=self.get_request_id(headers)
+        access.ip=ip or self.get_user_ip()
         if access.is_authorised is False:
-            self.log_event(access.user_name, "GET", endpoint, 403, log_level=9)
-            # return a status code 403 to flask server
-            return abort(403)
-        log_level=1
-        if endpoint=="api/ps" or endpoint=="api/tags" or endpoint=="v1/models" or endpoint=="api/show":
-            # if access is authorized and the endpoint are not sensible, log_level is 0 and no log is stored
-            log_level=0
-        self.log_event(access.user_name, "GET", endpoint, 200, log_level=log_level)
-
-        url = self.create_url(endpoint)
+            self.log_event(access.user_name, method, endpoint, 403, log_level=9, ip=ip)
+            return access
+        if endpoint in admission_endpoints:
+            access.retry_after=self.rate_limiter.check(access.user_name, self.get_rate_limits(access.user_name, access.user_type))
+            if access.retry_after>0:
+                access.is_authorised=False
+                self.log_event(access.user_name, method, endpoint, 429, log_level=5, event=f"Rate limited, retry after {access.retry_after}s", ip=ip)
+                return access
+        # if access is authorized and the endpoint is not sensible, the log_level of its route is 0 and no log is stored
+        log_level=access.route.log_level if access.route is not None else 1
+        self.log_event(access.user_name, method, endpoint, 200, log_level=log_level, event=event, ip=ip)
+        return access
+
+    def forward(self, method, endpoint, headers, json_data=None, params=None, ip=None, ticket: admission.Ticket|None = None, size=0,
+                access: InfollamaAccess|None = None) -> InfollamaResponse:
+        """Send a non streamed GET or POST call to the Ollama API if the token access to endpoint is validated.
+        ticket is an admission slot already taken by the caller (asyncio engine), released when the call is done.
+        access is the result of authorize() when the caller already checked the access and the rate limits before taking the ticket.
+        size is the length of the request body, counted in the metrics.
+        """
+        started=time.perf_counter()
         try:
-            response = requests.get(url, params=kwargs)
-            if (utils.is_json(response.text)):
-                return response.json()      
+            if access is None:
+                event="" if method=="GET" else json_data.__str__()
+                access=self.authorize(method, endpoint, headers, event=event, ip=ip)
+            if access.is_authorised is False:
+                response=self.get_denied_response(access)
+            else:
+                response=self.forward_call(method, endpoint, access, json_data, params, ip, ticket)
+            self.record_request(access, method, endpoint, response.status, started, size, len(response.body), self.get_model_name(json_data), response.usage)
+            return response
+        finally:
+            self.release_ticket(ticket)
+
+    def forward_call(self, method, endpoint, access: InfollamaAccess, json_data, params, ip, ticket) -> InfollamaResponse:
+        ttl=access.route.cache_ttl if access.route is not None else 0
+        if ttl>0:
+            key=self.get_cache_key(method, endpoint, json_data, params)
+            response=self.metadata_cache.get(key)
+            if response is not None:
+                return response
+            if endpoint=="v1/models":
+                response=self.get_openai_models()
+            else:
+                response=self.send_shared(method, endpoint, json_data, params)
+            if response.status==200:
+                self.metadata_cache.set(key, response, ttl)
+            return response
+
+        generation_key=self.get_generation_cache_key(endpoint, json_data, access.user_name) if method=="POST" else None
+        if generation_key is not None:
+            response=self.generation_cache.get(generation_key)
+            if response is not None:
+                return response
+
+        admitted=None
+        if ticket is None and self.needs_admission(method, endpoint):
+            admitted=self.admit(access, endpoint, ip)
+            if admitted is None:
+                return self.get_rejected_response()
+        try:
+            if endpoint in embedding_endpoints and method=="POST":
+                if self.embedding_cache is not None:
+                    response=self.embed(endpoint, json_data, params)
+                else:
+                    response=self.send_embeddings(endpoint, json_data, params)
             else:
-                return response.text
+                response=self.send_shared(method, endpoint, json_data, params)
+        finally:
+            self.release_ticket(admitted)
+        if response.status==200 and endpoint in admission_endpoints:
+            response.usage=usage.find_usage(response.body)
+            self.record_usage(access.user_name, self.get_model_name(json_data), endpoint, response.usage)
+        if endpoint in embedding_endpoints:
+            return response
+        if generation_key is not None and response.status==200:
+            self.generation_cache.set(generation_key, response, len(response.body))
+        self.invalidate_metadata_cache(endpoint)
+        return response
+
+    def get_rate_limits(self, user_name: str, user_type: str|None = None) -> dict:
+        """Return the rate limits of a user: limits of its type, overridden by its own limits in the user file"""
+        user_index=self.user_index
+        user=user_index.by_name.get(user_name)
+        if user_type is None:
+            user_type=user.user_type if user is not None else "anonymous"
+        limits=dict(user_index.type_limits.get(user_type, {}))
+        if user is not None:
+            limits.update(user.limits)
+        return limits
+
+    def record_usage(self, user_name: str, model, endpoint: str, found: dict|None) -> None:
+        """Count the usage of a finished model call (read in the answer or in the final frames of a stream)
+        in the rate limits and in the usage statistics
+        """
+        if found is not None:
+            self.rate_limiter.record_tokens(user_name, self.get_rate_limits(user_name), usage.get_total_tokens(found))
+            self.usage_stats.record(user_name, model, endpoint, found)
+
+    def get_denied_response(self, access: InfollamaAccess) -> InfollamaResponse:
+        """Answer of a call refused by authorize(): 429 with Retry-After when rate limited, else 403"""
+        if access.retry_after>0:
+            return InfollamaResponse(429, json.dumps({"error": f"rate limit exceeded, retry after {access.retry_after} seconds"}).encode(), "application/json", 
+                                     headers={"Retry-After": str(access.retry_after)})
+        return InfollamaResponse(403)
+
+    def needs_admission(self, method, endpoint) -> bool:
+        """Return True if the call runs a model and must wait for an admission slot"""
+        return self.admission is not None and method=="POST" and endpoint in admission_endpoints
+
+    def admit(self, access: InfollamaAccess, endpoint, ip=None) -> admission.Ticket|None:
+        """Wait for an admission slot (blocking the thread). Return None if the queue is full or the wait too long"""
+        ticket=self.admission.acquire(access.user_name, endpoint, self.get_admission_weight(access), timeout=self.config.queue_timeout)
+        self.log_admission(access, endpoint, ticket, ip)
+        return ticket
+
+    def get_admission_weight(self, access: InfollamaAccess) -> float:
+        """Fair share weight of a call in the admission queue: weight of the user type times the priority of the route"""
+        return self.config.fair_weights.get(access.user_type, 1)*(access.route.priority if access.route is not None else 1)
+
+    def log_admission(self, access: InfollamaAccess, endpoint, ticket: admission.Ticket|None, ip=None) -> None:
+        """Log the calls rejected by the admission control, and the queue depth and wait of the queued calls"""
+        if ticket is None:
+            self.log_event(access.user_name, "POST", endpoint, 429, log_level=5, event="Rejected by the admission control", ip=ip)
+        elif ticket.queue_depth>0 or ticket.wait>0.1:
+            self.log_event(access.user_name, "POST", endpoint, 200, log_level=0, event=f"Queued: queue_depth={ticket.queue_depth} wait={ticket.wait:.3f}s", ip=ip)
+
+    def release_ticket(self, ticket: admission.Ticket|None) -> None:
+        """Give back an admission slot, if the call had one"""
+        if ticket is not None:
+            self.admission.release(ticket)
+
+    def get_metric_endpoint(self, endpoint) -> str:
+        """Endpoint label of the metrics: unknown paths are counted together, to bound the number of series"""
+        route=self.routes.match(endpoint)
+        return route.pattern if route is not None else "other"
+
+    def get_route(self, endpoint) -> routes.RoutePolicy:
+        """Return the policy of endpoint, the default policy if no route matches it"""
+        return self.routes.match(endpoint) or routes.RoutePolicy(endpoint)
+
+    def get_timeout(self, endpoint) -> tuple:
+        """(connect, read) timeouts of a call to Ollama: the read timeout of the route, or --read_timeout"""
+        timeout=self.get_route(endpoint).timeout
+        return (self.config.connect_timeout, timeout if timeout else self.config.read_timeout)
+
+    def record_request(self, access: InfollamaAccess, method, endpoint, status: int, started: float, bytes_in=0, bytes_out=0, model=None, found=None) -> None:
+        """Count a non streamed call, or a stream refused before it started, in the metrics and in the access log"""
+        latency=time.perf_counter()-started
+        self.metrics.record_request(self.get_metric_endpoint(endpoint), status, access.user_type, latency, bytes_in, bytes_out)
+        self.log_access(access.request_id, access.user_name, access.user_type, access.ip, method, endpoint, model, status, latency, bytes_in, bytes_out, found)
+
+    def record_stream(self, timer: streaming.StreamTimer) -> None:
+        """Count a finished stream in the stream statistics, in the metrics and in the access log"""
+        self.stream_stats.record(timer)
+        latency=time.perf_counter()-timer.start
+        self.metrics.record_stream(self.get_metric_endpoint(timer.endpoint), timer.status, timer.user_type, latency,
+                                   timer.first_token, timer.connect, timer.request_bytes, timer.bytes)
+        self.log_access(timer.request_id, timer.user_name, timer.user_type, timer.ip, "STREAM", timer.endpoint, timer.model, timer.status, latency,
+                        timer.request_bytes, timer.bytes, timer.usage, timer.first_token)
+
+    def get_metrics(self) -> str:
+        """Return the metrics in the Prometheus text format, with the gauges of the caches, queues, backends and models"""
+        caches={}
+        for name, cache_stats in self.get_cache_stats().items():
+            if cache_stats is not None:
+                caches[(name,)]=cache_stats["hit_rate"]
+        models=self.usage_stats.to_dict()["models"]
+        gauges=[("cache_hit_rate", "Hits of the response caches over their lookups", ("cache",), caches),
+                ("model_tokens_per_second", "Generated tokens per second of evaluation, as reported by Ollama", ("model",),
+                 {(model,): totals["tokens_per_second"] for model, totals in models.items()}),
+                ("model_prompt_tokens_per_second", "Prompt tokens per second of evaluation, as reported by Ollama", ("model",),
+                 {(model,): totals["prompt_tokens_per_second"] for model, totals in models.items()}),
+                ("backend_outstanding", "Calls in progress on each Ollama backend", ("backend",),
+                 {(backend.base_url,): backend.outstanding for backend in self.backends})]
+        if self.log_writers:
+            gauges.append(("log_dropped", "Log lines dropped because the log queue was full", ("log",), {(name,): writer.dropped for name, writer in self.log_writers.items()}))
+        elif self.log_sink is not None:
+            gauges.append(("log_dropped", "Log lines dropped because the log queue was full", ("log",), {("worker_queue",): self.log_sink_dropped}))
+        if self.admission is not None:
+            admission_stats=self.admission.get_stats()
+            gauges+=[("admission_in_flight", "Model calls holding an admission slot", (), {(): admission_stats["in_flight"]}),
+                     ("admission_queue_depth", "Model calls waiting for an admission slot", (), {(): admission_stats["queue_depth"]})]
+        return self.get_worker_metrics().render(gauges)
+
+    def get_worker_metrics(self) -> metrics.Metrics:
+        """Return the metrics of this process, or in pre-fork mode the sum of the metrics of every worker:
+        the live metrics of this worker and the last snapshot of the others
+        """
+        if self.metrics_dir is None:
+            return self.metrics
+        combined=metrics.Metrics()
+        combined.add(self.metrics.to_dict())
+        for name in os.listdir(self.metrics_dir):
+            if name.endswith(".json") and name!=f"worker-{self.worker_id}.json":
+                snapshot=metrics.read_snapshot(os.path.join(self.metrics_dir, name))
+                if snapshot is not None:
+                    combined.add(snapshot)
+        return combined
+
+    def get_usage_stats(self) -> dict:
+        """Return the tokens, tokens per second and model load time per user and per model, and the usage of the last calls"""
+        return self.usage_stats.to_dict()
+
+    def get_rejected_response(self) -> InfollamaResponse:
+        return InfollamaResponse(429, json.dumps({"error": "too many requests in progress, try again later"}).encode(), "application/json")
+
+    def get_admission_stats(self) -> dict:
+        """Return the state of the admission control: calls in progress, queue depth per user, wait times"""
+        stats={"enabled": False} if self.admission is None else {"enabled": True, "weights": self.config.fair_weights, **self.admission.get_stats()}
+        stats["rate_limits"]=self.rate_limiter.get_stats()
+        return stats
+
+    def send(self, method, endpoint, json_data=None, params=None) -> InfollamaResponse:
+        """Send a call to the Ollama API, without access control. With several backends, the call goes to the backend
+        chosen for its model, or to every backend for the endpoints whose answers are merged.
+        """
+        if len(self.backends)>1:
+            if method=="GET" and endpoint in merged_endpoints:
+                return self.send_merged(endpoint, params)
+            if endpoint in broadcast_endpoints:
+                responses=[self.send_or_fail(backend, method, endpoint, json_data, params) for backend in self.backends.holding(self.get_model_name(json_data))]
+                if not responses:
+                    return InfollamaResponse(503, json.dumps({"error": "no Ollama server available"}).encode(), "application/json")
+                return next((response for response in responses if response.status==200), responses[-1])
+        model=self.get_model_name(json_data) if method=="POST" else None
+        failed=[]
+        while True:
+            backend=self.backends.choose(model, exclude=failed)
+            if backend is None:
+                # Every backend is down: fail fast instead of waiting for timeouts
+                return InfollamaResponse(503, json.dumps({"error": "no Ollama server available"}).encode(), "application/json")
+            try:
+                return self.send_to(backend, method, endpoint, json_data, params)
+            except requests.ConnectionError:
+                # The call did not reach this backend: try the next one
+                failed.append(backend)
+
+    def send_to(self, backend: backends.Backend, method, endpoint, json_data=None, params=None) -> InfollamaResponse:
+        """Send a call to one backend. Connection errors are raised (the caller may try another backend)"""
+        url = self.create_url(endpoint, backend)
+        backend.acquire()
+        try:
+            if method=="GET":
+                response = self.upstream.get(url, params=params, timeout=self.get_timeout(endpoint))
+            else:
+                response = self.upstream.post(url, json=json_data, params=params, timeout=self.get_timeout(endpoint))
+            backend.breaker.on_success()
+            if response.status_code==200 and (endpoint in generation_endpoints or endpoint in embedding_endpoints):
+                self.backends.mark_loaded(backend, self.get_model_name(json_data))
+            # Raw passthrough: no decode/parse/serialize round-trip on large answers like api/embed
+            return InfollamaResponse(response.status_code, response.content, response.headers.get("Content-Type", "application/json"))
+        except requests.ConnectionError as e:
+            backend.breaker.on_failure()
+            pytherminal.console(f"self.send() [error]{backend.base_url}: {e}[/error]");
+            raise
+        except requests.Timeout as e:
+            backend.breaker.on_failure()
+            pytherminal.console(f"self.send() [error]{backend.base_url}: {e}[/error]");
+            return InfollamaResponse(504)
+        except requests.RequestException as e:
+            # Broken answer of the backend
+            backend.breaker.on_failure()
+            pytherminal.console(f"self.send() [error]{backend.base_url}: {e}[/error]");
+            return InfollamaResponse(500)
         except Exception as e:
-            pytherminal.console(f"self.get() [error]{e}[/error]");
-            return abort(500)
+            backend.breaker.on_abort()
+            pytherminal.console(f"self.send() [error]{e}[/error]");
+            return InfollamaResponse(500)
+        except BaseException:
+            backend.breaker.on_abort()
+            raise
+        finally:
+            backend.release()
+
+    def send_or_fail(self, backend: backends.Backend, method, endpoint, json_data=None, params=None) -> InfollamaResponse:
+        """Send a call to one backend, a connection error is answered with a 502 status"""
+        try:
+            return self.send_to(backend, method, endpoint, json_data, params)
+        except requests.ConnectionError:
+            return InfollamaResponse(502)
+
+    def send_merged(self, endpoint, params=None) -> InfollamaResponse:
+        """Send a GET call to every available backend and merge their answers (api/tags, api/ps)"""
+        responses=[self.send_or_fail(backend, "GET", endpoint, params=params) for backend in self.backends.available()]
+        if not responses:
+            return InfollamaResponse(503, json.dumps({"error": "no Ollama server available"}).encode(), "application/json")
+        answers=[]
+        for response in responses:
+            if response.status==200:
+                try:
+                    answers.append(response.json())
+                except ValueError:
+                    pass
+        if not answers:
+            return responses[0]
+        return InfollamaResponse(200, json.dumps(merged_endpoints[endpoint](answers)).encode(), "application/json")
+
+    def send_shared(self, method, endpoint, json_data=None, params=None) -> InfollamaResponse:
+        """Send a call to the Ollama API. Identical idempotent calls in flight at the same time share one upstream call"""
+        if method=="GET" or endpoint in idempotent_post_endpoints:
+            key=self.get_cache_key(method, endpoint, json_data, params)
+            return self.singleflight.do(key, lambda: self.send(method, endpoint, json_data, params))
+        return self.send(method, endpoint, json_data, params)
+
+    def send_embeddings(self, endpoint, json_data, params=None) -> InfollamaResponse:
+        """Send an embedding call to the Ollama API, batched with the concurrent calls if micro-batching is enabled"""
+        if self.embedding_batcher is not None:
+            return self.embedding_batcher.embed(endpoint, json_data, params)
+        return self.send("POST", endpoint, json_data, params)
+
+    def get_cache_key(self, method, endpoint, json_data=None, params=None) -> tuple:
+        """Key identifying a call in the caches: endpoint, query parameters and canonical JSON body"""
+        body=json.dumps(json_data, sort_keys=True) if json_data is not None else ""
+        return (method, endpoint, tuple(sorted((params or {}).items())), body)
+
+    def get_cached(self, method, endpoint) -> InfollamaResponse:
+        """Return the answer of a metadata endpoint from the cache, or from Ollama on a miss"""
+        key=self.get_cache_key(method, endpoint)
+        response=self.metadata_cache.get(key)
+        if response is None:
+            response=self.send_shared(method, endpoint)
+            if response.status==200:
+                self.metadata_cache.set(key, response, self.get_route(endpoint).cache_ttl)
+        return response
+
+    def get_openai_models(self) -> InfollamaResponse:
+        """Build the OpenAI compatible v1/models answer from the (cached) api/tags answer"""
+        tags=self.get_cached("GET", "api/tags")
+        if tags.status!=200:
+            return tags
+        models=[]
+        for model in tags.json().get("models", []):
+            try:
+                created=int(datetime.fromisoformat(model.get("modified_at")).timestamp())
+            except (TypeError, ValueError):
+                created=0
+            name=model.get("name", "")
+            models.append({"id": name, "object": "model", "created": created, "owned_by": name.split("/")[0] if "/" in name else "library"})
+        return InfollamaResponse(200, json.dumps({"object": "list", "data": models}).encode(), "application/json")
+
+    def get_model_digest(self, model: str) -> str|None:
+        """Return the digest of an installed model, read from the cached api/tags answer"""
+        if not isinstance(model, str):
+            return None
+        if ":" not in model:
+            model+=":latest"
+        tags=self.get_cached("GET", "api/tags")
+        if tags.status!=200:
+            return None
+        for installed in tags.json().get("models", []):
+            if installed.get("name")==model or installed.get("model")==model:
+                return installed.get("digest")
+        return None
+
+    def embed(self, endpoint, json_data, params=None) -> InfollamaResponse:
+        """Answer api/embed and v1/embeddings from the embedding cache. Only the inputs missing in the cache
+        are sent to Ollama, then all the vectors are merged back in the order of the request.
+        """
+        if not isinstance(json_data, dict):
+            # Not a request object: Ollama answers with its own error
+            return self.send("POST", endpoint, json_data, params)
+        inputs=json_data.get("input")
+        if isinstance(inputs, str):
+            inputs=[inputs]
+        digest=self.get_model_digest(json_data.get("model"))
+        # Token arrays, base64 answers or unknown models are not cached
+        if (digest is None or not isinstance(inputs, list) or len(inputs)==0 or not all(isinstance(text, str) for text in inputs)
+                or json_data.get("encoding_format", "float")!="float"):
+            return self.send_embeddings(endpoint, json_data, params)
+
+        # Parameters that change the vectors are part of the key
+        options=json.dumps({k: v for k, v in json_data.items() if k not in ("model", "input", "keep_alive", "stream", "encoding_format", "user")}, sort_keys=True)
+        keys=[embedcache.get_key(digest, text, options) for text in inputs]
+        vectors=self.embedding_cache.get_many(keys)
+        missing=[i for i, vector in enumerate(vectors) if vector is None]
+        upstream_answer={}
+        if missing:
+            sub_request=dict(json_data)
+            sub_request["input"]=[inputs[i] for i in missing]
+            response=self.send_embeddings(endpoint, sub_request, params)
+            if response.status!=200:
+                return response
+            upstream_answer=response.json()
+            if endpoint=="v1/embeddings":
+                received=[item.get("embedding") for item in sorted(upstream_answer.get("data", []), key=lambda item: item.get("index", 0))]
+            else:
+                received=upstream_answer.get("embeddings", [])
+            if len(received)!=len(missing):
+                return response
+            self.embedding_cache.set_many([keys[i] for i in missing], received)
+            if len(missing)==len(inputs):
+                # Nothing came from the cache: send the upstream answer untouched
+                return response
+            for i, vector in zip(missing, received):
+                vectors[i]=vector
+
+        if endpoint=="v1/embeddings":
+            upstream_usage=upstream_answer.get("usage", {"prompt_tokens": 0, "total_tokens": 0})
+            answer={"object": "list", "data": [{"object": "embedding", "embedding": vector, "index": i} for i, vector in enumerate(vectors)],
+                    "model": json_data.get("model"), "usage": upstream_usage}
+        else:
+            answer={"model": json_data.get("model"), "embeddings": vectors}
+            for field in ("total_duration", "load_duration", "prompt_eval_count"):
+                if field in upstream_answer:
+                    answer[field]=upstream_answer[field]
+        return InfollamaResponse(200, json.dumps(answer).encode(), "application/json")
+
+    def get_generation_cache_key(self, endpoint, json_data, user_name) -> tuple|None:
+        """Return the generation cache key of a deterministic request (seed set or temperature 0), 
+        or None if the request must not be answered from the cache.
+        The model digest is part of the key: entries of a model expire when the model is updated.
+        """
+        if (self.generation_cache is None or endpoint not in generation_endpoints or not isinstance(json_data, dict)
+                or endpoint in self.config.gen_cache_skip_endpoints or user_name in self.config.gen_cache_skip_users):
+            return None
+        options=json_data.get("options") or {}
+        if not isinstance(options, dict):
+            # Wrong options: not cached, Ollama answers with its own error
+            return None
+        # Ollama API puts seed and temperature in options, OpenAI API at the root of the request
+        if not ("seed" in options or options.get("temperature")==0 or "seed" in json_data or json_data.get("temperature")==0):
+            return None
+        digest=self.get_model_digest(json_data.get("model"))
+        if digest is None:
+            return None
+        body=json.dumps({k: v for k, v in json_data.items() if k!="keep_alive"}, sort_keys=True)
+        return (endpoint, digest, body)
+
+    def invalidate_metadata_cache(self, endpoint) -> None:
+        """Clear the metadata cache after a call that changes the installed models"""
+        if endpoint in metadata_invalidating_endpoints:
+            self.metadata_cache.clear()
+            self.backends.forget()
+
+    def get_cache_stats(self) -> dict:
+        """Return the statistics of the response caches"""
+        return {"metadata": self.metadata_cache.get_stats(), 
+                "embeddings": self.embedding_cache.get_stats() if self.embedding_cache is not None else None,
+                "generations": self.generation_cache.get_stats() if self.generation_cache is not None else None}
+
+    def clear_caches(self) -> None:
+        """Clear the response caches"""
+        self.metadata_cache.clear()
+        if self.embedding_cache is not None:
+            self.embedding_cache.clear()
+        if self.generation_cache is not None:
+            self.generation_cache.clear()
+
+    def get(self, endpoint, headers, **kwargs):
+        """Send a GET request to the Ollama API if the token access to endpoint is validated"""
+
+        if endpoint =="":
+            return "<script>window.location.href='/info';</script>"
+
+        response=self.forward("GET", endpoint, headers, params=kwargs)
+        if response.status>=400 and not response.body:
+            # return the status code to flask server
+            return abort(response.status)
+        return Response(response.body, status=response.status, content_type=response.content_type, headers=response.headers)
     
     def post(self, endpoint, headers, data=None, **kwargs):
         """Transmit a POST call"""
-        access=self.check_user_access(headers, endpoint)
-        if access.is_authorised is False:
-            self.log_event(access.user_name, "POST", endpoint, 403, log_level=9)
-            return abort(403)
-        log_level=1
-        if endpoint=="api/ps" or endpoint=="api/tags" or endpoint=="v1/models" or endpoint=="api/show":
-            # if access is authorized and the endpoint are not sensible, log_level is 0 and no log is stored
-            log_level=0
-
-        url = self.create_url(endpoint)     
-        try:
-            response = requests.post(url, json=request.json, params=kwargs)
-            self.log_event(access.user_name, "POST", endpoint, 200, log_level=log_level, event=request.json.__str__())
-            if (utils.is_json(response.text)):
-                return response.json()      
-            else:
-                return response.text
-        except Exception as e:
-            pytherminal.console(f"self.post() [error]{e}[/error]");
-            abort(500)
+        response=self.forward("POST", endpoint, headers, json_data=request.json, params=kwargs, size=request.content_length or 0)
+        if response.status>=400 and not response.body:
+            return abort(response.status)
+        return Response(response.body, status=response.status, content_type=response.content_type, headers=response.headers)
     
+    def is_streamed(self, endpoint, json_data) -> bool:
+        """Return True if a POST call must be forwarded as a stream"""
+        if endpoint in non_streamed_endpoints:
+            return False
+        if isinstance(json_data, dict) and "stream" in json_data:
+            return json_data["stream"] is not False
+        #By default, the response will be returned as a stream
+        return True
+
     def stream(self, endpoint, headers, data=None, **kwargs):
         """Transmit and listen to a stream"""
-        access=self.check_user_access(headers, endpoint)
+        started=time.perf_counter()
+        access=self.authorize("STREAM", endpoint, headers, event=request.json.__str__())
         if access.is_authorised is False:
-            self.log_event(access.user_name, "STREAM", endpoint, 403, log_level=9)
+            denied=self.get_denied_response(access)
+            self.record_request(access, "STREAM", endpoint, denied.status, started, request.content_length or 0, model=self.get_model_name(request.json))
+            if denied.status==429:
+                return Response(denied.body, status=denied.status, content_type=denied.content_type, headers=denied.headers)
             return abort(403)
-        log_level=1
-        if endpoint=="api/ps" or endpoint=="api/tags" or endpoint=="v1/models" or endpoint=="api/show":
-            # if access is authorized and the endpoint are not sensible, log_level is 0 and no log is stored
-            log_level=0        
-        self.log_event(access.user_name, "STREAM", endpoint, 200, log_level=log_level, event=request.json.__str__())
 
-        url = self.create_url(endpoint)        
-        return Response(stream_with_context(stream_request('POST', url, json=request.json, params=request.args)), content_type=request.headers.get('Content-Type'))
+        model=self.get_model_name(request.json)
+        timer=streaming.StreamTimer(endpoint, access.user_name, model, access.user_type, access.request_id, access.ip)
+        timer.request_bytes=request.content_length or 0
+        generation_key=self.get_generation_cache_key(endpoint, request.json, access.user_name)
+        if generation_key is not None:
+            cached=self.generation_cache.get(generation_key)
+            if cached is not None:
+                return Response(stream_with_context(self.replay_generation(cached, timer)), status=cached.status, content_type=cached.content_type, 
+                                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+        ticket=None
+        if self.needs_admission("POST", endpoint):
+            ticket=self.admit(access, endpoint)
+            if ticket is None:
+                rejected=self.get_rejected_response()
+                self.record_request(access, "STREAM", endpoint, rejected.status, started, timer.request_bytes, model=model)
+                return Response(rejected.body, status=rejected.status, content_type=rejected.content_type)
+            timer.queue_wait=ticket.wait
+        failed=[]
+        try:
+            while True:
+                backend=self.backends.choose(model, exclude=failed)
+                if backend is None:
+                    return abort(503)
+                url = self.create_url(endpoint, backend)
+                backend.acquire()
+                try:
+                    response=self.upstream.request('POST', url, stream=True, json=request.json, params=request.args, timeout=self.get_timeout(endpoint))
+                    backend.breaker.on_success()
+                    break
+                except requests.ConnectionError as e:
+                    # The call did not reach this backend: try the next one
+                    backend.release()
+                    backend.breaker.on_failure()
+                    failed.append(backend)
+                    pytherminal.console(f"self.stream() [error]{backend.base_url}: {e}[/error]");
+                except requests.Timeout as e:
+                    backend.release()
+                    backend.breaker.on_failure()
+                    pytherminal.console(f"self.stream() [error]{backend.base_url}: {e}[/error]");
+                    return abort(504)
+                except requests.RequestException as e:
+                    backend.release()
+                    backend.breaker.on_failure()
+                    pytherminal.console(f"self.stream() [error]{backend.base_url}: {e}[/error]");
+                    return abort(500)
+                except Exception as e:
+                    backend.release()
+                    backend.breaker.on_abort()
+                    pytherminal.console(f"self.stream() [error]{e}[/error]");
+                    return abort(500)
+                except BaseException:
+                    backend.release()
+                    backend.breaker.on_abort()
+                    raise
+        except BaseException as e:
+            # abort() raises: the admission slot is given back before
+            self.release_ticket(ticket)
+            self.record_request(access, "STREAM", endpoint, getattr(e, "code", 500), started, timer.request_bytes, model=model)
+            raise
+        content_type=response.headers.get('Content-Type', request.headers.get('Content-Type'))
+        timer.on_connect(content_type, response.status_code)
+        # No buffering by the client or a reverse proxy: each frame must reach the client as soon as it is written
+        if response.status_code!=200:
+            generation_key=None
+        else:
+            self.backends.mark_loaded(backend, model)
+        # Released when the WSGI server closes the answer, even if the client is gone before the generator has started
+        self.metrics.stream_started()
+        try:
+            answer=Response(stream_with_context(self.stream_response(response, timer, generation_key)), status=response.status_code, content_type=content_type, 
+                            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+            answer.call_on_close(lambda: self.finish_stream(response, timer, backend, ticket))
+        except BaseException:
+            self.finish_stream(response, timer, backend, ticket)
+            raise
+        return answer
+
+    def stream_response(self, response, timer: streaming.StreamTimer, generation_key=None):
+        """ Forward an upstream stream to Flask as soon as data arrives.
+            In lines mode, only complete NDJSON lines or SSE events are written, in raw mode chunks are written as received
+            With a generation_key, the complete stream is stored in the generation cache
+        """
+        splitter=streaming.FrameSplitter(timer.sse) if self.config.stream_mode=="lines" else None
+        recorder=[] if generation_key is not None else None
+        # chunk_size=None yields every chunk as soon as it is received, instead of waiting for 8 KB
+        for chunk in response.iter_content(chunk_size=None):
+            if not chunk:
+                continue
+            timer.on_data(chunk)
+            if splitter is not None:
+                chunk=splitter.feed(chunk)
+                if not chunk:
+                    continue
+            timer.on_frames(chunk)
+            if recorder is not None:
+                recorder.append(chunk)
+            yield chunk
+        if splitter is not None:
+            rest=splitter.flush()
+            if rest:
+                timer.on_frames(rest)
+                if recorder is not None:
+                    recorder.append(rest)
+                yield rest
+        if recorder is not None:
+            # Only complete streams reach this line: a client disconnection stops the generator before
+            self.store_generation(generation_key, recorder, timer)
+
+    def finish_stream(self, response, timer: streaming.StreamTimer, backend: backends.Backend|None = None, ticket: admission.Ticket|None = None) -> None:
+        """Close the upstream stream, give back its backend and admission slot, and count it. Called once the answer is closed"""
+        try:
+            response.close()
+        finally:
+            if backend is not None:
+                backend.release()
+            self.release_ticket(ticket)
+            self.record_usage(timer.user_name, timer.model, timer.endpoint, timer.usage)
+            self.record_stream(timer)
+            self.invalidate_metadata_cache(timer.endpoint)
+
+    def replay_generation(self, cached: InfollamaResponse, timer: streaming.StreamTimer):
+        """Replay a stream stored in the generation cache frame by frame, with the framing (NDJSON or SSE) of the original answer.
+        Counted in the metrics and in the access log like a forwarded stream, not in the token usage: Ollama generated nothing
+        """
+        timer.on_connect(cached.content_type, cached.status)
+        self.metrics.stream_started()
+        try:
+            for frame in streaming.iter_frames(cached.body, timer.sse):
+                timer.on_data(frame)
+                timer.on_frames(frame)
+                yield frame
+        finally:
+            self.record_stream(timer)
+
+    def store_generation(self, generation_key, frames: list, timer: streaming.StreamTimer) -> None:
+        """Store a complete streamed answer in the generation cache"""
+        body=b"".join(frames)
+        content_type="text/event-stream" if timer.sse else "application/x-ndjson"
+        self.generation_cache.set(generation_key, InfollamaResponse(200, body, content_type), len(body))
+
+    def get_stream_stats(self) -> dict:
+        """Return the time-to-first-byte and time-to-first-token of the last streams"""
+        return self.stream_stats.to_dict()
+
+    def get_pool_stats(self) -> dict:
+        """Return the statistics of the upstream connection pools (reused vs new connections) and of the coalesced calls"""
+        stats=self.upstream.get_stats()
+        stats["singleflight"]=self.singleflight.get_stats()
+        stats["embed_batching"]=self.embedding_batcher.get_stats() if self.embedding_batcher is not None else None
+        stats["backends"]=self.backends.get_stats()
+        stats["log_writers"]={name: writer.get_stats() for name, writer in self.log_writers.items()}
+        if self.log_sink is not None and self.worker_id is not None:
+            stats["log_writers"]["worker_queue"]={"max_queue": self.config.log_queue_size, "overflow": self.config.log_overflow, "dropped": self.log_sink_dropped}
+        stats["log_index"]=self.log_index.get_stats() if self.log_index is not None else None
+        stats["routes"]=self.routes.to_list()
+        stats["device_sampler"]=self.device_sampler.get_stats()
+        stats["dashboard"]=self.dashboard.get_stats() if self.dashboard is not None else None
+        with self.snapshot_lock:
+            stats["snapshot"]={"calls": self.snapshots, "not_modified": self.snapshots_not_modified}
+        return stats
 
 
     # Check python version and venv
@@ -412,7 +1513,7 @@ class InfollamaProxy:
         """
         Trying to connect to ollama server and checking if it's running."""
         try:
-            response=requests.get(f"{self.ollama_base_url}")
+            response=self.upstream.get(f"{self.ollama_base_url}")
             self.ollama_running=True
             return True
         except requests.exceptions.RequestException as e:
@@ -420,13 +1521,13 @@ class InfollamaProxy:
             return False
         
         
-    def get_ollama_version(self) -> str|None:
+    def get_ollama_version(self, use_cache=False) -> str|None:
         """ Trying to read the /api/version to ensure this is a real ollama server on base_url. """
-        url=self.create_url("/api/version")
-        response=requests.get(url)
-
         try:
-            response=json.loads(response.text)
+            if use_cache:
+                response=self.get_cached("GET", "api/version").json()
+            else:
+                response=self.send("GET", "api/version").json()
             self.ollama_version=response["version"]
             self.ollama_running=True
             return self.ollama_version
@@ -438,6 +1539,169 @@ class InfollamaProxy:
             return None        
 
 
+def add_routes(proxy: InfollamaProxy, app_path: str) -> None:
+    """Define the routes of the Flask proxy server"""
+    @proxy.server.route('/info')
+    def info():
+        """ Serve the home page with localhost hardware informations & ollama server details (models available, models running, etc)"""
+        proxy.log_event("anonymous", "GET", "/info", 200, log_level=1)
+        return render_template('index.html', release=OLLAMA_PROXY_RELEASE)
+
+    @proxy.server.route("/info/ping",  methods=['GET', 'POST'])
+    def ping():
+        """ Ping the Ollama server to check if it's running and get user/token information """
+        return proxy.ping(request.headers)
+    
+    @proxy.server.route("/info/snapshot")
+    def info_snapshot():
+        """ Get the ping, models, running models and device in one call, 304 if unchanged since the ETag of If-None-Match """
+        response=proxy.get_dashboard_snapshot(request.headers, request.headers.get("If-None-Match"))
+        return Response(response.body, status=response.status, content_type=response.content_type, headers=response.headers)
+
+    @proxy.server.route("/info/events")
+    def info_events():
+        """ Push the dashboard updates (ping, models, running models, device) as Server-Sent Events """
+        if proxy.check_user_access(proxy.get_event_headers(request.headers, request.cookies), "info/events").is_authorised:
+            if proxy.dashboard is None:
+                return abort(404)
+            return Response(proxy.iter_dashboard_events(), content_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        else:
+            return abort(403)
+
+    @proxy.server.route("/info/device")
+    def info_device():
+        """ Get device information only to authorized users """
+        if proxy.check_user_access(request.headers, "info/device").is_authorised:
+            return Response(proxy.get_info_device_body(), content_type="application/json")
+        else:
+            return abort(403)
+        
+    @proxy.server.route("/info/device/history")
+    def info_device_history():
+        """ Get the device telemetry of a time range, downsampled to a number of points, only to authorized users """
+        if proxy.check_user_access(request.headers, "info/device/history").is_authorised:
+            if proxy.device_sampler.history is None:
+                return {"error": "The device history is disabled"}, 404
+            try:
+                return proxy.get_device_history(request.args.to_dict())
+            except ValueError as e:
+                return {"error": str(e)}, 400
+        else:
+            return abort(403)
+
+    @proxy.server.route("/info/ps")
+    def info_ps():
+        """ Get running models with computed informations """
+        if proxy.check_user_access(request.headers, "info/ps").is_authorised:
+            return proxy.get_info_ps(request.headers)
+        else:
+            return abort(403)
+
+
+
+    @proxy.server.route("/info/admin_api/pool")
+    def info_admin_pool():
+        """ Get the upstream connection pool statistics (admin only) """
+        if proxy.check_user_access(request.headers, "info/admin_api/").is_authorised:
+            return proxy.get_pool_stats()
+        else:
+            return abort(403)
+
+    @proxy.server.route("/info/admin_api/cache", methods=['GET', 'POST'])
+    def info_admin_cache():
+        """ Get the response cache statistics, or clear the caches with a POST (admin only) """
+        if proxy.check_user_access(request.headers, "info/admin_api/").is_authorised:
+            if request.method == 'POST':
+                proxy.clear_caches()
+            return proxy.get_cache_stats()
+        else:
+            return abort(403)
+
+    @proxy.server.route("/info/admin_api/streams")
+    def info_admin_streams():
+        """ Get the time-to-first-byte and time-to-first-token of the last streams (admin only) """
+        if proxy.check_user_access(request.headers, "info/admin_api/").is_authorised:
+            return proxy.get_stream_stats()
+        else:
+            return abort(403)
+
+    @proxy.server.route("/info/admin_api/queue")
+    def info_admin_queue():
+        """ Get the admission control state: calls in progress and queued per user, queue depth and wait times (admin only) """
+        if proxy.check_user_access(request.headers, "info/admin_api/").is_authorised:
+            return proxy.get_admission_stats()
+        else:
+            return abort(403)
+
+    @proxy.server.route("/info/admin_api/logs")
+    def info_admin_logs():
+        """ Query the access log by user, endpoint, model, status and time range, with paging, or get totals with group_by (admin only) """
+        if proxy.check_user_access(request.headers, "info/admin_api/").is_authorised:
+            if proxy.log_index is None:
+                return {"error": "The access log index is disabled"}, 404
+            try:
+                return proxy.query_logs(request.args.to_dict())
+            except ValueError as e:
+                return {"error": str(e)}, 400
+        else:
+            return abort(403)
+
+    @proxy.server.route("/metrics")
+    def serve_metrics():
+        """ Get the proxy metrics in the Prometheus text format (admin only) """
+        if proxy.check_user_access(request.headers, "info/admin_api/").is_authorised:
+            return Response(proxy.get_metrics(), content_type="text/plain; version=0.0.4")
+        else:
+            return abort(403)
+
+    @proxy.server.route("/info/admin_api/usage", methods=['GET', 'POST'])
+    def info_admin_usage():
+        """ Get the token usage per user and per model, or reset it with a POST (admin only) """
+        if proxy.check_user_access(request.headers, "info/admin_api/").is_authorised:
+            if request.method == 'POST':
+                proxy.usage_stats.clear()
+            return proxy.get_usage_stats()
+        else:
+            return abort(403)
+
+    @proxy.server.route('/favicon.ico', methods=['GET'])
+    def serveFavicon():
+        """ Serve the favicon.ico file (to avoid 404 errors)"""
+        return send_from_directory(os.path.join(app_path, 'static/picto'), 'infollama.png', mimetype='image/vnd.microsoft.icon')
+
+    @proxy.server.route('/robots.txt', methods=['GET'])
+    def serveRobots():
+        """ Serve the robots.txt file (to avoid 404 errors)"""
+        return "deny: all"
+
+    @proxy.server.route('/')
+    def home():
+        return proxy.get("", None, **request.args)
+    
+    @proxy.server.route('/<path:path>', methods=['GET', 'POST', 'OPTIONS'])
+    def catch_all(path):
+        """ Catch all routes and forward them to the ollama server """
+        if request.method == 'GET':
+            # A simple get request will be forwarded to the ollama server
+            return proxy.get(path, request.headers, **request.args)
+        elif request.method == 'POST':
+            # A POST request will be forwarded to the ollama server and must be streamed if stream parameter is set
+            if proxy.is_streamed(path, request.json):
+                return proxy.stream(path, request.headers, **request.args)
+            else:
+                return proxy.post(path, request.headers, **request.args)
+                
+
+        elif request.method == 'OPTIONS':
+            # Handle CORS preflight requests called by browsers on the frontend when cors origin must be checked
+            # Always accept CORS preflight requests called by browsers on the frontend when cors origin must be checked
+            if proxy.config.cors_policy=="*":
+                return '', 204 
+        else:
+            proxy.log_event("-", "POST", path, 405, log_level=9)
+            return "Method not allowed", 405
+
+
 if __name__ == "__main__":
     # Only one instance of this proxy server can be run at a time. This is done by freezing the support for multiprocessing.
     multiprocessing.freeze_support()
@@ -447,24 +1711,107 @@ if __name__ == "__main__":
     tjs_host="0.0.0.0"                      # host of the proxy server (localhost or 127.0.0.1 to keep on the same machine, 0.0.0.0 to allow connections from any machine)
     tjs_port=11430                          # port of the proxy server
     cors_policy="*"                         # cors policy of the proxy server (* allows all origins, None fixes policy to same origin)
-    base_url="http://localhost:11434"       # base url of the Ollama server
+    base_url="http://localhost:11434"       # base url of the Ollama server (several servers separated by commas are load balanced)
     user_file="users.conf"                  # path to the user file containing credentials
     log_level="PROMPT"                      # log level of the proxy server
     log_file="infollama.log"                # path to the log file for the proxy server
+    access_log_file="infollama.jsonl"       # path to the structured access log (one JSON line per call)
+    access_index_file="infollama.db"        # path to the SQLite index of the access log, queried at /info/admin_api/logs
     anonymous_access=False                  # Allows anonymous access to all API without providing token (default false)
+    pool_size=32                            # number of keep-alive connections kept open to the Ollama server
+    keep_alive=60                           # seconds an idle upstream connection is kept open (0 disables connection reuse)
+    engine="flask"                          # web engine serving the proxy: flask (threaded) or async (asyncio, for many concurrent streams)
+    stream_mode="lines"                     # lines: forward complete NDJSON lines / SSE events as soon as they arrive, raw: forward bytes as received
+    cache_size=256                          # max number of answers kept in the metadata cache (api/tags, api/show, ...), 0 disables the cache
+    embed_cache_size=10000                  # max number of embedding vectors kept in memory, 0 disables the embedding cache
+    embed_cache_file=""                     # path of the file keeping the embedding vectors between restarts (empty: memory only)
+    gen_cache_size=0                        # size in MB of the cache of deterministic generations (seed set or temperature 0), 0 disables it
+    gen_cache_skip_users=""                 # comma separated user names never answered from the generation cache
+    gen_cache_skip_endpoints=""             # comma separated endpoints never answered from the generation cache
+    embed_batch_window=0                    # milliseconds concurrent embedding calls are collected to be sent as one call, 0 disables micro-batching
+    embed_batch_size=64                     # max number of inputs sent in one batched embedding call
+    health_interval=10                      # seconds between two health probes (api/version) of every Ollama server, 0 disables them
+    circuit_threshold=3                     # consecutive failures of an Ollama server before its calls fail fast (circuit open)
+    circuit_reset=30                        # seconds a failing Ollama server is skipped before a trial call is sent again (half-open)
+    connect_timeout=5                       # seconds to open a connection to an Ollama server
+    read_timeout=300                        # max seconds without any data from an Ollama server during a call
+    max_in_flight=0                         # max model calls (generations, embeddings) sent to Ollama at the same time, 0 for no limit
+    max_per_user=0                          # max model calls of one user sent to Ollama at the same time, 0 for no limit
+    max_queue=1000                          # max calls waiting for a slot, the next ones are rejected (429)
+    queue_timeout=300                       # max seconds a call waits for a slot before being rejected (429)
+    fair_weights="admin:1,user:1"           # share of the slots given to each user type when calls are waiting
+    log_queue_size=10000                    # max log lines waiting to be written to the log file
+    log_overflow="drop"                     # when the log queue is full: drop the new line (drop) or the oldest queued line (drop_oldest)
+    log_format="both"                       # apache: events log only, jsonl: structured access log only, both: the two log files
+    log_max_size=100                        # size in MB of a log file before it is rotated, 0 for no rotation on size
+    log_rotate="daily"                      # daily: rotate the log files when the day changes, never: only on size
+    log_keep=14                             # rotated (gzipped) segments kept for each log file, 0 keeps all of them
+    log_index_days=30                       # days of access log records kept in the query index, 0 disables the index
+    users_reload=2                          # seconds between two checks of the user file, reloaded when it changed on disk, 0 disables the reload
+    device_interval=5                       # seconds between two samples of the device telemetry (RAM, disk, GPU), 0 samples at each /info/device call
+    dashboard_interval=2                    # seconds between two polls of the dashboard updates pushed to the /info pages, 0 disables the push (pages poll)
+    device_history=17280                    # samples of the device telemetry kept for /info/device/history (17280 samples every 5 s: 24 hours), 0 disables it
+    routes_file=""                          # path to a file of route policies (pattern:role[:log=0,cache=30,timeout=600,priority=2]) added to the default routes
+    workers=1                               # number of worker processes serving the port (pre-fork mode if > 1, not on Windows)
     ##########################################################################################################################################
 
     # Reading the argument parameters
     parser = argparse.ArgumentParser(description='Run a proxy filtered server to forward API requests to Ollama server defined by base_url.')
-    parser.add_argument('--base_url', type=str, default=base_url, help=f'The base_url of localhost Ollama server (default: {base_url})')
+    parser.add_argument('--base_url', type=str, default=base_url, help=f'The base_url of localhost Ollama server, or several base_urls separated by commas to balance the calls between them (default: {base_url})')
     parser.add_argument('--host', type=str, default=tjs_host, help=f'The host name for the proxy server (default: {tjs_host})')
     parser.add_argument('--port', type=str, default=tjs_port, help=f'The port for the proxy server (default: {tjs_port})')
     parser.add_argument('--cors', type=str, default=cors_policy, help=f'The cors policy for the proxy server (default: {cors_policy})')
     parser.add_argument('--anonym', type=bool, default=anonymous_access, help=f'Authorize the proxy server to be accessed anonymously without token (default: {anonymous_access})')
     parser.add_argument('--log', type=str, default=log_level, help=f'Define the log level that is stored in {log_file} (default: {log_level}, Could be NEVER|ERROR|INFO|PROMPT|ALL)')
+    parser.add_argument('--pool_size', type=int, default=pool_size, help=f'Number of keep-alive connections kept open to the Ollama server (default: {pool_size})')
+    parser.add_argument('--keep_alive', type=int, default=keep_alive, help=f'Seconds an idle connection to the Ollama server is kept open, 0 disables connection reuse (default: {keep_alive})')
+    parser.add_argument('--engine', type=str, default=engine, choices=["flask", "async"], help=f'The web engine serving the proxy, async holds many concurrent streams without a thread each (default: {engine})')
+    parser.add_argument('--workers', type=int, default=workers, help=f'Number of worker processes sharing the port, pre-fork mode if > 1, not available on Windows (default: {workers})')
+    parser.add_argument('--stream_mode', type=str, default=stream_mode, choices=["lines", "raw"], help=f'lines forwards each complete NDJSON line or SSE event as soon as it arrives, raw forwards bytes as received (default: {stream_mode})')
+    parser.add_argument('--cache_size', type=int, default=cache_size, help=f'Max number of answers kept in the metadata cache (api/tags, v1/models, api/version, api/show, api/ps), 0 disables it (default: {cache_size})')
+    parser.add_argument('--embed_cache_size', type=int, default=embed_cache_size, help=f'Max number of embedding vectors kept in memory, 0 disables the embedding cache (default: {embed_cache_size})')
+    parser.add_argument('--embed_cache_file', type=str, default=embed_cache_file, help=f'File keeping the embedding vectors between restarts, memory only if empty (default: "{embed_cache_file}")')
+    parser.add_argument('--gen_cache_size', type=int, default=gen_cache_size, help=f'Size in MB of the cache of deterministic generations (seed set or temperature 0), 0 disables it (default: {gen_cache_size})')
+    parser.add_argument('--gen_cache_skip_users', type=str, default=gen_cache_skip_users, help=f'Comma separated user names never answered from the generation cache (default: "{gen_cache_skip_users}")')
+    parser.add_argument('--gen_cache_skip_endpoints', type=str, default=gen_cache_skip_endpoints, help=f'Comma separated endpoints never answered from the generation cache, like api/chat (default: "{gen_cache_skip_endpoints}")')
+    parser.add_argument('--embed_batch_window', type=float, default=embed_batch_window, help=f'Milliseconds concurrent embedding calls are collected to be sent to Ollama as one call, 0 disables micro-batching (default: {embed_batch_window})')
+    parser.add_argument('--embed_batch_size', type=int, default=embed_batch_size, help=f'Max number of inputs sent in one batched embedding call (default: {embed_batch_size})')
+    parser.add_argument('--health_interval', type=float, default=health_interval, help=f'Seconds between two health probes of every Ollama server, 0 disables them (default: {health_interval})')
+    parser.add_argument('--circuit_threshold', type=int, default=circuit_threshold, help=f'Consecutive failures of an Ollama server before its calls fail fast (default: {circuit_threshold})')
+    parser.add_argument('--circuit_reset', type=float, default=circuit_reset, help=f'Seconds a failing Ollama server is skipped before a trial call is sent again (default: {circuit_reset})')
+    parser.add_argument('--connect_timeout', type=float, default=connect_timeout, help=f'Seconds to open a connection to an Ollama server (default: {connect_timeout})')
+    parser.add_argument('--read_timeout', type=float, default=read_timeout, help=f'Max seconds without any data from an Ollama server during a call (default: {read_timeout})')
+    parser.add_argument('--max_in_flight', type=int, default=max_in_flight, help=f'Max model calls (generations, embeddings) sent to Ollama at the same time, 0 for no limit (default: {max_in_flight})')
+    parser.add_argument('--max_per_user', type=int, default=max_per_user, help=f'Max model calls of one user sent to Ollama at the same time, 0 for no limit (default: {max_per_user})')
+    parser.add_argument('--max_queue', type=int, default=max_queue, help=f'Max calls waiting for a slot, the next ones are rejected with a 429 status (default: {max_queue})')
+    parser.add_argument('--queue_timeout', type=float, default=queue_timeout, help=f'Max seconds a call waits for a slot before being rejected with a 429 status (default: {queue_timeout})')
+    parser.add_argument('--fair_weights', type=str, default=fair_weights, help=f'Share of the slots given to each user type when calls are waiting, as type:weight,type:weight (default: "{fair_weights}")')
+    parser.add_argument('--log_queue_size', type=int, default=log_queue_size, help=f'Max log lines waiting to be written to {log_file} (default: {log_queue_size})')
+    parser.add_argument('--log_overflow', type=str, default=log_overflow, choices=logwriter.OVERFLOW_POLICIES, help=f'Line dropped when the log queue is full: drop the new line, or drop_oldest the oldest queued line (default: {log_overflow})')
+    parser.add_argument('--log_format', type=str, default=log_format, choices=["apache", "jsonl", "both"], help=f'apache writes the events log {log_file}, jsonl the structured access log {access_log_file}, both writes the two (default: {log_format})')
+    parser.add_argument('--log_max_size', type=float, default=log_max_size, help=f'Size in MB of a log file before it is rotated and gzipped, 0 for no rotation on size (default: {log_max_size})')
+    parser.add_argument('--log_rotate', type=str, default=log_rotate, choices=["daily", "never"], help=f'daily also rotates the log files when the day changes (default: {log_rotate})')
+    parser.add_argument('--log_keep', type=int, default=log_keep, help=f'Rotated segments kept for each log file, 0 keeps all of them (default: {log_keep})')
+    parser.add_argument('--log_index_days', type=float, default=log_index_days, help=f'Days of access log records kept in the query index {access_index_file}, 0 disables the index (default: {log_index_days})')
+    parser.add_argument('--users_reload', type=float, default=users_reload, help=f'Seconds between two checks of the user file {user_file}, reloaded without restart when it changed, 0 disables the reload (default: {users_reload})')
+    parser.add_argument('--routes_file', type=str, default=routes_file, help=f'File of route policies pattern:role[:log=0,cache=30,timeout=600,priority=2], added to the default routes (default: "{routes_file}")')
+    parser.add_argument('--device_interval', type=float, default=device_interval, help=f'Seconds between two background samples of the device telemetry (RAM, disk, GPU) returned by /info/device, 0 samples at each call (default: {device_interval})')
+    parser.add_argument('--device_history', type=int, default=device_history, help=f'Samples of the device telemetry kept in memory for /info/device/history, 0 disables the history (default: {device_history})')
+    parser.add_argument('--dashboard_interval', type=float, default=dashboard_interval, help=f'Seconds between two polls of the dashboard updates pushed to the /info pages by /info/events, 0 disables the push (default: {dashboard_interval})')
     args = parser.parse_args()
 
-    proxy = InfollamaProxy(base_url=args.base_url, host=args.host, port=args.port, cors_policy=args.cors, user_file=user_file, log_level=args.log, log_file=log_file,  anonymous_access=args.anonym )
+    proxy = InfollamaProxy(base_url=args.base_url, host=args.host, port=args.port, cors_policy=args.cors, user_file=user_file, log_level=args.log, log_file=log_file,  anonymous_access=args.anonym, pool_size=args.pool_size, keep_alive=args.keep_alive, stream_mode=args.stream_mode, cache_size=args.cache_size, embed_cache_size=args.embed_cache_size, embed_cache_file=args.embed_cache_file,
+                           gen_cache_size=args.gen_cache_size, gen_cache_skip_users=[u.strip() for u in args.gen_cache_skip_users.split(",") if u.strip()], 
+                           gen_cache_skip_endpoints=[e.strip().strip("/") for e in args.gen_cache_skip_endpoints.split(",") if e.strip()],
+                           embed_batch_window=args.embed_batch_window, embed_batch_size=args.embed_batch_size, health_interval=args.health_interval,
+                           circuit_threshold=args.circuit_threshold, circuit_reset=args.circuit_reset, connect_timeout=args.connect_timeout, read_timeout=args.read_timeout,
+                           max_in_flight=args.max_in_flight, max_per_user=args.max_per_user, max_queue=args.max_queue, queue_timeout=args.queue_timeout,
+                           fair_weights={w.split(":")[0].strip(): float(w.split(":")[1]) for w in args.fair_weights.split(",") if ":" in w},
+                           log_queue_size=args.log_queue_size, log_overflow=args.log_overflow, access_log_file=access_log_file, log_format=args.log_format,
+                           log_max_size=args.log_max_size, log_rotate=args.log_rotate, log_keep=args.log_keep, access_index_file=access_index_file, log_index_days=args.log_index_days,
+                           users_reload=args.users_reload, routes_file=args.routes_file,
+                           device_interval=args.device_interval, device_history=args.device_history,
+                           dashboard_interval=args.dashboard_interval)
     #print("proxy after init()", proxy)
 
     # Display on terminal the state of application.
@@ -506,111 +1853,29 @@ if __name__ == "__main__":
     else:
         pytherminal.console(f"   Here the {len(proxy.users)} users who have an access token (listed in {user_file}) :", False)
         for user in proxy.users:
-            pytherminal.console(f"      {user.user_name.ljust(15, " ")}   [b]{user.user_type}[/b] ", False)
-
-    # Define the proxy server routes
-    @proxy.server.route('/info')
-    def info():
-        """ Serve the home page with localhost hardware informations & ollama server details (models available, models running, etc)"""
-        proxy.log_event("anonymous", "GET", "/info", 200, log_level=1)
-        return render_template('index.html', release=OLLAMA_PROXY_RELEASE)
-
-    @proxy.server.route("/info/ping",  methods=['GET', 'POST'])
-    def ping():
-        """ Ping the Ollama server to check if it's running and get user/token information """
-        user=proxy.get_user(proxy.get_token(request.headers))
-        ping=InfollamaPing(False, user)
-        try:
-            response = proxy.get("api/tags", request.headers)
-            if response:
-                ping.ping=True
-                ping.config=proxy.config
-                ping.ollama_version=proxy.ollama_version
-                proxy.get_ollama_version() # To update version number
-                return ping.to_dict()
-            else:
-                return ping.to_dict()
-        except requests.RequestException as e:
-            return ping.to_dict()
-    
-    @proxy.server.route("/info/device")
-    def info_device():
-        """ Get device information only to authorized users """
-        if proxy.check_user_access(request.headers, "info/device").is_authorised:
-            try:
-                proxy.device=device.get_device_info(proxy.config.log_file)
-            except Exception as e:
-                traceback.print_exc()
-                print("[b]Error get_device_info():[/b]", e)
-                print("[b]Try to update your install with this command:\n pip install -U pip setuptools wheel[/b]")
-                proxy.device=None
-
-            return proxy.device
-        else:
-            return abort(403)
-        
-    @proxy.server.route("/info/ps")
-    def info_ps():
-        """ Get running models with computed informations """
-        if proxy.check_user_access(request.headers, "info/ps").is_authorised:
-            return proxy.get_info_ps(request.headers)
-        else:
-            return abort(403)
-
-
-
-    @proxy.server.route('/favicon.ico', methods=['GET'])
-    def serveFavicon():
-        """ Serve the favicon.ico file (to avoid 404 errors)"""
-        return send_from_directory(os.path.join(appPath, 'static/picto'), 'infollama.png', mimetype='image/vnd.microsoft.icon')
-
-    @proxy.server.route('/robots.txt', methods=['GET'])
-    def serveRobots():
-        """ Serve the robots.txt file (to avoid 404 errors)"""
-        return "deny: all"
-
-    @proxy.server.route('/')
-    def home():
-        return proxy.get("", None, **request.args)
-    
-    @proxy.server.route('/<path:path>', methods=['GET', 'POST', 'OPTIONS'])
-    def catch_all(path):
-        """ Catch all routes and forward them to the ollama server """
-        if request.method == 'GET':
-            # A simple get request will be forwarded to the ollama server
-            return proxy.get(path, request.headers, **request.args)
-        elif request.method == 'POST':
-            # A POST request will be forwarded to the ollama server and must be streamed if stream parameter is set
-            if "stream" in request.json:
-                if request.json["stream"] is not False:
-                    url=proxy.create_url(path)
-                    return proxy.stream(path, request.headers, **request.args)
-                else:
-                    return proxy.post(path, request.headers, **request.args)
-            else:
-                #By default, the response will be returned as a stream
-                return proxy.stream(path, request.headers, **request.args)
-                
-
-        elif request.method == 'OPTIONS':
-            # Handle CORS preflight requests called by browsers on the frontend when cors origin must be checked
-            # Always accept CORS preflight requests called by browsers on the frontend when cors origin must be checked
-            if proxy.config.cors_policy=="*":
-                return '', 204 
-        else:
-            proxy.log_event("-", "POST", path, 405, log_level=9)
-            return "Method not allowed", 405
-
-    # Manage the streaming chat completions
-    def stream_request(method, url, **kwargs):
-        """ Stream a request to the ollama server with Flask """
-        with requests.request(method, url, stream=True, **kwargs) as r:
-            for chunk in r.iter_content(chunk_size=8192):
-                if chunk:
-                    yield chunk
-
+            pytherminal.console(f"      {user.user_name.ljust(15, ' ')}   [b]{user.user_type}[/b] ", False)
 
+    add_routes(proxy, appPath)
 
     # Starting the Flask proxy server with the specified host and port
     proxy.log_event(event=f"Proxy server starting on {args.host}:{args.port}", log_level=5)
-    proxy.server.run(host=args.host, port=tjs_port)
+    def serve(proxy, sock):
+        """ Serve the proxy in a pre-fork worker, on the listening socket shared by the supervisor """
+        if args.engine=="async":
+            aioproxy.run(proxy, host=args.host, port=args.port, release=OLLAMA_PROXY_RELEASE, app_path=appPath, sock=sock)
+        else:
+            from werkzeug.serving import make_server
+            make_server(args.host, int(args.port), proxy.server, threaded=True, fd=sock.fileno()).serve_forever()
+
+    if args.workers>1 and prefork.is_supported() is False:
+        pytherminal.console(f"[warning]Pre-fork mode (--workers) is not available on this OS: running one process[/warning]", False)
+    if args.workers>1 and prefork.is_supported():
+        prefork.run(proxy, host=args.host, port=args.port, workers=args.workers, serve=serve)
+    elif args.engine=="async":
+        proxy.health.start()
+        proxy.device_sampler.start()
+        aioproxy.run(proxy, host=args.host, port=args.port, release=OLLAMA_PROXY_RELEASE, app_path=appPath)
+    else:
+        proxy.health.start()
+        proxy.device_sampler.start()
+        proxy.server.run(host=args.host, port=tjs_port)
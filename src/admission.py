@@ -0,0 +1,237 @@
+"""
+Admission control in front of Ollama: a global and a per-user limit of calls in progress, and a weighted fair
+queue across users for the calls waiting for a slot. A user sending hundreds of parallel generations only
+gets its share of the slots, the other users are still served.
+Fair queueing: each queued call gets a virtual start tag, max(virtual time, last tag of the user) + 1/weight,
+and the waiting call with the smallest tag among the users under their limit is admitted first.
+With pre-fork workers, the calls in progress are counted in shared memory, so the limits apply to the whole proxy.
+Each worker keeps its own fair queue, and checks it again when another worker may have given a slot back.
+"""
+import contextlib
+import itertools
+import threading
+import time
+from collections import deque
+from src import sharedmem
+
+# Seconds between two checks of the queue of a pre-fork worker for the slots given back by the other workers
+POLL_INTERVAL=0.05
+
+
+class Ticket:
+    """One call waiting for, or holding, an admission slot"""
+    def __init__(self, user_name: str, endpoint: str, tag: float, notify):
+        self.user_name=user_name
+        self.endpoint=endpoint
+        self.tag=tag
+        self.notify=notify                  # called (from any thread) when the call is admitted
+        self.enqueued_at=time.perf_counter()
+        self.admitted_at=None
+        self.queue_depth=0                  # calls waiting when this one arrived
+        self.order=0
+
+    @property
+    def wait(self) -> float:
+        return (self.admitted_at or time.perf_counter())-self.enqueued_at
+
+
+class SharedSlots:
+    """Calls in progress in every pre-fork worker, counted per worker so the slots of a crashed worker can be given back.
+    Created by the supervisor before forking
+    """
+    def __init__(self, context, workers: int, size: int = 1024):
+        self.table=sharedmem.SharedTable(context, size, workers)
+        self.lock=self.table.lock
+
+    def count(self, name: str, default: int) -> int:
+        """Calls of name ("*" for every call) in progress in all the workers, default if the table is full (lock held)"""
+        offset=self.table.find(name)
+        if offset is None:
+            return default
+        return int(sum(self.table.values[offset:offset+self.table.width]))
+
+    def add(self, worker_id: int, name: str, delta: int) -> None:
+        """Count delta calls of name in progress in worker_id (lock held)"""
+        offset=self.table.find(name)
+        if offset is not None:
+            self.table.values[offset+worker_id]+=delta
+
+    def reset(self, worker_id: int) -> None:
+        """Give back the slots held by a worker that stopped"""
+        with self.lock:
+            for offset in self.table.used_rows():
+                self.table.values[offset+worker_id]=0
+
+
+class AdmissionController:
+    """Weighted fair admission of the calls sent to Ollama (thread-safe).
+    max_in_flight and max_per_user set to 0 mean unlimited.
+    """
+    def __init__(self, max_in_flight: int = 0, max_per_user: int = 0, max_queue: int = 1000, history: int = 200):
+        self.max_in_flight=max_in_flight
+        self.max_per_user=max_per_user
+        self.max_queue=max_queue
+        self.lock=threading.Lock()
+        self.queues: dict[str, deque[Ticket]]={}
+        self.waiting=0
+        self.in_flight=0
+        self.user_in_flight: dict[str, int]={}
+        self.last_tag: dict[str, float]={}
+        self.virtual_time=0.0
+        self.counter=itertools.count()
+        self.admitted=0
+        self.rejected=0
+        self.timeouts=0
+        self.wait_sum=0.0
+        self.wait_max=0.0
+        self.recent=deque(maxlen=history)
+        # Slots shared by the pre-fork workers, and the lock of their shared memory (taken after self.lock)
+        self.shared: SharedSlots|None=None
+        self.shared_lock=contextlib.nullcontext()
+        self.worker_id=0
+
+    def share(self, shared: SharedSlots, worker_id: int) -> None:
+        """Count the calls in the slots shared by the pre-fork workers. Called by worker worker_id after fork"""
+        self.shared=shared
+        self.shared_lock=shared.lock
+        self.worker_id=worker_id
+        threading.Thread(target=self.poll, name="infollama-admission", daemon=True).start()
+
+    def poll(self) -> None:
+        """Pre-fork worker thread: admit the waiting calls when another worker gives a slot back"""
+        while True:
+            time.sleep(POLL_INTERVAL)
+            if self.waiting>0:
+                with self.lock:
+                    admitted=self.dispatch()
+                for admitted_ticket in admitted:
+                    admitted_ticket.notify()
+
+    def is_free(self, user_name: str) -> bool:
+        """Return True if one more call of user_name can be sent now"""
+        in_flight=self.in_flight
+        user_in_flight=self.user_in_flight.get(user_name, 0)
+        if self.shared is not None:
+            in_flight=self.shared.count("*", in_flight)
+            user_in_flight=self.shared.count(f"user:{user_name}", user_in_flight)
+        if self.max_in_flight>0 and in_flight>=self.max_in_flight:
+            return False
+        return self.max_per_user<=0 or user_in_flight<self.max_per_user
+
+    def count_shared(self, user_name: str, delta: int) -> None:
+        """Count a call taking (1) or giving back (-1) a slot in the shared slots (shared lock held)"""
+        if self.shared is not None:
+            self.shared.add(self.worker_id, "*", delta)
+            self.shared.add(self.worker_id, f"user:{user_name}", delta)
+
+    def submit(self, user_name: str, endpoint: str, weight: float, notify) -> Ticket|None:
+        """Queue a call. notify() is called once it is admitted (at once if a slot is free).
+        Return None if the queue is full.
+        """
+        with self.lock:
+            if self.waiting>=self.max_queue>0:
+                self.rejected+=1
+                return None
+            tag=max(self.virtual_time, self.last_tag.get(user_name, 0.0))+1/max(weight, 0.01)
+            self.last_tag[user_name]=tag
+            ticket=Ticket(user_name, endpoint, tag, notify)
+            ticket.order=next(self.counter)
+            ticket.queue_depth=self.waiting
+            self.queues.setdefault(user_name, deque()).append(ticket)
+            self.waiting+=1
+            admitted=self.dispatch()
+        for admitted_ticket in admitted:
+            admitted_ticket.notify()
+        return ticket
+
+    def dispatch(self) -> list[Ticket]:
+        """Admit the waiting calls while slots are free, smallest tag first (called with the lock held)"""
+        admitted=[]
+        while self.waiting>0:
+            with self.shared_lock:
+                best=None
+                for user_name, queue in self.queues.items():
+                    if queue and self.is_free(user_name) and (best is None or (queue[0].tag, queue[0].order)<(best.tag, best.order)):
+                        best=queue[0]
+                if best is None:
+                    break
+                self.count_shared(best.user_name, 1)
+            self.queues[best.user_name].popleft()
+            if not self.queues[best.user_name]:
+                del self.queues[best.user_name]
+            self.waiting-=1
+            self.in_flight+=1
+            self.user_in_flight[best.user_name]=self.user_in_flight.get(best.user_name, 0)+1
+            self.virtual_time=max(self.virtual_time, best.tag)
+            best.admitted_at=time.perf_counter()
+            self.admitted+=1
+            self.wait_sum+=best.wait
+            self.wait_max=max(self.wait_max, best.wait)
+            self.recent.append({"user_name": best.user_name, "endpoint": best.endpoint, "time": time.time(),
+                                "queue_depth": best.queue_depth, "wait": best.wait})
+            admitted.append(best)
+        if self.waiting==0 and self.in_flight==0:
+            # Idle: tags restart from 0, so a user inactive for long does not get an old low tag
+            self.virtual_time=0.0
+            self.last_tag.clear()
+        return admitted
+
+    def cancel(self, ticket: Ticket) -> bool:
+        """Remove a call that waited too long. Return False if it was admitted meanwhile (it must then be released)"""
+        with self.lock:
+            queue=self.queues.get(ticket.user_name)
+            if ticket.admitted_at is not None or queue is None or ticket not in queue:
+                return False
+            queue.remove(ticket)
+            if not queue:
+                del self.queues[ticket.user_name]
+            self.waiting-=1
+            self.timeouts+=1
+            return True
+
+    def release(self, ticket: Ticket) -> None:
+        """The admitted call is finished: give its slot to the next waiting call"""
+        with self.lock:
+            with self.shared_lock:
+                self.count_shared(ticket.user_name, -1)
+            self.in_flight-=1
+            count=self.user_in_flight.get(ticket.user_name, 1)-1
+            if count>0:
+                self.user_in_flight[ticket.user_name]=count
+            else:
+                self.user_in_flight.pop(ticket.user_name, None)
+            admitted=self.dispatch()
+        for admitted_ticket in admitted:
+            admitted_ticket.notify()
+
+    def acquire(self, user_name: str, endpoint: str, weight: float = 1, timeout: float|None = None) -> Ticket|None:
+        """Wait (blocking the thread) until the call is admitted. Return None if the queue is full or on timeout"""
+        event=threading.Event()
+        ticket=self.submit(user_name, endpoint, weight, event.set)
+        if ticket is None:
+            return None
+        if not event.wait(timeout) and self.cancel(ticket):
+            return None
+        return ticket
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            in_flight=self.in_flight
+            if self.shared is not None:
+                with self.shared_lock:
+                    in_flight=self.shared.count("*", in_flight)
+            return {
+                "max_in_flight": self.max_in_flight,
+                "max_per_user": self.max_per_user,
+                "in_flight": in_flight,
+                "worker_in_flight": self.in_flight,
+                "queue_depth": self.waiting,
+                "users_in_flight": dict(self.user_in_flight),
+                "users_queued": {user_name: len(queue) for user_name, queue in self.queues.items()},
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "avg_wait": self.wait_sum/self.admitted if self.admitted else None,
+                "max_wait": self.wait_max,
+                "recent": list(self.recent)
+            }
@@ -0,0 +1,452 @@
+"""
+Asyncio web engine for the Infollama proxy, an alternative to the Flask development server.
+It serves the same routes with the same access rules. Streams are forwarded with non-blocking aiohttp I/O,
+so a token stream waiting on Ollama costs a coroutine instead of a thread.
+Short non streamed calls reuse the InfollamaProxy forwarding code in a bounded thread pool.
+"""
+import asyncio
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import render_template
+from src import pytherminal
+from src import streaming
+from src import dashboard
+
+try:
+    import aiohttp
+    from aiohttp import web
+except ImportError:
+    aiohttp = None
+
+
+class AioProxy:
+    """aiohttp application serving an InfollamaProxy"""
+    def __init__(self, proxy, release: str, app_path: str):
+        self.proxy=proxy
+        self.release=release
+        self.app_path=app_path
+        self.session=None
+        # Blocking calls (non streamed forwards, hardware scan) run here, never in the event loop
+        self.executor=ThreadPoolExecutor(max_workers=max(proxy.config.pool_size, 4), thread_name_prefix="infollama")
+        with proxy.server.test_request_context("/info"):
+            self.index_html=render_template('index.html', release=release)
+
+    def create_app(self):
+        """Create the aiohttp application with the proxy routes"""
+        app=web.Application(client_max_size=1024**3)
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
+        app.on_response_prepare.append(self.add_cors_headers)
+        app.router.add_get('/info', self.info)
+        app.router.add_route('*', '/info/ping', self.ping)
+        app.router.add_get('/info/snapshot', self.info_snapshot)
+        app.router.add_get('/info/events', self.info_events)
+        app.router.add_get('/info/device', self.info_device)
+        app.router.add_get('/info/device/history', self.info_device_history)
+        app.router.add_get('/info/ps', self.info_ps)
+        app.router.add_get('/info/admin_api/pool', self.info_admin_pool)
+        app.router.add_get('/info/admin_api/streams', self.info_admin_streams)
+        app.router.add_get('/info/admin_api/queue', self.info_admin_queue)
+        app.router.add_route('*', '/info/admin_api/cache', self.info_admin_cache)
+        app.router.add_route('*', '/info/admin_api/usage', self.info_admin_usage)
+        app.router.add_get('/info/admin_api/logs', self.info_admin_logs)
+        app.router.add_get('/metrics', self.serve_metrics)
+        app.router.add_get('/favicon.ico', self.favicon)
+        app.router.add_get('/robots.txt', self.robots)
+        app.router.add_static('/static', os.path.join(self.app_path, 'static'))
+        app.router.add_get('/', self.home)
+        app.router.add_route('*', '/{path:.*}', self.catch_all)
+        return app
+
+    async def on_startup(self, app) -> None:
+        keep_alive=self.proxy.config.keep_alive
+        if keep_alive>0:
+            connector=aiohttp.TCPConnector(limit=0, keepalive_timeout=keep_alive)
+        else:
+            connector=aiohttp.TCPConnector(limit=0, force_close=True)
+        # No total timeout: a generation can last minutes, but a dead or hung backend fails after the connect/read timeouts
+        config=self.proxy.config
+        self.session=aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=None, sock_connect=config.connect_timeout, sock_read=config.read_timeout))
+
+    async def on_cleanup(self, app) -> None:
+        await self.session.close()
+        self.executor.shutdown(wait=False)
+
+    async def add_cors_headers(self, request, response) -> None:
+        """Same CORS policy as flask_cors in the Flask engine"""
+        cors_policy=self.proxy.config.cors_policy
+        if cors_policy=="" or cors_policy is None:
+            return
+        response.headers["Access-Control-Allow-Origin"]=cors_policy
+        if request.method=="OPTIONS":
+            response.headers["Access-Control-Allow-Methods"]="GET, POST, OPTIONS"
+            response.headers["Access-Control-Allow-Headers"]=request.headers.get("Access-Control-Request-Headers", "*")
+
+    async def run_blocking(self, func, *args, **kwargs):
+        """Run a blocking proxy function in the thread pool"""
+        loop=asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def to_response(self, response):
+        """Convert an InfollamaResponse into an aiohttp response, with the upstream raw body"""
+        return web.Response(body=response.body, status=response.status, headers={"Content-Type": response.content_type, **response.headers})
+
+    async def info(self, request):
+        """ Serve the home page """
+        self.proxy.log_event("anonymous", "GET", "/info", 200, log_level=1, ip=request.remote)
+        return web.Response(text=self.index_html, content_type="text/html")
+
+    async def ping(self, request):
+        """ Ping the Ollama server to check if it's running and get user/token information """
+        return web.json_response(await self.run_blocking(self.proxy.ping, request.headers, ip=request.remote))
+
+    async def info_snapshot(self, request):
+        """ Get the ping, models, running models and device in one call, 304 if unchanged since the ETag of If-None-Match """
+        response=await self.run_blocking(self.proxy.get_dashboard_snapshot, request.headers, request.headers.get("If-None-Match"))
+        if response.status==304:
+            return web.Response(status=304, headers=response.headers)
+        return self.to_response(response)
+
+    async def info_events(self, request):
+        """ Push the dashboard updates (ping, models, running models, device) as Server-Sent Events """
+        if not self.proxy.check_user_access(self.proxy.get_event_headers(request.headers, request.cookies), "info/events").is_authorised:
+            return web.Response(status=403, text="Forbidden")
+        if self.proxy.dashboard is None:
+            return web.Response(status=404, text="Not Found")
+        loop=asyncio.get_running_loop()
+        changed=asyncio.Event()
+        subscription=self.proxy.dashboard.subscribe(lambda: loop.call_soon_threadsafe(changed.set))
+        response=web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        try:
+            await response.prepare(request)
+            await response.write(dashboard.format_retry())
+            while True:
+                for name, body in self.proxy.dashboard.get_changes(subscription):
+                    await response.write(dashboard.format_event(name, body))
+                try:
+                    await asyncio.wait_for(changed.wait(), dashboard.KEEP_ALIVE)
+                except asyncio.TimeoutError:
+                    await response.write(dashboard.format_keep_alive())
+                changed.clear()
+        except ConnectionResetError:
+            # Page closed
+            return response
+        finally:
+            self.proxy.dashboard.unsubscribe(subscription)
+
+    async def info_device(self, request):
+        """ Get device information only to authorized users """
+        if self.proxy.check_user_access(request.headers, "info/device").is_authorised:
+            if self.proxy.device_sampler.is_running():
+                return web.Response(body=self.proxy.get_info_device_body(), content_type="application/json")
+            return web.Response(body=await self.run_blocking(self.proxy.get_info_device_body), content_type="application/json")
+        return web.Response(status=403, text="Forbidden")
+
+    async def info_device_history(self, request):
+        """ Get the device telemetry of a time range, downsampled to a number of points, only to authorized users """
+        if self.proxy.check_user_access(request.headers, "info/device/history").is_authorised:
+            if self.proxy.device_sampler.history is None:
+                return web.json_response({"error": "The device history is disabled"}, status=404)
+            try:
+                return web.json_response(await self.run_blocking(self.proxy.get_device_history, dict(request.query)))
+            except ValueError as e:
+                return web.json_response({"error": str(e)}, status=400)
+        return web.Response(status=403, text="Forbidden")
+
+    async def info_ps(self, request):
+        """ Get running models with computed informations """
+        if self.proxy.check_user_access(request.headers, "info/ps").is_authorised:
+            return web.json_response(await self.run_blocking(self.proxy.get_info_ps, request.headers, ip=request.remote))
+        return web.Response(status=403, text="Forbidden")
+
+    async def info_admin_pool(self, request):
+        """ Get the upstream connection pool statistics (admin only) """
+        if self.proxy.check_user_access(request.headers, "info/admin_api/").is_authorised:
+            return web.json_response(self.proxy.get_pool_stats())
+        return web.Response(status=403, text="Forbidden")
+
+    async def info_admin_streams(self, request):
+        """ Get the time-to-first-byte and time-to-first-token of the last streams (admin only) """
+        if self.proxy.check_user_access(request.headers, "info/admin_api/").is_authorised:
+            return web.json_response(self.proxy.get_stream_stats())
+        return web.Response(status=403, text="Forbidden")
+
+    async def info_admin_queue(self, request):
+        """ Get the admission control state: calls in progress and queued per user, queue depth and wait times (admin only) """
+        if self.proxy.check_user_access(request.headers, "info/admin_api/").is_authorised:
+            return web.json_response(self.proxy.get_admission_stats())
+        return web.Response(status=403, text="Forbidden")
+
+    async def info_admin_cache(self, request):
+        """ Get the response cache statistics, or clear the caches with a POST (admin only) """
+        if self.proxy.check_user_access(request.headers, "info/admin_api/").is_authorised:
+            if request.method=="POST":
+                # Clearing the embedding cache replaces its disk file
+                await self.run_blocking(self.proxy.clear_caches)
+            return web.json_response(self.proxy.get_cache_stats())
+        return web.Response(status=403, text="Forbidden")
+
+    async def info_admin_usage(self, request):
+        """ Get the token usage per user and per model, or reset it with a POST (admin only) """
+        if self.proxy.check_user_access(request.headers, "info/admin_api/").is_authorised:
+            if request.method=="POST":
+                self.proxy.usage_stats.clear()
+            return web.json_response(self.proxy.get_usage_stats())
+        return web.Response(status=403, text="Forbidden")
+
+    async def info_admin_logs(self, request):
+        """ Query the access log by user, endpoint, model, status and time range, with paging, or get totals with group_by (admin only) """
+        if self.proxy.check_user_access(request.headers, "info/admin_api/").is_authorised:
+            if self.proxy.log_index is None:
+                return web.json_response({"error": "The access log index is disabled"}, status=404)
+            try:
+                return web.json_response(await self.run_blocking(self.proxy.query_logs, dict(request.query)))
+            except ValueError as e:
+                return web.json_response({"error": str(e)}, status=400)
+        return web.Response(status=403, text="Forbidden")
+
+    async def serve_metrics(self, request):
+        """ Get the proxy metrics in the Prometheus text format (admin only) """
+        if self.proxy.check_user_access(request.headers, "info/admin_api/").is_authorised:
+            return web.Response(body=self.proxy.get_metrics().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+        return web.Response(status=403, text="Forbidden")
+
+    async def favicon(self, request):
+        return web.FileResponse(os.path.join(self.app_path, 'static/picto', 'infollama.png'), headers={"Content-Type": "image/vnd.microsoft.icon"})
+
+    async def robots(self, request):
+        return web.Response(text="deny: all")
+
+    async def home(self, request):
+        return web.Response(text="<script>window.location.href='/info';</script>", content_type="text/html")
+
+    async def catch_all(self, request):
+        """ Catch all routes and forward them to the ollama server """
+        path=request.match_info["path"]
+        if request.method=="GET":
+            response=await self.run_blocking(self.proxy.forward, "GET", path, request.headers, params=dict(request.query), ip=request.remote)
+            return self.to_response(response)
+        elif request.method=="POST":
+            try:
+                data=await request.json()
+            except ValueError:
+                return web.Response(status=400, text="Bad Request")
+            # A POST request must be streamed, unless the stream parameter is set to false
+            if not self.proxy.is_streamed(path, data):
+                ticket=None
+                access=None
+                if self.proxy.needs_admission("POST", path):
+                    # Check the access and the rate limits, then wait for the admission slot here, not in a thread of the pool
+                    started=time.perf_counter()
+                    access=self.proxy.authorize("POST", path, request.headers, event=data.__str__(), ip=request.remote)
+                    if access.is_authorised is False:
+                        denied=self.proxy.get_denied_response(access)
+                        self.proxy.record_request(access, "POST", path, denied.status, started, request.content_length or 0, model=self.proxy.get_model_name(data))
+                        return self.to_response(denied)
+                    ticket=await self.admit(access, path, request.remote)
+                    if ticket is None:
+                        self.proxy.record_request(access, "POST", path, 429, started, request.content_length or 0, model=self.proxy.get_model_name(data))
+                        return self.to_response(self.proxy.get_rejected_response())
+                response=await self.run_blocking(self.proxy.forward, "POST", path, request.headers, json_data=data, params=dict(request.query), ip=request.remote, ticket=ticket, 
+                                                 size=request.content_length or 0, access=access)
+                return self.to_response(response)
+            return await self.stream(request, path, data)
+        elif request.method=="OPTIONS":
+            if self.proxy.config.cors_policy=="*":
+                return web.Response(status=204)
+        self.proxy.log_event("-", request.method, path, 405, log_level=9, ip=request.remote)
+        return web.Response(status=405, text="Method not allowed")
+
+    async def admit(self, access, path: str, ip):
+        """Wait for an admission slot without blocking the event loop. Return None if the call is rejected"""
+        loop=asyncio.get_running_loop()
+        admitted=loop.create_future()
+        def notify():
+            loop.call_soon_threadsafe(lambda: admitted.done() or admitted.set_result(True))
+        controller=self.proxy.admission
+        ticket=controller.submit(access.user_name, path, self.proxy.get_admission_weight(access), notify)
+        if ticket is not None and not admitted.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(admitted), self.proxy.config.queue_timeout)
+            except asyncio.TimeoutError:
+                if controller.cancel(ticket):
+                    ticket=None
+            except asyncio.CancelledError:
+                # Client gone while waiting: give the slot back if it was given meanwhile
+                if not controller.cancel(ticket):
+                    controller.release(ticket)
+                raise
+        self.proxy.log_admission(access, path, ticket, ip)
+        return ticket
+
+    async def stream(self, request, path: str, data):
+        """Transmit and listen to a stream without blocking a thread"""
+        started=time.perf_counter()
+        access=self.proxy.authorize("STREAM", path, request.headers, event=data.__str__(), ip=request.remote)
+        if access.is_authorised is False:
+            denied=self.proxy.get_denied_response(access)
+            self.proxy.record_request(access, "STREAM", path, denied.status, started, request.content_length or 0, model=self.proxy.get_model_name(data))
+            if access.retry_after>0:
+                return self.to_response(denied)
+            return web.Response(status=403, text="Forbidden")
+
+        generation_key=None
+        if self.proxy.generation_cache is not None:
+            # The model digest is read from the metadata cache, which calls Ollama when it expired: never in the event loop
+            generation_key=await self.run_blocking(self.proxy.get_generation_cache_key, path, data, access.user_name)
+        model=self.proxy.get_model_name(data)
+        timer=streaming.StreamTimer(path, access.user_name, model, access.user_type, access.request_id, access.ip)
+        timer.request_bytes=request.content_length or 0
+        if generation_key is not None:
+            cached=self.proxy.generation_cache.get(generation_key)
+            if cached is not None:
+                return await self.replay(request, cached, timer)
+
+        ticket=None
+        if self.proxy.needs_admission("POST", path):
+            ticket=await self.admit(access, path, request.remote)
+            if ticket is None:
+                self.proxy.record_request(access, "STREAM", path, 429, started, timer.request_bytes, model=model)
+                return self.to_response(self.proxy.get_rejected_response())
+            timer.queue_wait=ticket.wait
+        try:
+            upstream, backend=await self.connect(request, path, model, data)
+        except BaseException:
+            self.proxy.release_ticket(ticket)
+            raise
+        if upstream is None:
+            self.proxy.release_ticket(ticket)
+            self.proxy.record_request(access, "STREAM", path, backend.status, started, timer.request_bytes, model=model)
+            return backend
+
+        if upstream.status==200:
+            self.proxy.backends.mark_loaded(backend, model)
+        async with upstream:
+            content_type=upstream.headers.get("Content-Type", request.content_type)
+            timer.on_connect(content_type, upstream.status)
+            response=web.StreamResponse(status=upstream.status, headers={"Content-Type": content_type, "Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+            splitter=streaming.FrameSplitter(timer.sse) if self.proxy.config.stream_mode=="lines" else None
+            recorder=[] if generation_key is not None and upstream.status==200 else None
+            self.proxy.metrics.stream_started()
+            try:
+                await response.prepare(request)
+                async for chunk in upstream.content.iter_any():
+                    timer.on_data(chunk)
+                    if splitter is not None:
+                        chunk=splitter.feed(chunk)
+                        if not chunk:
+                            continue
+                    timer.on_frames(chunk)
+                    if recorder is not None:
+                        recorder.append(chunk)
+                    # write() sends the frame to the transport and waits if the client reads slower
+                    await response.write(chunk)
+                if splitter is not None:
+                    rest=splitter.flush()
+                    if rest:
+                        timer.on_frames(rest)
+                        if recorder is not None:
+                            recorder.append(rest)
+                        await response.write(rest)
+                if recorder is not None:
+                    self.proxy.store_generation(generation_key, recorder, timer)
+            except (ConnectionResetError, aiohttp.ClientError) as e:
+                # Client gone or upstream broken: the upstream connection is released by the context manager
+                pytherminal.console(f"AioProxy.stream() [error]{e}[/error]")
+                return response
+            finally:
+                backend.release()
+                self.proxy.release_ticket(ticket)
+                self.proxy.record_usage(timer.user_name, timer.model, timer.endpoint, timer.usage)
+                self.proxy.record_stream(timer)
+                self.proxy.invalidate_metadata_cache(path)
+            await response.write_eof()
+        return response
+
+
+    async def connect(self, request, path: str, model, data):
+        """Open the upstream stream on the chosen backend, or on the next one if it can not be reached.
+        Return (upstream response, backend), or (None, error response)
+        """
+        failed=[]
+        while True:
+            # Choosing a backend may read its api/ps: never in the event loop
+            choice=asyncio.ensure_future(self.run_blocking(self.proxy.backends.choose, model, exclude=failed))
+            try:
+                backend=await asyncio.shield(choice)
+            except asyncio.CancelledError:
+                # Client gone while choosing: the half-open trial claimed by the choice goes to the next call
+                choice.add_done_callback(abort_choice)
+                raise
+            if backend is None:
+                return None, web.Response(status=503, text="Service Unavailable")
+            url=self.proxy.create_url(path, backend)
+            backend.acquire()
+            try:
+                connect_timeout, read_timeout=self.proxy.get_timeout(path)
+                upstream=await self.session.post(url, json=data, params=dict(request.query), 
+                                                 timeout=aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout))
+                backend.breaker.on_success()
+                return upstream, backend
+            except aiohttp.ClientConnectionError as e:
+                # The call did not reach this backend: try the next one
+                backend.release()
+                backend.breaker.on_failure()
+                failed.append(backend)
+                pytherminal.console(f"AioProxy.stream() [error]{backend.base_url}: {e}[/error]")
+            except asyncio.TimeoutError as e:
+                backend.release()
+                backend.breaker.on_failure()
+                pytherminal.console(f"AioProxy.stream() [error]{backend.base_url}: timeout[/error]")
+                return None, web.Response(status=504, text="Gateway Timeout")
+            except aiohttp.ClientError as e:
+                backend.release()
+                backend.breaker.on_failure()
+                pytherminal.console(f"AioProxy.stream() [error]{e}[/error]")
+                return None, web.Response(status=500, text="Internal Server Error")
+            except BaseException:
+                # Client gone while connecting: the trial of a half-open circuit goes to the next call
+                backend.release()
+                backend.breaker.on_abort()
+                raise
+
+    async def replay(self, request, cached, timer: streaming.StreamTimer):
+        """Replay a stream stored in the generation cache, frame by frame with its original framing.
+        Counted in the metrics and in the access log like a forwarded stream
+        """
+        timer.on_connect(cached.content_type, cached.status)
+        response=web.StreamResponse(status=cached.status, headers={"Content-Type": cached.content_type, "Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        self.proxy.metrics.stream_started()
+        try:
+            await response.prepare(request)
+            for frame in streaming.iter_frames(cached.body, timer.sse):
+                timer.on_data(frame)
+                timer.on_frames(frame)
+                await response.write(frame)
+            await response.write_eof()
+        except ConnectionResetError:
+            # Client gone
+            pass
+        finally:
+            self.proxy.record_stream(timer)
+        return response
+
+
+def abort_choice(choice) -> None:
+    """Give back the half-open trial of a backend chosen for a call that was cancelled"""
+    if not choice.cancelled() and choice.exception() is None and choice.result() is not None:
+        choice.result().breaker.on_abort()
+
+
+def run(proxy, host, port, release: str, app_path: str, sock=None) -> None:
+    """Serve the proxy with the asyncio engine, on host:port or on an already listening socket (pre-fork workers)"""
+    if aiohttp is None:
+        pytherminal.console("[error]The asyncio engine needs aiohttp. Install it with this command:\n pip install aiohttp[/error]", False)
+        return
+    app=AioProxy(proxy, release, app_path).create_app()
+    if sock is not None:
+        web.run_app(app, sock=sock, print=None, access_log=None, handle_signals=False)
+    else:
+        web.run_app(app, host=host, port=int(port), print=None, access_log=None)
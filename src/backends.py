@@ -0,0 +1,178 @@
+"""
+Several Ollama backends behind one proxy. Each call for a model is routed to a backend that has the model
+installed, preferring a backend where the model is already loaded in memory (api/ps), then the backend
+with the fewest outstanding requests. Backends whose circuit breaker is open are skipped.
+"""
+import threading
+import time
+from src import health
+
+
+def normalize_model(model: str) -> str:
+    """Ollama names without a tag are the :latest tag"""
+    return model if ":" in model else model+":latest"
+
+
+class Backend:
+    """One Ollama server, with the models it holds, the number of requests in progress and its health"""
+    def __init__(self, base_url: str, failure_threshold: int = 3, reset_timeout: float = 30):
+        self.base_url=base_url
+        self.breaker=health.CircuitBreaker(failure_threshold, reset_timeout)
+        self.health="unknown"                   # up, degraded or down, set by the HealthChecker
+        self.error=None
+        self.latency=None
+        self.version=None
+        self.checked_at=None
+        self.lock=threading.Lock()
+        self.outstanding=0
+        self.requests=0
+        self.installed: set[str]|None=None      # None while unknown
+        self.loaded: set[str]=set()
+        self.installed_at=0.0
+        self.loaded_at=0.0
+
+    def acquire(self) -> None:
+        with self.lock:
+            self.outstanding+=1
+            self.requests+=1
+
+    def release(self) -> None:
+        with self.lock:
+            self.outstanding-=1
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "base_url": self.base_url,
+                "outstanding": self.outstanding,
+                "requests": self.requests,
+                "installed": sorted(self.installed) if self.installed is not None else None,
+                "loaded": sorted(self.loaded),
+                **self.get_health()
+            }
+
+    def get_health(self) -> dict:
+        return {
+            "base_url": self.base_url,
+            "health": self.health,
+            "circuit": self.breaker.to_dict(),
+            "latency": self.latency,
+            "version": self.version,
+            "checked_at": self.checked_at,
+            "error": self.error
+        }
+
+
+class BackendPool:
+    """Choose the backend of each call (thread-safe).
+    fetch(backend, endpoint) must return the parsed JSON answer of a GET call to that backend, or None on error.
+    """
+    def __init__(self, base_urls: list[str], fetch, loaded_ttl: float = 2, installed_ttl: float = 30, failure_threshold: int = 3, reset_timeout: float = 30):
+        self.backends=[Backend(base_url, failure_threshold, reset_timeout) for base_url in base_urls]
+        self.fetch=fetch
+        self.loaded_ttl=loaded_ttl
+        self.installed_ttl=installed_ttl
+        self.refresh_lock=threading.Lock()
+
+    def __len__(self):
+        return len(self.backends)
+
+    def __iter__(self):
+        return iter(self.backends)
+
+    def refresh(self) -> None:
+        """Read again the installed (api/tags) and loaded (api/ps) models of the backends when they are too old.
+        Only one thread refreshes, the others use the current values.
+        """
+        if not self.refresh_lock.acquire(blocking=False):
+            return
+        try:
+            now=time.monotonic()
+            for backend in self.available():
+                if now-backend.installed_at>self.installed_ttl:
+                    tags=self.fetch(backend, "api/tags")
+                    with backend.lock:
+                        backend.installed={model.get("name") for model in tags.get("models", [])} if tags is not None else None
+                        backend.installed_at=now
+                if now-backend.loaded_at>self.loaded_ttl:
+                    ps=self.fetch(backend, "api/ps")
+                    with backend.lock:
+                        backend.loaded={model.get("name") for model in ps.get("models", [])} if ps is not None else set()
+                        backend.loaded_at=now
+        finally:
+            self.refresh_lock.release()
+
+    def available(self) -> list[Backend]:
+        """Return the backends that can receive a call (circuit closed, or ready for a half-open trial)"""
+        return [backend for backend in self.backends if backend.breaker.is_available()]
+
+    def choose(self, model=None, exclude=()) -> Backend|None:
+        """Return the backend that should answer a call for model (any backend if model is None),
+        or None if every backend is down. Backends in exclude already failed for this call.
+        """
+        if len(self.backends)==1:
+            backend=self.backends[0]
+            return backend if backend not in exclude and backend.breaker.allow() else None
+        self.refresh()
+        candidates=[backend for backend in self.available() if backend not in exclude]
+        while candidates:
+            backend=self.rank(candidates, model)
+            if backend.breaker.allow():
+                return backend
+            candidates.remove(backend)
+        return None
+
+    def rank(self, candidates: list[Backend], model) -> Backend:
+        """Return the best candidate for model: model installed, then loaded, then fewest outstanding requests"""
+        if isinstance(model, str):
+            model=normalize_model(model)
+            holding=[backend for backend in candidates if backend.installed is not None and model in backend.installed]
+            if holding:
+                candidates=holding
+            loaded=[backend for backend in candidates if model in backend.loaded]
+            if loaded:
+                candidates=loaded
+        return min(candidates, key=lambda backend: backend.outstanding)
+
+    def holding(self, model) -> list[Backend]:
+        """Return the available backends where model is installed (every available backend if unknown)"""
+        available=self.available()
+        if not isinstance(model, str) or len(self.backends)==1:
+            return available
+        self.refresh()
+        model=normalize_model(model)
+        holding=[backend for backend in available if backend.installed is not None and model in backend.installed]
+        return holding or available
+
+    def mark_loaded(self, backend: Backend, model) -> None:
+        """A call for model succeeded on backend: the model is now loaded there"""
+        if isinstance(model, str):
+            with backend.lock:
+                backend.loaded.add(normalize_model(model))
+
+    def forget(self) -> None:
+        """Read the models of every backend again on the next call (after a model was created, copied, deleted or pulled)"""
+        for backend in self.backends:
+            with backend.lock:
+                backend.installed_at=0.0
+                backend.loaded_at=0.0
+
+    def get_stats(self) -> list[dict]:
+        return [backend.to_dict() for backend in self.backends]
+
+    def get_health(self) -> list[dict]:
+        return [backend.get_health() for backend in self.backends]
+
+
+def merge_tags(answers: list[dict]) -> dict:
+    """Merge the api/tags answers of several backends: each model name is listed once"""
+    models={}
+    for answer in answers:
+        for model in answer.get("models", []):
+            models.setdefault(model.get("name"), model)
+    return {"models": list(models.values())}
+
+
+def merge_ps(answers: list[dict]) -> dict:
+    """Merge the api/ps answers of several backends: every loaded model of every backend"""
+    return {"models": [model for answer in answers for model in answer.get("models", [])]}
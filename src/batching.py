@@ -0,0 +1,147 @@
+"""
+Micro-batching of small embedding requests: concurrent api/embed or v1/embeddings calls for the same model
+and options are collected for a few milliseconds, sent to Ollama as one call, then split back per request.
+If the batched call fails, each request is sent again alone, so one bad input never fails its neighbours.
+"""
+import json
+import threading
+
+
+class Batch:
+    """Requests collected for one upstream call"""
+    def __init__(self):
+        self.items: list[list[str]]=[]       # inputs of each request, in order of arrival
+        self.size=0
+        self.full=threading.Event()
+        self.done=threading.Event()
+        self.results=None                   # per request answers, or None if the batched call failed
+
+
+class EmbeddingBatcher:
+    """Collect concurrent embedding requests and send them as one call (thread-safe).
+    send(endpoint, json_data, params) must return an InfollamaResponse-like object (status, json()),
+    respond(answer) builds the response of one request from its answer dict.
+    """
+    def __init__(self, send, respond, window_ms: float = 5, max_inputs: int = 64):
+        self.send=send
+        self.respond=respond
+        self.window=window_ms/1000
+        self.max_inputs=max_inputs
+        self.lock=threading.Lock()
+        self.pending: dict[tuple, Batch]={}
+        self.batches=0
+        self.requests=0
+        self.fallbacks=0
+
+    def get_batch_key(self, endpoint, json_data, params) -> tuple|None:
+        """Requests can share a batch if they only differ by their inputs. None if the request can not be batched"""
+        if not isinstance(json_data, dict):
+            return None
+        inputs=json_data.get("input")
+        if isinstance(inputs, str):
+            inputs=[inputs]
+        if (not isinstance(inputs, list) or len(inputs)==0 or len(inputs)>=self.max_inputs
+                or not all(isinstance(text, str) for text in inputs) or json_data.get("encoding_format", "float")!="float"):
+            return None
+        options=json.dumps({k: v for k, v in json_data.items() if k!="input"}, sort_keys=True)
+        return (endpoint, options, tuple(sorted((params or {}).items())))
+
+    def embed(self, endpoint, json_data, params=None):
+        """Return the answer of one request, sent to Ollama in a batch with the concurrent requests"""
+        key=self.get_batch_key(endpoint, json_data, params)
+        if key is None:
+            return self.send(endpoint, json_data, params)
+        inputs=json_data["input"] if isinstance(json_data["input"], list) else [json_data["input"]]
+
+        with self.lock:
+            self.requests+=1
+            batch=self.pending.get(key)
+            leader=batch is None
+            if leader:
+                batch=Batch()
+                self.pending[key]=batch
+            position=len(batch.items)
+            batch.items.append(inputs)
+            batch.size+=len(inputs)
+            if batch.size>=self.max_inputs:
+                # Closed: the next requests start a new batch
+                del self.pending[key]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self.lock:
+                if self.pending.get(key) is batch:
+                    del self.pending[key]
+                self.batches+=1
+            try:
+                batch.results=self.send_batch(endpoint, json_data, params, batch.items)
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.results is None:
+            # Error isolation: the request is sent alone and gets its own answer
+            return self.send(endpoint, json_data, params)
+        return batch.results[position]
+
+    def send_batch(self, endpoint, json_data, params, items: list[list[str]]) -> list|None:
+        """Send all the inputs in one call and return the answer of each request, None if the call failed"""
+        if len(items)==1:
+            return [self.send(endpoint, json_data, params)]
+        batch_request=dict(json_data)
+        batch_request["input"]=[text for inputs in items for text in inputs]
+        response=self.send(endpoint, batch_request, params)
+        try:
+            if response.status!=200:
+                raise ValueError(f"status {response.status}")
+            answer=response.json()
+            if endpoint=="v1/embeddings":
+                vectors=[item.get("embedding") for item in sorted(answer.get("data", []), key=lambda item: item.get("index", 0))]
+            else:
+                vectors=answer.get("embeddings", [])
+            if len(vectors)!=len(batch_request["input"]):
+                raise ValueError(f"{len(vectors)} vectors for {len(batch_request['input'])} inputs")
+        except (ValueError, AttributeError):
+            with self.lock:
+                self.fallbacks+=1
+            return None
+        return [self.respond(answer) for answer in split_answer(endpoint, json_data, answer, items, vectors)]
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "batches": self.batches,
+                "avg_batch_size": self.requests/self.batches if self.batches else None,
+                "fallbacks": self.fallbacks,
+                "window_ms": self.window*1000,
+                "max_inputs": self.max_inputs
+            }
+
+
+def split_answer(endpoint, json_data, answer, items: list[list[str]], vectors: list) -> list[dict]:
+    """Build the answer of each request from the batched answer.
+    Token counts are shared between the requests in proportion of the length of their inputs.
+    """
+    lengths=[sum(len(text) for text in inputs) or 1 for inputs in items]
+    total_length=sum(lengths)
+    if endpoint=="v1/embeddings":
+        tokens=answer.get("usage", {}).get("prompt_tokens", 0)
+    else:
+        tokens=answer.get("prompt_eval_count", 0)
+    answers=[]
+    start=0
+    shared_tokens=0
+    for i, inputs in enumerate(items):
+        request_vectors=vectors[start:start+len(inputs)]
+        start+=len(inputs)
+        request_tokens=tokens-shared_tokens if i==len(items)-1 else round(tokens*lengths[i]/total_length)
+        shared_tokens+=request_tokens
+        if endpoint=="v1/embeddings":
+            answers.append({"object": "list", "data": [{"object": "embedding", "embedding": vector, "index": j} for j, vector in enumerate(request_vectors)],
+                            "model": answer.get("model", json_data.get("model")), "usage": {"prompt_tokens": request_tokens, "total_tokens": request_tokens}})
+        else:
+            answers.append({"model": answer.get("model", json_data.get("model")), "embeddings": request_vectors, "prompt_eval_count": request_tokens})
+    return answers
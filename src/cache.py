@@ -0,0 +1,115 @@
+"""
+In-memory caches used by the proxy to avoid sending the same read-only calls to Ollama again and again.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Bounded LRU cache where each entry expires after its own time-to-live (thread-safe)"""
+    def __init__(self, max_size: int = 256):
+        self.max_size=max_size
+        self.entries=OrderedDict()          # key -> (expires_at, value)
+        self.lock=threading.Lock()
+        self.hits=0
+        self.misses=0
+        self.invalidations=0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Return the value stored for key, or None if missing or expired"""
+        with self.lock:
+            entry=self.entries.get(key)
+            if entry is None or entry[0]<time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses+=1
+                return None
+            self.entries.move_to_end(key)
+            self.hits+=1
+            return entry[1]
+
+    def set(self, key, value, ttl: float) -> None:
+        """Store value for ttl seconds, evicting the least recently used entries if the cache is full"""
+        if self.max_size<=0 or ttl<=0:
+            return
+        with self.lock:
+            self.entries[key]=(time.monotonic()+ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries)>self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.invalidations+=1
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            lookups=self.hits+self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits/lookups if lookups else None,
+                "invalidations": self.invalidations
+            }
+
+
+class SizedLRUCache:
+    """LRU cache bounded by the total size in bytes of its values (thread-safe)"""
+    def __init__(self, max_bytes: int):
+        self.max_bytes=max_bytes
+        self.entries=OrderedDict()          # key -> (size, value)
+        self.size=0
+        self.lock=threading.Lock()
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+
+    def get(self, key):
+        with self.lock:
+            entry=self.entries.get(key)
+            if entry is None:
+                self.misses+=1
+                return None
+            self.entries.move_to_end(key)
+            self.hits+=1
+            return entry[1]
+
+    def set(self, key, value, size: int) -> None:
+        """Store value, evicting the least recently used entries until the cache fits in max_bytes"""
+        if size>self.max_bytes:
+            return
+        with self.lock:
+            previous=self.entries.pop(key, None)
+            if previous is not None:
+                self.size-=previous[0]
+            self.entries[key]=(size, value)
+            self.size+=size
+            while self.size>self.max_bytes:
+                evicted_size, evicted=self.entries.popitem(last=False)[1]
+                self.size-=evicted_size
+                self.evictions+=1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size=0
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            lookups=self.hits+self.misses
+            return {
+                "items": len(self.entries),
+                "size": self.size,
+                "max_size": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits/lookups if lookups else None,
+                "evictions": self.evictions
+            }
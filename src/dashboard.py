@@ -0,0 +1,122 @@
+"""
+Push channel of the /info dashboard. One thread polls the parts of the dashboard (ping, models, running models,
+device) every interval seconds while at least one browser is subscribed, and keeps each part serialized in JSON
+with a version. Subscribers are notified when a part changed and only receive the parts newer than the version
+they already have, so the cost of the polling does not depend on the number of open tabs.
+"""
+import hashlib
+import json
+import threading
+import traceback
+
+# Seconds between two comments sent on an idle stream, so that proxies and browsers keep the connection open
+KEEP_ALIVE=15
+# Milliseconds a browser waits before opening the stream again after a disconnection
+RETRY=5000
+
+
+class Subscription:
+    def __init__(self, notify):
+        self.notify=notify
+        self.version=0                      # version of the last part sent to the subscriber
+
+
+class DashboardFeed:
+    """Parts of the dashboard polled by one thread and pushed to the subscribers (thread-safe).
+    sources maps the name of each part to a function returning its data (JSON serializable)
+    """
+    def __init__(self, sources: dict, interval: float = 2):
+        self.sources=sources
+        self.interval=interval
+        self.lock=threading.Lock()
+        self.wakeup=threading.Condition(self.lock)
+        self.parts: dict[str, tuple]={}     # name -> (version, digest, JSON body)
+        self.version=0
+        self.subscriptions: list[Subscription]=[]
+        self.thread=None
+        self.polls=0
+        self.errors=0
+        self.events=0
+
+    def subscribe(self, notify) -> Subscription:
+        """Add a subscriber. notify() is called by the polling thread when a part changed (it must not block)"""
+        subscription=Subscription(notify)
+        with self.lock:
+            self.subscriptions.append(subscription)
+            if self.thread is None or not self.thread.is_alive():
+                # Started by the first subscriber of this process (threads are not inherited by fork)
+                self.thread=threading.Thread(target=self.run, name="infollama-dashboard", daemon=True)
+                self.thread.start()
+            self.wakeup.notify_all()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self.lock:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+
+    def run(self) -> None:
+        while True:
+            with self.lock:
+                # No polling while nobody is subscribed
+                while not self.subscriptions:
+                    self.wakeup.wait()
+            self.poll()
+            with self.lock:
+                self.wakeup.wait(self.interval)
+
+    def poll(self) -> None:
+        """Read every part, and notify the subscribers if one of them changed"""
+        changed=False
+        for name, source in self.sources.items():
+            try:
+                data=source()
+            except Exception:
+                self.errors+=1
+                traceback.print_exc()
+                continue
+            if data is None:
+                # Not available now (Ollama down): the subscribers keep the last value
+                continue
+            body=json.dumps(data, default=str).encode()
+            digest=hashlib.blake2b(body, digest_size=16).digest()
+            with self.lock:
+                part=self.parts.get(name)
+                if part is None or part[1]!=digest:
+                    self.version+=1
+                    self.parts[name]=(self.version, digest, body)
+                    changed=True
+        with self.lock:
+            self.polls+=1
+            subscriptions=list(self.subscriptions) if changed else []
+        for subscription in subscriptions:
+            try:
+                subscription.notify()
+            except Exception:
+                # A subscriber being closed never stops the polling of the others
+                self.errors+=1
+
+    def get_changes(self, subscription: Subscription) -> list[tuple[str, bytes]]:
+        """Return the (name, JSON body) of the parts changed since the last call for this subscriber"""
+        with self.lock:
+            changes=[(version, name, body) for name, (version, digest, body) in self.parts.items() if version>subscription.version]
+            subscription.version=self.version
+            self.events+=len(changes)
+        return [(name, body) for version, name, body in sorted(changes)]
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {"interval": self.interval, "subscribers": len(self.subscriptions), "version": self.version, "polls": self.polls, "events": self.events, "errors": self.errors}
+
+
+def format_event(name: str, body: bytes) -> bytes:
+    """Server-Sent Events frame of a part (the JSON body has no line break)"""
+    return b"event: "+name.encode()+b"\ndata: "+body+b"\n\n"
+
+
+def format_keep_alive() -> bytes:
+    return b": keep-alive\n\n"
+
+
+def format_retry() -> bytes:
+    return f"retry: {RETRY}\n\n".encode()
@@ -14,12 +14,8 @@ def get_file_size(file_path):
     except FileNotFoundError:
         return 0
 
-# Get hardware informations about the device (CPU, RAM, GPU)
-def get_device_info(log_file: str):
-    start_time0 = timeit.default_timer()
-
-    log_file_size=get_file_size(log_file)
-    gpus=None
+# Get the GPU informations (shells out to nvidia-smi): None if no GPU is found
+def get_gpu_info():
     try:
         import GPUtil
         gpus = GPUtil.getGPUs()
@@ -45,128 +41,136 @@ def get_device_info(log_file: str):
         pytherminal.console("[b]Error get_device_info():[/b]", e)
         pytherminal.console("[b]Try to update your install with this command:\n pip install -U pip setuptools wheel[/b]")
         gpu_info = None
+    return gpu_info
+
+# Get the facts of the device that do not change while the proxy runs (CPU, installed RAM, OS, hostname)
+# Slow: cpuinfo.get_cpu_info() takes hundreds of milliseconds, it is called once
+def get_static_info() -> dict:
+    cpu_util = psutil.cpu_freq()
+    cpu_name = cpuinfo.get_cpu_info()
+    ram_info = psutil.virtual_memory()
+
+    cpu_freq=0
+    cpu_freq_max=0
+    cpu_name_text=""
+    l3_cache_size=0
+    ram_installed=0
+    os_version=""
+
+    os_name=platform.system()
+    cpu_brand=cpu_name.get("vendor_id_raw")
+    os="Linux"
+
+    os_detail=platform.platform()
+    if (os_detail.upper().startswith("MACOS")):
+        cpu_brand="Apple"
+        versions=os_detail.split("-")
+        os_version=versions[1]
+        os="Mac"
+        os_name="macOS "+os_name+" "+os_version
+        cpu_freq = cpu_name.get("hz_advertised", cpu_util.max)
+        cpu_freq_max=cpu_name.get("hz_advertised", cpu_util.max)
+        if (cpu_freq<10000):
+            cpu_freq=cpu_freq*1e6
+            cpu_freq_max=cpu_freq_max*1e6
+
+        cpu_name_text=cpu_name.get("brand_raw")
+        l3_cache_size=cpu_name.get("l3_cache_size", 0)
+        ram_installed=ram_info.total            
+
+    if os_name=="Windows" or os_name=="Linux":
+        os=os_name
+        versions=os_detail.split("-")
+        os_version=versions[1]
+        if os_version=="10":
+            build=os_detail[os_detail.rfind(".")+1:]
+            if (build>="22000"):
+                os_version="11"
+        cpu_brand= cpu_name.get("vendor_id_raw")
+        cpu_freq= cpu_name.get("hz_advertised")[0]
+        cpu_freq_max= cpu_name.get("hz_advertised")[0]
+        l3_cache_size= cpu_name.get("l3_cache_size")
+        ram_installed= ram_info[0]
+        cpu_name_text= cpu_name.get("brand_raw")
+
+    cpu_name_text=cpu_name_text.replace("Processor","").strip()
+
+    import socket
+    hostname = socket.gethostname()
+
+    return {
+        "cpu_info": cpu_name,
+        "cpu_brand": cpu_brand,
+        "cpu_name": cpu_name_text,
+        "cpu_freq": cpu_freq,
+        "cpu_threads": cpu_name.get("count"),
+        "cpu_max_freq": cpu_freq_max,
+        "l3_cache_size": l3_cache_size,
+        "cpu_arch": cpu_name.get("arch"),
+        "ram_installed": ram_installed,
+        "os": os,
+        "os_name": os_name,
+        "os_version": os_version,
+        "os_details": os_detail,
+        "hostname": hostname
+    }
 
+# Get hardware informations about the device (CPU, RAM, GPU)
+# static is the result of get_static_info(), read again if not given: only the dynamic values are sampled
+def get_device_info(log_file: str, static: dict|None = None):
+    start_time0 = timeit.default_timer()
 
-    end_time = timeit.default_timer()
-    #print(f"Execution time GPUtil.getGPUs(): {end_time - start_time} seconds")
+    log_file_size=get_file_size(log_file)
+    gpu_info=get_gpu_info()
 
     try:
+        if static is None:
+            static=get_static_info()
         cpu_util = psutil.cpu_freq()
-        end_time = timeit.default_timer()
-        #print(f"Execution time psutil.cpu_freq(): {end_time - start_time0} seconds")
-        #print(f"CPU Util: {cpu_util}")
-        
-        start_time = timeit.default_timer()
-        cpu_name = cpuinfo.get_cpu_info()
-        end_time = timeit.default_timer()
-        #print(f"Execution time cpuinfo.get_cpu_info(): {end_time - start_time} seconds")
-        #print(f"CPU name: {cpu_name}")
-        
-        start_time = timeit.default_timer()
+        cpu_load = psutil.cpu_percent(interval=None)
         ram_info = psutil.virtual_memory()
-        end_time = timeit.default_timer()
-        #print(f"Execution time psutil.virtual_memory(): {end_time - start_time} seconds")
-        #print(f"RAM: {ram_info}")
-             
-
-        start_time = timeit.default_timer()
         hdd_info = psutil.disk_usage('/')
         end_time = timeit.default_timer()
-        #print(f"Execution time psutil.disk_usage(): {end_time - start_time} seconds")
-        #print(f"HDD: {hdd_info}")
-
-        cpu_freq=0
-        cpu_freq_max=0
-        cpu_name_text=""
-        l3_cache_size=0
-        ram_installed=0
-        ram_available=0
-        os_version=""
-        cpu_max_freq=0
-
-
-
-        os_name=platform.system()
-        cpu_brand=cpu_name.get("vendor_id_raw")
-        os="Linux"
-
-        os_detail=platform.platform()
-        if (os_detail.upper().startswith("MACOS")):
-            cpu_brand="Apple"
-            versions=os_detail.split("-")
-            os_version=versions[1]
-            os="Mac"
-            os_name="macOS "+os_name+" "+os_version
-            cpu_freq = cpu_name.get("hz_advertised", cpu_util.max)
-            cpu_freq_max=cpu_name.get("hz_advertised", cpu_util.max)
-            if (cpu_freq<10000):
-                cpu_freq=cpu_freq*1e6
-                cpu_freq_max=cpu_freq_max*1e6
-
-            cpu_name_text=cpu_name.get("brand_raw")
-            l3_cache_size=cpu_name.get("l3_cache_size", 0)
-            ram_available=ram_info.available
-            ram_installed=ram_info.total            
-
-        if os_name=="Windows" or os_name=="Linux":
-            os=os_name
-            versions=os_detail.split("-")
-            os_version=versions[1]
-            if os_version=="10":
-                build=os_detail[os_detail.rfind(".")+1:]
-                if (build>="22000"):
-                    os_version="11"
-            cpu_brand= cpu_name.get("vendor_id_raw")
-            cpu_freq= cpu_name.get("hz_advertised")[0]
-            cpu_freq_max= cpu_name.get("hz_advertised")[0]
-            l3_cache_size= cpu_name.get("l3_cache_size")
-            ram_installed= ram_info[0]
-            ram_available= ram_info[1]
-            cpu_name_text= cpu_name.get("brand_raw")
-
-        cpu_name_text=cpu_name_text.replace("Processor","").strip()
-
-        import socket
-        hostname = socket.gethostname()
 
         device = {
             "detected": True,
             "raw": {
                 "cpu_util": cpu_util,
-                "cpu_name": cpu_name,
+                "cpu_name": static["cpu_info"],
                 "ram_info": ram_info,
                 "gpus": gpu_info,
                 "hdd_info": hdd_info
             },
             
-            "cpu_brand": cpu_brand,
-            "cpu_name": cpu_name_text,
-            "cpu_freq": cpu_freq,
-            "cpu_threads": cpu_name.get("count"),
-            "cpu_max_freq": cpu_freq_max,
-            "l3_cache_size": l3_cache_size,
-            "cpu_arch": cpu_name.get("arch"),
+            "cpu_brand": static["cpu_brand"],
+            "cpu_name": static["cpu_name"],
+            "cpu_freq": static["cpu_freq"],
+            "cpu_threads": static["cpu_threads"],
+            "cpu_max_freq": static["cpu_max_freq"],
+            "l3_cache_size": static["l3_cache_size"],
+            "cpu_arch": static["cpu_arch"],
+            "cpu_load": cpu_load,
             "ram_info": ram_info,
-            "ram_installed": ram_installed,
-            "ram_available": ram_available,
+            "ram_installed": static["ram_installed"],
+            "ram_available": ram_info.available if static["ram_installed"] else 0,
             "hdd_total": hdd_info.total,
             "hdd_used": hdd_info.used,
             "hdd_free": hdd_info.free,
             "gpus": gpu_info,
             "getDeviceInfoTime": end_time - start_time0,
-            "os": os,
-            "os_name": os_name,
-            "os_version": os_version,
-            "os_details": platform.platform(),
-            "hostname": hostname,
+            "os": static["os"],
+            "os_name": static["os_name"],
+            "os_version": static["os_version"],
+            "os_details": static["os_details"],
+            "hostname": static["hostname"],
             "description": "",
             "log_file_size": log_file_size
         }
 
 
         try:
-            device["description"] = f"""CPU: {device.get("cpu_name")} - {utils.formatFrequencies(cpu_freq)} {device.get("cpu_threads")} threads 
-            RAM: {utils.formatBytes(round(ram_installed), 0)}
+            device["description"] = f"""CPU: {device.get("cpu_name")} - {utils.formatFrequencies(device.get("cpu_freq"))} {device.get("cpu_threads")} threads 
+            RAM: {utils.formatBytes(round(device.get("ram_installed")), 0)}
             HDD: Total: {utils.formatBytes(device.get("hdd_total"))} Free: {utils.formatBytes(device.get("hdd_free"))}\n"""
         except:
             traceback.print_exc()
@@ -206,7 +210,7 @@ def get_device_info(log_file: str):
             "hdd_free": "",
             "gpus": gpu_info,
             "getDeviceInfoTime": 0,
-            "os": os,
+            "os": "",
             "os_name": platform.system(),
             "os_version": platform.release(),
             "os_details": platform.platform(),
@@ -217,5 +221,3 @@ def get_device_info(log_file: str):
 
 
     return device
-
-
@@ -0,0 +1,218 @@
+"""
+Content-addressed cache of embedding vectors, shared by api/embed and v1/embeddings.
+Each input text is cached alone, keyed by the model digest and a hash of the normalized text, so a batch
+only sends its cache misses to Ollama.
+Two tiers: an in-memory LRU, and an optional memory-mapped file that survives restarts.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from src import pytherminal
+
+KEY_SIZE=16
+# First bytes of the disk file, with the version of its records
+MAGIC=b"IEMBv2\0\0"
+# Record stored in the disk file: key (16 bytes) + number of dimensions (uint32) + float64 values, the precision
+# of the JSON answers of Ollama: a vector read from the file is the same as the one read from Ollama or from memory
+RECORD_HEADER=struct.Struct(f"<{KEY_SIZE}sI")
+VALUE_SIZE=8
+# Seconds between two checks that the file was not replaced by clear() in another process
+CHECK_INTERVAL=1
+
+
+def get_key(digest: str, text: str, options: str = "") -> bytes:
+    """Key of one input: model digest + options that change the vector + NFC normalized text"""
+    text=unicodedata.normalize("NFC", text)
+    return hashlib.blake2b(f"{digest}\0{options}\0{text}".encode("utf-8"), digest_size=KEY_SIZE).digest()
+
+
+class EmbeddingDiskCache:
+    """Append-only file of float64 vectors, read through mmap. The offsets are indexed in memory at startup.
+    When the file reaches max_size, new vectors are only kept in memory. The file is never cut while other
+    processes may be reading it: clear() replaces it by a new empty file, and the other processes open the
+    new file at their next lookup.
+    """
+    def __init__(self, path: str, max_size: int = 1024*1024*1024):
+        self.path=path
+        self.max_size=max_size
+        self.lock=threading.Lock()
+        self.index: dict[bytes, tuple[int, int]]={}      # key -> (offset of the values, dims)
+        self.fd=None
+        self.mm=None
+        self.size=0
+        self.inode=None
+        self.checked_at=0.0
+        self.disabled=False
+
+    def open(self) -> None:
+        """Open the file (lazily, in the process that uses it) and index the records it holds"""
+        try:
+            # The process creating the file writes its header
+            self.fd=os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o644)
+            os.write(self.fd, MAGIC)
+        except FileExistsError:
+            self.fd=os.open(self.path, os.O_RDWR | os.O_APPEND)
+        stat=os.fstat(self.fd)
+        self.inode=stat.st_ino
+        self.checked_at=time.monotonic()
+        self.index={}
+        self.size=stat.st_size
+        self.remap()
+        if self.size>=len(MAGIC) and self.mm[:len(MAGIC)]!=MAGIC:
+            # File of another format (float32 vectors of a former release): neither read nor written
+            pytherminal.console(f"[error]Embedding cache file {self.path} has an unknown format: vectors are kept in memory only. Remove the file to cache them on disk[/error]")
+            self.disabled=True
+            return
+        offset=len(MAGIC)
+        while offset+RECORD_HEADER.size<=self.size:
+            key, dims=RECORD_HEADER.unpack_from(self.mm, offset)
+            end=offset+RECORD_HEADER.size+dims*VALUE_SIZE
+            if end>self.size:
+                break
+            self.index[key]=(offset+RECORD_HEADER.size, dims)
+            offset=end
+        if len(MAGIC)<offset<self.size:
+            # Incomplete record written by a crashed process: cut it
+            os.ftruncate(self.fd, offset)
+            self.size=offset
+            self.remap()
+
+    def close(self) -> None:
+        if self.mm is not None:
+            self.mm.close()
+            self.mm=None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd=None
+        self.index={}
+        self.size=0
+
+    def check_file(self) -> None:
+        """Open the file, or open it again if another process replaced it (called with the lock held)"""
+        if self.fd is not None and time.monotonic()-self.checked_at<CHECK_INTERVAL:
+            return
+        if self.fd is not None:
+            self.checked_at=time.monotonic()
+            try:
+                if os.stat(self.path).st_ino==self.inode:
+                    return
+            except FileNotFoundError:
+                pass
+            self.close()
+            self.disabled=False
+        self.open()
+
+    def remap(self) -> None:
+        if self.mm is not None:
+            self.mm.close()
+            self.mm=None
+        if self.size>0:
+            self.mm=mmap.mmap(self.fd, self.size, access=mmap.ACCESS_READ)
+
+    def get(self, key: bytes) -> list[float]|None:
+        with self.lock:
+            self.check_file()
+            entry=self.index.get(key)
+            if entry is None:
+                return None
+            offset, dims=entry
+            if self.mm is None or len(self.mm)<offset+dims*VALUE_SIZE:
+                self.remap()
+            return array("d", self.mm[offset:offset+dims*VALUE_SIZE]).tolist()
+
+    def set(self, key: bytes, vector: list[float]) -> None:
+        record=RECORD_HEADER.pack(key, len(vector))+array("d", vector).tobytes()
+        with self.lock:
+            self.check_file()
+            if self.disabled or key in self.index or self.size+len(record)>self.max_size:
+                return
+            # One write() per record in O_APPEND mode: records of other processes are never interleaved
+            os.write(self.fd, record)
+            end=os.lseek(self.fd, 0, os.SEEK_CUR)
+            self.size=max(self.size, end)
+            self.index[key]=(end-len(record)+RECORD_HEADER.size, len(vector))
+
+    def clear(self) -> None:
+        """Replace the file by an empty one. The processes reading the former file keep a valid mapping of it"""
+        with self.lock:
+            temporary=f"{self.path}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as file:
+                file.write(MAGIC)
+            os.replace(temporary, self.path)
+            self.close()
+            self.disabled=False
+            self.open()
+
+    def get_stats(self) -> dict:
+        return {"path": self.path, "items": len(self.index), "file_size": self.size, "max_size": self.max_size, "disabled": self.disabled}
+
+
+class EmbeddingCache:
+    """In-memory LRU of vectors, backed by an optional EmbeddingDiskCache"""
+    def __init__(self, max_items: int = 10000, disk_path: str = "", disk_max_size: int = 1024*1024*1024):
+        self.max_items=max_items
+        self.entries=OrderedDict()
+        self.lock=threading.Lock()
+        self.disk=EmbeddingDiskCache(disk_path, disk_max_size) if disk_path else None
+        self.memory_hits=0
+        self.disk_hits=0
+        self.misses=0
+
+    def get_many(self, keys: list[bytes]) -> list[list[float]|None]:
+        """Return the vector of each key, None for the cache misses"""
+        vectors=[]
+        for key in keys:
+            with self.lock:
+                vector=self.entries.get(key)
+                if vector is not None:
+                    self.entries.move_to_end(key)
+                    self.memory_hits+=1
+            if vector is None and self.disk is not None:
+                vector=self.disk.get(key)
+                if vector is not None:
+                    with self.lock:
+                        self.disk_hits+=1
+                    self.set_memory(key, vector)
+            if vector is None:
+                with self.lock:
+                    self.misses+=1
+            vectors.append(vector)
+        return vectors
+
+    def set_memory(self, key: bytes, vector: list[float]) -> None:
+        with self.lock:
+            self.entries[key]=vector
+            self.entries.move_to_end(key)
+            while len(self.entries)>self.max_items:
+                self.entries.popitem(last=False)
+
+    def set_many(self, keys: list[bytes], vectors: list[list[float]]) -> None:
+        for key, vector in zip(keys, vectors):
+            self.set_memory(key, vector)
+            if self.disk is not None:
+                self.disk.set(key, vector)
+
+    def get_stats(self) -> dict:
+        lookups=self.memory_hits+self.disk_hits+self.misses
+        return {
+            "items": len(self.entries),
+            "max_items": self.max_items,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits+self.disk_hits)/lookups if lookups else None,
+            "disk": self.disk.get_stats() if self.disk is not None else None
+        }
+
+    def clear(self) -> None:
+        """Clear both tiers. The memory of the other pre-fork workers is not cleared, they open the new disk file"""
+        with self.lock:
+            self.entries.clear()
+        if self.disk is not None:
+            self.disk.clear()
@@ -0,0 +1,128 @@
+"""
+Health of the Ollama backends: a background thread probes api/version on every backend at a fixed interval,
+and a circuit breaker per backend stops sending calls to a backend that fails, until it answers again.
+"""
+import threading
+import time
+from src import pytherminal
+
+
+class CircuitBreaker:
+    """closed: calls are sent. open: calls fail fast (or go to another backend) for reset_timeout seconds.
+    half_open: one trial call is sent, its result closes or opens the circuit again (thread-safe).
+    """
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30):
+        self.failure_threshold=failure_threshold
+        self.reset_timeout=reset_timeout
+        self.lock=threading.Lock()
+        self.state="closed"
+        self.failures=0
+        self.opened_at=0.0
+        self.trial=False                    # a half-open trial call is in progress
+        self.opened=0
+
+    def is_available(self) -> bool:
+        """Return True if a call could be sent now (without claiming the half-open trial)"""
+        with self.lock:
+            if self.state=="closed":
+                return True
+            if self.state=="open":
+                return time.monotonic()-self.opened_at>=self.reset_timeout
+            return not self.trial
+
+    def allow(self) -> bool:
+        """Return True if a call can be sent now. In half-open state, only the first caller gets the trial"""
+        with self.lock:
+            if self.state=="open" and time.monotonic()-self.opened_at>=self.reset_timeout:
+                self.state="half_open"
+                self.trial=False
+            if self.state=="closed":
+                return True
+            if self.state=="half_open" and not self.trial:
+                self.trial=True
+                return True
+            return False
+
+    def on_success(self) -> None:
+        with self.lock:
+            self.state="closed"
+            self.failures=0
+            self.trial=False
+
+    def on_failure(self) -> None:
+        with self.lock:
+            self.failures+=1
+            self.trial=False
+            if self.state=="half_open" or (self.state=="closed" and self.failures>=self.failure_threshold):
+                self.state="open"
+                self.opened_at=time.monotonic()
+                self.opened+=1
+
+    def on_abort(self) -> None:
+        """End a call that tells nothing about the backend (local error, client gone): the trial goes to the next call"""
+        with self.lock:
+            self.trial=False
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {"state": self.state, "failures": self.failures, "opened": self.opened}
+
+
+class HealthChecker:
+    """Probe every backend on an interval and set its health: up, degraded (slow or failing) or down.
+    probe(backend) must return the api/version answer of the backend, or raise an exception.
+    """
+    def __init__(self, backends, probe, interval: float = 10, degraded_latency: float = 1.0):
+        self.backends=backends
+        self.probe=probe
+        self.interval=interval
+        self.degraded_latency=degraded_latency
+        self.thread=None
+        self.stopping=threading.Event()
+
+    def start(self) -> None:
+        """Start the probing thread of this process (again after a fork: threads are not inherited)"""
+        if self.interval<=0 or (self.thread is not None and self.thread.is_alive()):
+            return
+        self.stopping=threading.Event()
+        self.thread=threading.Thread(target=self.run, name="infollama-health", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopping.set()
+
+    def run(self) -> None:
+        while not self.stopping.is_set():
+            self.check_all()
+            self.stopping.wait(self.interval)
+
+    def check_all(self) -> None:
+        for backend in self.backends:
+            self.check(backend)
+
+    def check(self, backend) -> None:
+        """Probe one backend and update its health and its circuit breaker"""
+        start=time.perf_counter()
+        try:
+            answer=self.probe(backend)
+        except Exception as e:
+            backend.breaker.on_failure()
+            health="down" if backend.breaker.state!="closed" else "degraded"
+            error=str(e)
+            answer=None
+        else:
+            backend.breaker.on_success()
+            latency=time.perf_counter()-start
+            health="degraded" if latency>self.degraded_latency else "up"
+            error=None
+        with backend.lock:
+            previous=backend.health
+            backend.health=health
+            backend.error=error
+            backend.checked_at=time.time()
+            if answer is not None:
+                backend.latency=latency
+                backend.version=answer.get("version")
+        if previous!=health and previous!="unknown":
+            tag="ok" if health=="up" else "error"
+            pytherminal.console(f"[{tag}]Ollama backend {backend.base_url} is {health}[/{tag}]")
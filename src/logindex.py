@@ -0,0 +1,190 @@
+"""
+Query index of the JSONL access log, kept in a small SQLite database. The records are inserted by the thread
+writing the access log, one transaction per batch of lines, so the index is always up to date and the requests
+never wait for it. Queries by user, endpoint, model, status and time range use the indexes of the database and
+take milliseconds, whatever the size of the log files. Totals per user, endpoint, model or status are read from
+hourly buckets updated with each batch, so they do not scan the records.
+In pre-fork mode, the supervisor writes the index and every worker reads it with its own connection.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+COLUMNS=["request_id", "ip", "user", "user_type", "method", "endpoint", "model", "status", "latency", "ttft",
+         "bytes_in", "bytes_out", "prompt_tokens", "completion_tokens"]
+FILTERS=["user", "user_type", "endpoint", "model", "method"]
+GROUPS=["user", "user_type", "endpoint", "model", "status"]
+BUCKET=3600
+MAX_LIMIT=1000
+# Seconds between two removals of the records older than the retention
+PRUNE_INTERVAL=3600
+
+
+def parse_time(value) -> float|None:
+    """Parse a time given as epoch seconds or as an ISO 8601 date (UTC if no timezone)"""
+    if value is None or value=="":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    date=datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if date.tzinfo is None:
+        date=date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
+
+
+def format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec="milliseconds")
+
+
+class LogIndex:
+    """SQLite index of the access log records (thread-safe)"""
+    def __init__(self, path: str, retention_days: float = 30):
+        self.path=path
+        self.retention_days=retention_days
+        self.lock=threading.Lock()
+        self.connection=None
+        self.pid=None
+        self.pruned_at=0.0
+        self.indexed=0
+        self.errors=0
+
+    def reset(self) -> None:
+        """Forget the lock and the connection inherited from the parent process after a fork"""
+        self.lock=threading.Lock()
+        self.connection=None
+
+    def connect(self) -> sqlite3.Connection:
+        """Return the connection of this process (called with the lock held)"""
+        if self.connection is None or self.pid!=os.getpid():
+            self.connection=sqlite3.connect(self.path, check_same_thread=False)
+            self.pid=os.getpid()
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS access (ts REAL, {', '.join(COLUMNS)})")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS access_ts ON access (ts)")
+            for column in ["user", "endpoint", "model", "status"]:
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS access_{column} ON access ({column}, ts)")
+            self.connection.execute(f"""CREATE TABLE IF NOT EXISTS buckets (bucket INTEGER, {', '.join(GROUPS)}, calls INTEGER, errors INTEGER, 
+                                        prompt_tokens INTEGER, completion_tokens INTEGER, latency REAL, UNIQUE (bucket, {', '.join(GROUPS)}))""")
+            self.connection.commit()
+        return self.connection
+
+    def add_lines(self, lines: list[str]) -> None:
+        """Index a batch of access log lines (called by the log writer thread)"""
+        rows=[]
+        buckets={}
+        for line in lines:
+            try:
+                record=json.loads(line)
+                timestamp=parse_time(record.get("time"))
+                rows.append([timestamp]+[record.get(column) for column in COLUMNS])
+            except (ValueError, TypeError):
+                self.errors+=1
+                continue
+            # Empty strings instead of NULL: NULL values are never equal in the UNIQUE constraint
+            key=(int(timestamp//BUCKET*BUCKET),)+tuple(record.get(column) or "" for column in GROUPS)
+            totals=buckets.setdefault(key, [0, 0, 0, 0, 0.0])
+            totals[0]+=1
+            totals[1]+=(record.get("status") or 0)>=400
+            totals[2]+=record.get("prompt_tokens") or 0
+            totals[3]+=record.get("completion_tokens") or 0
+            totals[4]+=record.get("latency") or 0.0
+        with self.lock:
+            connection=self.connect()
+            connection.executemany(f"INSERT INTO access VALUES ({', '.join('?'*(len(COLUMNS)+1))})", rows)
+            connection.executemany(f"""INSERT INTO buckets VALUES ({', '.join('?'*(len(GROUPS)+6))}) ON CONFLICT (bucket, {', '.join(GROUPS)}) DO UPDATE SET 
+                                       calls=calls+excluded.calls, errors=errors+excluded.errors, prompt_tokens=prompt_tokens+excluded.prompt_tokens, 
+                                       completion_tokens=completion_tokens+excluded.completion_tokens, latency=latency+excluded.latency""",
+                                   [key+tuple(totals) for key, totals in buckets.items()])
+            if self.retention_days>0 and time.time()-self.pruned_at>PRUNE_INTERVAL:
+                connection.execute("DELETE FROM access WHERE ts<?", (time.time()-self.retention_days*86400,))
+                connection.execute("DELETE FROM buckets WHERE bucket<?", (time.time()-self.retention_days*86400-BUCKET,))
+                self.pruned_at=time.time()
+            connection.commit()
+            self.indexed+=len(rows)
+
+    def get_where(self, filters: dict) -> tuple[str, list]:
+        """Return the WHERE clause and its parameters for the filters of a query"""
+        clauses=[]
+        values=[]
+        for name in FILTERS:
+            if filters.get(name):
+                clauses.append(f"{name}=?")
+                values.append(filters[name])
+        status=str(filters.get("status") or "").lower()
+        if status.endswith("xx") and status[0].isdigit():
+            # Status class, like 5xx
+            clauses.append("status>=? AND status<?")
+            values+=[int(status[0])*100, int(status[0])*100+100]
+        elif status=="errors":
+            clauses.append("status>=400")
+        elif status:
+            clauses.append("status=?")
+            values.append(int(status))
+        since=parse_time(filters.get("since"))
+        if since is not None:
+            clauses.append("ts>=?")
+            values.append(since)
+        until=parse_time(filters.get("until"))
+        if until is not None:
+            clauses.append("ts<?")
+            values.append(until)
+        return (" WHERE "+" AND ".join(clauses) if clauses else ""), values
+
+    def query(self, filters: dict) -> dict:
+        """Return a page of the records matching the filters, newest first.
+        filters: user, user_type, endpoint, model, method, status (200, 5xx or errors), since, until, limit, before.
+        The next page is read with before set to the cursor returned in next: the index is walked from there, so every page
+        takes the same time, and no record is skipped or repeated when new ones are inserted between two pages
+        """
+        limit=min(max(int(filters.get("limit") or 100), 1), MAX_LIMIT)
+        where, values=self.get_where(filters)
+        if filters.get("before"):
+            # Cursor "ts:rowid" of the last record of the previous page, rowid orders the records of the same time
+            try:
+                ts, rowid=str(filters["before"]).split(":")
+                values+=[float(ts), float(ts), int(rowid)]
+            except ValueError:
+                raise ValueError("before must be the next cursor of a previous answer") from None
+            where+=(" AND " if where else " WHERE ")+"(ts<? OR (ts=? AND rowid<?))"
+        started=time.perf_counter()
+        with self.lock:
+            rows=self.connect().execute(f"SELECT rowid, ts, {', '.join(COLUMNS)} FROM access{where} ORDER BY ts DESC, rowid DESC LIMIT ?", values+[limit+1]).fetchall()
+        more=len(rows)>limit
+        rows=rows[:limit]
+        records=[{"time": format_time(row[1]), **dict(zip(COLUMNS, row[2:]))} for row in rows]
+        return {"limit": limit, "more": more, "next": f"{rows[-1][1]!r}:{rows[-1][0]}" if more else None, 
+                "query_time": time.perf_counter()-started, "records": records}
+
+    def aggregate(self, group_by: str, filters: dict) -> dict:
+        """Return the calls, errors, tokens and average latency of the records matching the filters, per value of group_by.
+        Read from the hourly buckets: since and until are rounded to the hour
+        """
+        if group_by not in GROUPS:
+            raise ValueError(f"group_by must be one of {', '.join(GROUPS)}")
+        where, values=self.get_where({name: value for name, value in filters.items() if name not in ("since", "until", "method")})
+        clauses=[where[len(" WHERE "):]] if where else []
+        since=parse_time(filters.get("since"))
+        if since is not None:
+            clauses.append("bucket>=?")
+            values.append(since//BUCKET*BUCKET)
+        until=parse_time(filters.get("until"))
+        if until is not None:
+            clauses.append("bucket<?")
+            values.append(until)
+        where=" WHERE "+" AND ".join(clauses) if clauses else ""
+        started=time.perf_counter()
+        with self.lock:
+            rows=self.connect().execute(f"""SELECT {group_by}, SUM(calls), SUM(errors), SUM(prompt_tokens), SUM(completion_tokens), SUM(latency)
+                                            FROM buckets{where} GROUP BY {group_by} ORDER BY SUM(calls) DESC""", values).fetchall()
+        groups=[{group_by: row[0] if row[0]!="" else None, "calls": row[1], "errors": row[2], "prompt_tokens": row[3], "completion_tokens": row[4], 
+                 "avg_latency": row[5]/row[1] if row[1] else None} for row in rows]
+        return {"group_by": group_by, "query_time": time.perf_counter()-started, "groups": groups}
+
+    def get_stats(self) -> dict:
+        return {"path": self.path, "retention_days": self.retention_days, "indexed": self.indexed, "errors": self.errors}
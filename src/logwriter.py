@@ -0,0 +1,197 @@
+"""
+Background writer of the log files. log_event() only appends the line to a bounded queue: a thread writes the
+queued lines in batches, on a file kept open, when batch_size lines are waiting or every flush_interval seconds.
+When the queue is full, a request never waits for the disk: the new line (overflow="drop") or the oldest queued
+line (overflow="drop_oldest") is dropped and counted.
+The file is rotated when it reaches max_size bytes or when the day changes: the rotated segment is renamed with
+its date, compressed with gzip in another thread, and only the keep last segments are kept.
+on_write(lines) is called by the writing thread after each written batch (to index the access log).
+"""
+import datetime
+import gzip
+import os
+import shutil
+import threading
+from collections import deque
+
+OVERFLOW_POLICIES=["drop", "drop_oldest"]
+
+
+class LogWriter:
+    """Append lines to a file from a background thread (thread-safe)"""
+    def __init__(self, path: str, max_queue: int = 10000, overflow: str = "drop", batch_size: int = 256, flush_interval: float = 0.5,
+                 max_size: int = 0, rotate_daily: bool = False, keep: int = 0, on_write=None):
+        self.path=path
+        self.max_queue=max_queue
+        self.overflow=overflow
+        self.batch_size=batch_size
+        self.flush_interval=flush_interval
+        self.max_size=max_size              # bytes, 0 for no rotation on size
+        self.rotate_daily=rotate_daily
+        self.keep=keep                      # rotated segments kept, 0 keeps all of them
+        self.on_write=on_write
+        self.lock=threading.Lock()
+        self.wakeup=threading.Event()
+        self.lines=deque()
+        self.thread=None
+        self.file=None
+        self.size=0
+        self.day=None
+        self.closed=False
+        self.written=0
+        self.dropped=0
+        self.batches=0
+        self.rotations=0
+        self.errors=0
+
+    def write(self, line: str) -> bool:
+        """Queue a line, without waiting. Return False if a line was dropped because the queue is full"""
+        with self.lock:
+            if self.closed:
+                return False
+            if self.thread is None:
+                self.start()
+            kept=True
+            if len(self.lines)>=self.max_queue:
+                self.dropped+=1
+                if self.overflow!="drop_oldest":
+                    return False
+                self.lines.popleft()
+                kept=False
+            self.lines.append(line)
+            if len(self.lines)>=self.batch_size:
+                self.wakeup.set()
+            return kept
+
+    def start(self) -> None:
+        """Start the writing thread (called with the lock held)"""
+        self.thread=threading.Thread(target=self.run, name="infollama-log-writer", daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            with self.lock:
+                closed=self.closed
+            self.flush()
+            if closed:
+                return
+
+    def flush(self) -> None:
+        """Write every queued line"""
+        while True:
+            with self.lock:
+                if not self.lines:
+                    return
+                count=min(len(self.lines), self.batch_size*16)
+                batch=[self.lines.popleft() for _ in range(count)]
+            try:
+                if self.file is None:
+                    self.open()
+                if self.needs_rotation():
+                    self.rotate()
+                    self.open()
+                text="".join(batch)
+                self.file.write(text)
+                self.file.flush()
+                self.size+=len(text.encode())
+                self.written+=len(batch)
+                self.batches+=1
+            except Exception as e:
+                self.errors+=1
+                print(f"Error logging event: {e}")
+                self.reopen()
+                continue
+            if self.on_write is not None:
+                try:
+                    self.on_write(batch)
+                except Exception as e:
+                    self.errors+=1
+                    print(f"Error indexing log lines: {e}")
+
+    def open(self) -> None:
+        self.file=open(self.path, "a")
+        self.size=self.file.tell()
+        # An existing file belongs to the day it was last written
+        self.day=datetime.date.fromtimestamp(os.path.getmtime(self.path)) if self.size>0 else datetime.date.today()
+
+    def needs_rotation(self) -> bool:
+        if self.size==0:
+            return False
+        return (self.max_size>0 and self.size>=self.max_size) or (self.rotate_daily and datetime.date.today()!=self.day)
+
+    def rotate(self) -> None:
+        """Rename the current file with its date, then compress it and remove the old segments in another thread"""
+        self.reopen()
+        # The names of the segments sort in the order they were rotated
+        segment=f"{self.path}.{datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+        os.replace(self.path, segment)
+        self.rotations+=1
+        threading.Thread(target=self.compress, args=(segment,), name="infollama-log-compress", daemon=True).start()
+
+    def compress(self, segment: str) -> None:
+        """Replace a rotated segment by its gzip version, then apply the retention"""
+        try:
+            with open(segment, "rb") as source, gzip.open(segment+".gz.tmp", "wb") as target:
+                shutil.copyfileobj(source, target)
+            os.replace(segment+".gz.tmp", segment+".gz")
+            os.remove(segment)
+        except Exception as e:
+            print(f"Error compressing log file {segment}: {e}")
+        self.remove_old_segments()
+
+    def get_segments(self) -> list[str]:
+        """Return the rotated segments of the file, oldest first"""
+        folder=os.path.dirname(os.path.abspath(self.path))
+        prefix=os.path.basename(self.path)+"."
+        names=[name for name in os.listdir(folder) if name.startswith(prefix) and not name.endswith(".tmp")]
+        return [os.path.join(folder, name) for name in sorted(names)]
+
+    def remove_old_segments(self) -> None:
+        if self.keep<=0:
+            return
+        segments=self.get_segments()
+        for segment in segments[:max(0, len(segments)-self.keep)]:
+            try:
+                os.remove(segment)
+            except OSError:
+                pass
+
+    def reopen(self) -> None:
+        """Close the file: it is opened again by the next write (after an error, or when the file was moved)"""
+        if self.file is not None:
+            try:
+                self.file.close()
+            except Exception:
+                pass
+            self.file=None
+
+    def close(self, timeout: float = 5) -> None:
+        """Write the queued lines and stop the thread. Lines written later are ignored"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed=True
+            thread=self.thread
+        self.wakeup.set()
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        else:
+            self.flush()
+        self.reopen()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "path": self.path,
+                "queued": len(self.lines),
+                "max_queue": self.max_queue,
+                "overflow": self.overflow,
+                "written": self.written,
+                "batches": self.batches,
+                "dropped": self.dropped,
+                "size": self.size,
+                "rotations": self.rotations,
+                "errors": self.errors
+            }
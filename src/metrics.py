@@ -0,0 +1,163 @@
+"""
+Proxy metrics in the Prometheus text format: request counts, latency histograms, streams in progress and bytes.
+Recording a request is a few dictionary updates under a lock: the text is only built when /metrics is read.
+In pre-fork mode, each worker writes a snapshot of its counters to a file, and /metrics sums the snapshots of
+every worker, whichever worker answers the scrape.
+"""
+import bisect
+import json
+import os
+import threading
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Histogram:
+    """Count of the observed values per bucket, with their sum"""
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets=buckets
+        self.counts=[0]*(len(buckets)+1)    # the last one is +Inf
+        self.sum=0.0
+        self.count=0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)]+=1
+        self.sum+=value
+        self.count+=1
+
+
+def format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    return "{"+",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))+"}"
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value) -> str:
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """Counters and histograms of the proxy (thread-safe)"""
+    def __init__(self):
+        self.lock=threading.Lock()
+        self.requests: dict[tuple, int]={}             # (endpoint, status, user_type) -> count
+        self.histograms: dict[str, dict[str, Histogram]]={"request_duration": {}, "time_to_first_token": {}, "upstream_connect": {}}
+        self.streams_in_flight=0
+        self.bytes_in=0
+        self.bytes_out=0
+
+    def observe(self, name: str, endpoint: str, value: float|None) -> None:
+        """Add value to the histogram name of endpoint (called with the lock held)"""
+        if value is not None:
+            histograms=self.histograms[name]
+            histogram=histograms.get(endpoint)
+            if histogram is None:
+                histogram=histograms[endpoint]=Histogram()
+            histogram.observe(value)
+
+    def record_request(self, endpoint: str, status: int, user_type: str, duration: float, bytes_in: int = 0, bytes_out: int = 0) -> None:
+        """Count a finished non streamed call"""
+        key=(endpoint, status, user_type or "anonymous")
+        with self.lock:
+            self.requests[key]=self.requests.get(key, 0)+1
+            self.observe("request_duration", endpoint, duration)
+            self.bytes_in+=bytes_in
+            self.bytes_out+=bytes_out
+
+    def stream_started(self) -> None:
+        with self.lock:
+            self.streams_in_flight+=1
+
+    def record_stream(self, endpoint: str, status: int, user_type: str, duration: float, ttft: float|None, connect: float|None, bytes_in: int = 0, bytes_out: int = 0) -> None:
+        """Count a finished stream, started with stream_started()"""
+        key=(endpoint, status, user_type or "anonymous")
+        with self.lock:
+            self.streams_in_flight-=1
+            self.requests[key]=self.requests.get(key, 0)+1
+            self.observe("request_duration", endpoint, duration)
+            self.observe("time_to_first_token", endpoint, ttft)
+            self.observe("upstream_connect", endpoint, connect)
+            self.bytes_in+=bytes_in
+            self.bytes_out+=bytes_out
+
+    def to_dict(self) -> dict:
+        """Snapshot of the counters and histograms, JSON serializable"""
+        with self.lock:
+            return {"requests": [[*key, count] for key, count in self.requests.items()],
+                    "histograms": {name: {endpoint: [histogram.counts, histogram.sum, histogram.count] for endpoint, histogram in histograms.items()}
+                                   for name, histograms in self.histograms.items()},
+                    "streams_in_flight": self.streams_in_flight, "bytes_in": self.bytes_in, "bytes_out": self.bytes_out}
+
+    def add(self, snapshot: dict, in_flight: bool = True) -> None:
+        """Add the counters of a snapshot (of another worker, or of this worker before it restarted) to these ones"""
+        with self.lock:
+            for endpoint, status, user_type, count in snapshot["requests"]:
+                key=(endpoint, status, user_type)
+                self.requests[key]=self.requests.get(key, 0)+count
+            for name, histograms in snapshot["histograms"].items():
+                for endpoint, (counts, total, count) in histograms.items():
+                    histogram=self.histograms[name].get(endpoint)
+                    if histogram is None:
+                        histogram=self.histograms[name][endpoint]=Histogram()
+                    histogram.counts=[a+b for a, b in zip(histogram.counts, counts)]
+                    histogram.sum+=total
+                    histogram.count+=count
+            if in_flight:
+                self.streams_in_flight+=snapshot["streams_in_flight"]
+            self.bytes_in+=snapshot["bytes_in"]
+            self.bytes_out+=snapshot["bytes_out"]
+
+    def render(self, gauges: list[tuple] = ()) -> str:
+        """Return the metrics in the Prometheus text format.
+        gauges are values read when the metrics are collected: (name, help, label names, {label values: value})
+        """
+        lines=[]
+        with self.lock:
+            lines+=["# HELP infollama_requests_total Calls answered by the proxy", "# TYPE infollama_requests_total counter"]
+            for labels, count in sorted(self.requests.items()):
+                lines.append(f"infollama_requests_total{format_labels(('endpoint', 'status', 'user_type'), labels)} {count}")
+            for name, help_text in (("request_duration", "Total time of the calls, until the last byte of a stream"),
+                                    ("time_to_first_token", "Time until the first generated token of a stream"),
+                                    ("upstream_connect", "Time until Ollama answered with its headers")):
+                lines+=[f"# HELP infollama_{name}_seconds {help_text}", f"# TYPE infollama_{name}_seconds histogram"]
+                for endpoint, histogram in sorted(self.histograms[name].items()):
+                    cumulated=0
+                    for bound, count in zip(histogram.buckets+("+Inf",), histogram.counts):
+                        cumulated+=count
+                        lines.append(f'infollama_{name}_seconds_bucket{{endpoint="{escape(endpoint)}",le="{bound}"}} {cumulated}')
+                    lines.append(f'infollama_{name}_seconds_sum{{endpoint="{escape(endpoint)}"}} {histogram.sum!r}')
+                    lines.append(f'infollama_{name}_seconds_count{{endpoint="{escape(endpoint)}"}} {histogram.count}')
+            lines+=["# HELP infollama_streams_in_flight Streams being forwarded", "# TYPE infollama_streams_in_flight gauge",
+                    f"infollama_streams_in_flight {self.streams_in_flight}",
+                    "# HELP infollama_received_bytes_total Bytes of the requests received from the clients", "# TYPE infollama_received_bytes_total counter",
+                    f"infollama_received_bytes_total {self.bytes_in}",
+                    "# HELP infollama_sent_bytes_total Bytes of the answers sent to the clients", "# TYPE infollama_sent_bytes_total counter",
+                    f"infollama_sent_bytes_total {self.bytes_out}"]
+        for name, help_text, label_names, values in gauges:
+            lines+=[f"# HELP infollama_{name} {help_text}", f"# TYPE infollama_{name} gauge"]
+            for labels, value in values.items():
+                # Values not known yet (no lookup, no timed call) are left out
+                if value is not None:
+                    lines.append(f"infollama_{name}{format_labels(label_names, labels)} {format_value(value)}")
+        return "\n".join(lines)+"\n"
+
+
+def write_snapshot(metrics: Metrics, path: str) -> None:
+    """Write the snapshot of metrics to path, replaced as a whole: readers never see a partial file"""
+    temporary=f"{path}.tmp"
+    with open(temporary, "w") as file:
+        json.dump(metrics.to_dict(), file)
+    os.replace(temporary, path)
+
+
+def read_snapshot(path: str) -> dict|None:
+    try:
+        with open(path, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,156 @@
+"""
+Pre-fork serving mode: one supervisor process binds the port, then forks N worker processes that
+accept connections on the same listening socket. Each worker has its own GIL, so JSON handling and
+logging use every core of the host.
+The users and the config are loaded once by the supervisor before forking, so every worker shares the same state.
+Workers send their log lines to the supervisor, the only process writing the log file, through a queue bounded
+like the log queue of the writers. A stopped worker sends its last lines before it exits. Workers write a snapshot
+of their metrics every second, summed by the worker answering /metrics.
+The admission slots and the rate-limit buckets are kept in shared memory created before forking: --max_in_flight,
+--max_per_user and the limits of users.conf apply to the whole proxy, not to each worker.
+Crashed workers are restarted by the supervisor, and the slots they held are given back.
+"""
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+from src import admission
+from src import metrics
+from src import ratelimit
+from src import pytherminal
+
+# Seconds between two snapshots of the metrics of a worker
+METRICS_INTERVAL=1
+
+
+def is_supported() -> bool:
+    """Pre-fork needs os.fork(): not available on Windows"""
+    return hasattr(os, "fork")
+
+
+def create_socket(host: str, port: int) -> socket.socket:
+    """Create the listening socket shared by all the workers"""
+    family=socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock=socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, int(port)))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+    return sock
+
+
+def write_log_lines(log_queue, log_writers: dict) -> None:
+    """Supervisor thread: pass the (log name, line) sent by the workers to the log writers of the supervisor"""
+    while True:
+        item=log_queue.get()
+        if item is None:
+            return
+        name, line=item
+        writer=log_writers.get(name)
+        if writer is not None:
+            writer.write(line)
+
+
+def write_metrics(proxy) -> None:
+    """Worker thread: write the snapshot of the metrics of the worker when they changed"""
+    path=os.path.join(proxy.metrics_dir, f"worker-{proxy.worker_id}.json")
+    written=None
+    while True:
+        snapshot=proxy.metrics.to_dict()
+        if snapshot!=written:
+            metrics.write_snapshot(proxy.metrics, path)
+            written=snapshot
+        time.sleep(METRICS_INTERVAL)
+
+
+def stop_worker(signum, frame) -> None:
+    """SIGTERM sent by the supervisor: stop serving, the worker then sends its last log lines and exits"""
+    raise SystemExit(0)
+
+
+def worker_main(proxy, sock: socket.socket, serve, log_queue, worker_id: int, slots: admission.SharedSlots|None = None) -> None:
+    """Entry point of a worker process"""
+    # Upstream connections opened by the supervisor are shared after fork: never reuse them in the worker
+    proxy.upstream.close()
+    proxy.log_sink=log_queue
+    # The log writer threads are not inherited by fork, and their locks may have been copied while held
+    proxy.log_writers={}
+    if proxy.log_index is not None:
+        proxy.log_index.reset()
+    proxy.worker_id=worker_id
+    if slots is not None:
+        proxy.admission.share(slots, worker_id)
+    # A restarted worker goes on from the counters of the worker it replaces: the summed counters never decrease
+    snapshot=metrics.read_snapshot(os.path.join(proxy.metrics_dir, f"worker-{worker_id}.json"))
+    if snapshot is not None:
+        proxy.metrics.add(snapshot, in_flight=False)
+    threading.Thread(target=write_metrics, args=(proxy,), name="infollama-metrics", daemon=True).start()
+    # Threads are not inherited by fork: each worker probes the backends it sends calls to, and samples the device
+    proxy.health.start()
+    proxy.device_sampler.start()
+    signal.signal(signal.SIGTERM, stop_worker)
+    # Ctrl+C is handled by the supervisor, that stops every worker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        serve(proxy, sock)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        # The lines still buffered by the feeder thread of the queue reach the supervisor before the process ends
+        log_queue.close()
+        log_queue.join_thread()
+
+
+def run(proxy, host: str, port: int, workers: int, serve) -> None:
+    """Run the supervisor: fork the workers, restart them when they crash, stop them on exit.
+    serve(proxy, sock) must serve the proxy on the listening socket sock until the process ends.
+    """
+    context=multiprocessing.get_context("fork")
+    sock=create_socket(host, port)
+    log_queue=context.Queue(maxsize=proxy.config.log_queue_size)
+    log_writer=threading.Thread(target=write_log_lines, args=(log_queue, proxy.log_writers), daemon=True)
+    log_writer.start()
+    proxy.log_sink=log_queue
+    proxy.metrics_dir=tempfile.mkdtemp(prefix="infollama-metrics-")
+    slots=admission.SharedSlots(context, workers) if proxy.admission is not None else None
+    # Shared even without limits: they can be added to users.conf while the proxy runs
+    proxy.rate_limiter.share(ratelimit.create_shared_table(context))
+
+    def start_worker(worker_id: int):
+        process=context.Process(target=worker_main, args=(proxy, sock, serve, log_queue, worker_id, slots), name=f"infollama-worker-{worker_id}", daemon=True)
+        process.start()
+        return process
+
+    processes=[start_worker(i) for i in range(workers)]
+    pytherminal.console(f"[ok]{workers} worker processes started (pids {', '.join(str(p.pid) for p in processes)})[/ok]", False)
+
+    stopping=threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+    try:
+        while not stopping.is_set():
+            for i, process in enumerate(processes):
+                if not process.is_alive() and not stopping.is_set():
+                    pytherminal.console(f"[error]Worker {i} (pid {process.pid}) stopped with exit code {process.exitcode}. Restarting it[/error]")
+                    proxy.log_event(event=f"Worker {i} (pid {process.pid}) stopped with exit code {process.exitcode}", log_level=9)
+                    if slots is not None:
+                        slots.reset(i)
+                    processes[i]=start_worker(i)
+            stopping.wait(1)
+    finally:
+        pytherminal.console("[info]Stopping the worker processes[/info]", False)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join(5)
+        log_queue.put(None)
+        log_writer.join(5)
+        for writer in proxy.log_writers.values():
+            writer.close()
+        sock.close()
+        shutil.rmtree(proxy.metrics_dir, ignore_errors=True)
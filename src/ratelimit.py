@@ -0,0 +1,163 @@
+"""
+Token-bucket rate limits per user: model calls per second (rps) and model tokens per minute (tpm).
+The tokens of a call are only known when Ollama answers (prompt_eval_count + eval_count): they are taken
+from the bucket afterwards, and the next calls wait until the bucket is positive again.
+With pre-fork workers, the buckets are kept in shared memory: every worker takes from the same buckets.
+"""
+import math
+import threading
+import time
+from src import sharedmem
+
+
+class TokenBucket:
+    """Bucket refilled with rate units per second, up to capacity. Its level can go below 0 (debt)"""
+    def __init__(self, rate: float, capacity: float):
+        self.rate=rate
+        self.capacity=capacity
+        self.level=capacity
+        self.updated_at=time.monotonic()
+
+    def refill(self) -> None:
+        now=time.monotonic()
+        self.level=min(self.capacity, self.level+(now-self.updated_at)*self.rate)
+        self.updated_at=now
+
+    def take(self, amount: float = 1) -> float:
+        """Take amount if available and return 0, else return the seconds to wait"""
+        self.refill()
+        if self.level>=amount:
+            self.level-=amount
+            return 0.0
+        return (amount-self.level)/self.rate
+
+    def wait_time(self) -> float:
+        """Seconds before the level is not negative anymore (0 if it is not)"""
+        self.refill()
+        return max(0.0, -self.level/self.rate)
+
+    def debit(self, amount: float) -> None:
+        self.refill()
+        self.level-=amount
+
+
+class SharedTokenBucket(TokenBucket):
+    """Token bucket kept in a row of a shared table (level, updated_at, rate), used by every pre-fork worker"""
+    def __init__(self, values, offset: int, rate: float, capacity: float):
+        self.values=values
+        self.offset=offset
+        self.capacity=capacity
+        if self.rate!=rate:
+            # New row (rate 0), or limits changed in users.conf: full bucket
+            self.rate=rate
+            self.level=capacity
+            self.updated_at=time.monotonic()
+
+    @property
+    def level(self) -> float:
+        return self.values[self.offset]
+
+    @level.setter
+    def level(self, value: float) -> None:
+        self.values[self.offset]=value
+
+    @property
+    def updated_at(self) -> float:
+        return self.values[self.offset+1]
+
+    @updated_at.setter
+    def updated_at(self, value: float) -> None:
+        self.values[self.offset+1]=value
+
+    @property
+    def rate(self) -> float:
+        return self.values[self.offset+2]
+
+    @rate.setter
+    def rate(self, value: float) -> None:
+        self.values[self.offset+2]=value
+
+
+def create_shared_table(context, size: int = 4096) -> sharedmem.SharedTable:
+    """Shared memory for the buckets of the pre-fork workers, created by the supervisor before forking"""
+    return sharedmem.SharedTable(context, size, 3)
+
+
+def parse_limits(text: str) -> dict[str, float]:
+    """Parse limits written as rps=2,tpm=60000"""
+    limits={}
+    for item in text.split(","):
+        if "=" in item:
+            name, value=item.split("=", 1)
+            name=name.strip().lower()
+            if name in ("rps", "tpm"):
+                limits[name]=float(value)
+    return limits
+
+
+class RateLimiter:
+    """Buckets of every user (thread-safe). The limits of a user are passed with each call: a change in users.conf
+    applies to the next call.
+    """
+    def __init__(self):
+        self.lock=threading.Lock()
+        self.requests: dict[str, TokenBucket]={}
+        self.tokens: dict[str, TokenBucket]={}
+        self.limited=0
+        self.shared: sharedmem.SharedTable|None=None
+
+    def share(self, shared: sharedmem.SharedTable) -> None:
+        """Keep the buckets in the shared table of the pre-fork workers, under its lock shared by the processes"""
+        self.shared=shared
+        self.lock=shared.lock
+
+    def get_bucket(self, kind: str, user_name: str, rate: float, capacity: float) -> TokenBucket:
+        """Bucket of the requests or of the tokens of a user (lock held)"""
+        buckets=self.requests if kind=="requests" else self.tokens
+        bucket=buckets.get(user_name)
+        if bucket is None or bucket.rate!=rate:
+            offset=self.shared.find(f"{kind}:{user_name}") if self.shared is not None else None
+            if offset is not None:
+                bucket=SharedTokenBucket(self.shared.values, offset, rate, capacity)
+            else:
+                # One process, or shared table full: bucket of this process
+                bucket=TokenBucket(rate, capacity)
+            buckets[user_name]=bucket
+        return bucket
+
+    def check(self, user_name: str, limits: dict) -> int:
+        """Count one call of user_name. Return 0 if allowed, else the seconds to wait (Retry-After)"""
+        rps=limits.get("rps", 0)
+        tpm=limits.get("tpm", 0)
+        if rps<=0 and tpm<=0:
+            return 0
+        with self.lock:
+            wait=0.0
+            if tpm>0:
+                wait=self.get_bucket("tokens", user_name, tpm/60, tpm).wait_time()
+            if wait==0 and rps>0:
+                # Bursts up to one second of calls
+                wait=self.get_bucket("requests", user_name, rps, max(rps, 1)).take()
+            if wait>0:
+                self.limited+=1
+                return max(1, math.ceil(wait))
+            return 0
+
+    def record_tokens(self, user_name: str, limits: dict, count: int) -> None:
+        """Take the tokens used by a finished call from the bucket of user_name"""
+        tpm=limits.get("tpm", 0)
+        if tpm<=0 or count<=0:
+            return
+        with self.lock:
+            self.get_bucket("tokens", user_name, tpm/60, tpm).debit(count)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            users={}
+            for user_name, bucket in self.requests.items():
+                bucket.refill()
+                users.setdefault(user_name, {})["requests_available"]=round(bucket.level, 2)
+            for user_name, bucket in self.tokens.items():
+                bucket.refill()
+                users.setdefault(user_name, {})["tokens_available"]=round(bucket.level)
+            return {"limited": self.limited, "users": users}
@@ -0,0 +1,113 @@
+"""
+Policy of each endpoint: role required, log level, cache time-to-live, read timeout and admission priority.
+The route table is compiled once: exact paths in a dictionary, patterns with {name} parts as regular expressions,
+and prefixes ending with * by decreasing length. An endpoint is matched by its exact path first, then by the
+patterns in their order, then by the longest prefix. The policies found are remembered, so the next calls of the
+same endpoint cost one dictionary lookup.
+"""
+import re
+import threading
+
+# Roles in increasing order of rights: a user can call the routes of its role and of the roles before it
+ROLES=["anonymous", "user", "admin"]
+# Role of the routes nobody can call
+NO_ROLE="none"
+# Max number of endpoints whose policy is remembered (client paths are not bounded)
+MAX_MATCHED=4096
+
+
+class RoutePolicy:
+    """Policy of the endpoints matching pattern.
+    role: anonymous, user, admin or none. log_level: level of the log_event() of a granted call (0 is not logged).
+    cache_ttl: seconds an answer is kept in the metadata cache, 0 for no cache. timeout: read timeout in seconds, None
+    for the --read_timeout value. priority: multiplies the fair share weight of the user in the admission queue.
+    """
+    def __init__(self, pattern: str, role: str = "admin", log_level: int = 1, cache_ttl: float = 0, timeout: float|None = None, priority: float = 1):
+        if role not in ROLES and role!=NO_ROLE:
+            raise ValueError(f"Unknown role {role} for route {pattern}")
+        self.pattern=pattern
+        self.role=role
+        self.log_level=log_level
+        self.cache_ttl=cache_ttl
+        self.timeout=timeout
+        self.priority=priority
+        self.rank=ROLES.index(role) if role in ROLES else len(ROLES)
+
+    def allows(self, user_type: str) -> bool:
+        """Return True if a user of this type can call the route"""
+        return user_type in ROLES and ROLES.index(user_type)>=self.rank
+
+    def to_dict(self) -> dict:
+        return {"pattern": self.pattern, "role": self.role, "log_level": self.log_level, "cache_ttl": self.cache_ttl,
+                "timeout": self.timeout, "priority": self.priority}
+
+
+def compile_pattern(pattern: str) -> re.Pattern:
+    """Regular expression of a pattern whose {name} parts match one path segment"""
+    parts=re.split(r"\{\w+\}", pattern)
+    return re.compile("[^/]+".join(re.escape(part) for part in parts)+"$")
+
+
+def parse_policy(line: str) -> RoutePolicy:
+    """Parse a route written as pattern:role[:log=0,cache=30,timeout=600,priority=2]"""
+    parts=line.strip().split(":")
+    if len(parts) not in (2, 3):
+        raise ValueError(f"Route must be pattern:role[:options], not {line.strip()}")
+    options={}
+    if len(parts)==3:
+        for item in parts[2].split(","):
+            if "=" in item:
+                name, value=item.split("=", 1)
+                options[name.strip().lower()]=float(value)
+    return RoutePolicy(parts[0].strip().lstrip("/"), parts[1].strip(),
+                       log_level=int(options.get("log", 1)), cache_ttl=options.get("cache", 0), timeout=options.get("timeout"), priority=options.get("priority", 1))
+
+
+def read_policies(path: str) -> list[RoutePolicy]:
+    """Read the routes of a file, one per line. Empty lines and lines starting with # are skipped"""
+    policies=[]
+    with open(path, "r") as file:
+        for line in file:
+            if line.strip() and not line.strip().startswith("#"):
+                policies.append(parse_policy(line))
+    return policies
+
+
+class RouteTable:
+    """Compiled route policies (thread-safe). A later policy with the same pattern replaces the former one"""
+    def __init__(self, policies: list[RoutePolicy]):
+        by_pattern={policy.pattern: policy for policy in policies}
+        self.policies=list(by_pattern.values())
+        self.exact: dict[str, RoutePolicy]={}
+        self.patterns: list[tuple[re.Pattern, RoutePolicy]]=[]
+        self.prefixes: list[tuple[str, RoutePolicy]]=[]
+        for policy in self.policies:
+            if policy.pattern.endswith("*"):
+                self.prefixes.append((policy.pattern[:-1], policy))
+            elif "{" in policy.pattern:
+                self.patterns.append((compile_pattern(policy.pattern), policy))
+            else:
+                self.exact[policy.pattern]=policy
+        self.prefixes.sort(key=lambda item: len(item[0]), reverse=True)
+        self.lock=threading.Lock()
+        self.matched: dict[str, RoutePolicy|None]={}
+
+    def match(self, endpoint: str) -> RoutePolicy|None:
+        """Return the policy of endpoint, None if no route matches it"""
+        try:
+            return self.matched[endpoint]
+        except KeyError:
+            pass
+        policy=self.exact.get(endpoint)
+        if policy is None:
+            policy=next((policy for regex, policy in self.patterns if regex.match(endpoint)), None)
+        if policy is None:
+            policy=next((policy for prefix, policy in self.prefixes if endpoint.startswith(prefix)), None)
+        with self.lock:
+            if len(self.matched)>=MAX_MATCHED:
+                self.matched.clear()
+            self.matched[endpoint]=policy
+        return policy
+
+    def to_list(self) -> list[dict]:
+        return [policy.to_dict() for policy in self.policies]
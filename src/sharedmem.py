@@ -0,0 +1,38 @@
+"""
+Counters shared by the pre-fork workers: a fixed-size hash table in shared memory, created by the supervisor
+before forking. Every worker process reads and writes the same rows, under one lock shared by the processes.
+Each row is width floats, found by a name. Rows are never removed: the table is sized for the users of the proxy.
+"""
+import hashlib
+
+
+def get_key(name: str) -> int:
+    """Stable 64-bit key of a name, the same in every process (never 0, the key of a free row)"""
+    return int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), "little", signed=True) or 1
+
+
+class SharedTable:
+    """Rows of floats in shared memory. The caller holds self.lock around every access"""
+    def __init__(self, context, size: int, width: int):
+        self.size=size
+        self.width=width
+        self.lock=context.Lock()
+        self.keys=context.RawArray("q", size)
+        self.values=context.RawArray("d", size*width)
+
+    def find(self, name: str) -> int|None:
+        """Return the offset of the row of name in self.values, adding a row of zeros if it is new. None if the table is full"""
+        key=get_key(name)
+        slot=key%self.size
+        for _ in range(self.size):
+            if self.keys[slot]==0:
+                self.keys[slot]=key
+                return slot*self.width
+            if self.keys[slot]==key:
+                return slot*self.width
+            slot=(slot+1)%self.size
+        return None
+
+    def used_rows(self) -> list[int]:
+        """Offsets of the rows in use"""
+        return [slot*self.width for slot in range(self.size) if self.keys[slot]!=0]
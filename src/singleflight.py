@@ -0,0 +1,56 @@
+"""
+Coalescing of identical concurrent calls: while a call is in flight, the same call made by other threads
+waits for its result instead of being sent again to Ollama.
+"""
+import threading
+
+
+class Call:
+    """One call in flight, with the result shared by all its waiters"""
+    def __init__(self):
+        self.done=threading.Event()
+        self.result=None
+        self.error=None
+        self.waiters=0
+
+
+class SingleFlight:
+    """Run func once for all the concurrent callers using the same key (thread-safe)"""
+    def __init__(self):
+        self.lock=threading.Lock()
+        self.calls: dict[object, Call]={}
+        self.executed=0
+        self.shared=0
+
+    def do(self, key, func):
+        """Return func() result. If the same key is already in flight, wait for it and share its result"""
+        with self.lock:
+            call=self.calls.get(key)
+            leader=call is None
+            if leader:
+                call=Call()
+                self.calls[key]=call
+                self.executed+=1
+            else:
+                call.waiters+=1
+                self.shared+=1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result=func()
+        except Exception as e:
+            call.error=e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {"in_flight": len(self.calls), "executed": self.executed, "shared": self.shared}
@@ -0,0 +1,174 @@
+"""
+Line-aligned streaming helpers shared by the Flask and asyncio engines.
+Ollama NDJSON lines and OpenAI-style SSE events are forwarded as soon as they are complete, never split
+across two writes nor held back waiting for a full buffer.
+Each stream records its time-to-first-byte and time-to-first-token, to check the latency added by the proxy.
+"""
+import json
+import threading
+import time
+from collections import deque
+from src import usage
+
+
+def is_sse(content_type: str|None) -> bool:
+    """Return True if the stream is made of Server-Sent Events (OpenAI compatible endpoints)"""
+    return content_type is not None and content_type.startswith("text/event-stream")
+
+
+class FrameSplitter:
+    """Cut a byte stream into complete frames: NDJSON lines or SSE events"""
+    def __init__(self, sse: bool):
+        self.sse=sse
+        self.separator=b"\n\n" if sse else b"\n"
+        self.buffer=b""
+
+    def feed(self, data: bytes) -> bytes:
+        """Add received bytes and return all the complete frames (or b"" if none is complete yet)"""
+        if self.sse and self.separator==b"\n\n" and b"\r\n" in data:
+            self.separator=b"\r\n\r\n"
+        if self.buffer:
+            data=self.buffer+data
+        end=data.rfind(self.separator)
+        if end<0:
+            self.buffer=data
+            return b""
+        end+=len(self.separator)
+        self.buffer=data[end:]
+        return data[:end]
+
+    def flush(self) -> bytes:
+        """Return the incomplete end of the stream"""
+        data=self.buffer
+        self.buffer=b""
+        return data
+
+
+def frame_has_token(frame: bytes, sse: bool) -> bool:
+    """Return True if a frame carries generated text (or the end of the generation)"""
+    try:
+        if sse:
+            for line in frame.splitlines():
+                if line.startswith(b"data:"):
+                    payload=line[5:].strip()
+                    if payload==b"[DONE]":
+                        return True
+                    choices=json.loads(payload).get("choices") or []
+                    for choice in choices:
+                        if (choice.get("delta") or {}).get("content") or choice.get("text"):
+                            return True
+            return False
+        chunk=json.loads(frame)
+        return bool(chunk.get("response") or (chunk.get("message") or {}).get("content") or chunk.get("done"))
+    except (ValueError, AttributeError):
+        # Unknown format: the first frame is considered as the first token
+        return True
+
+
+class StreamTimer:
+    """Timings of one forwarded stream, measured from the moment the proxy received the request"""
+    def __init__(self, endpoint: str, user_name: str, model=None, user_type: str = "", request_id: str|None = None, ip: str|None = None):
+        self.endpoint=endpoint
+        self.user_name=user_name
+        self.model=model
+        self.user_type=user_type
+        self.request_id=request_id
+        self.ip=ip
+        self.status=None
+        self.request_bytes=0
+        self.start=time.perf_counter()
+        self.sse=False
+        self.queue_wait=None            # seconds waited in the admission queue
+        self.connect=None               # upstream answered with its headers
+        self.first_byte=None
+        self.first_token=None
+        self.frames=0
+        self.bytes=0
+        self.usage=None                 # tokens and durations read in the final frames (usage.find_usage())
+
+    def on_connect(self, content_type: str|None, status: int = 200) -> None:
+        self.connect=time.perf_counter()-self.start
+        self.status=status
+        self.sse=is_sse(content_type)
+
+    def on_data(self, data: bytes) -> None:
+        """Called with every chunk received from upstream"""
+        if self.first_byte is None:
+            self.first_byte=time.perf_counter()-self.start
+        self.bytes+=len(data)
+
+    def on_frames(self, frames: bytes) -> None:
+        """Called with every block of complete frames, just before it is written to the client"""
+        separator=b"\n\n" if self.sse else b"\n"
+        self.frames+=max(frames.count(separator), 1)
+        found=usage.find_usage(frames)
+        if found is not None:
+            self.usage=found
+        if self.first_token is None:
+            for frame in frames.split(separator):
+                if frame.strip() and frame_has_token(frame, self.sse):
+                    self.first_token=time.perf_counter()-self.start
+                    break
+
+    def to_dict(self) -> dict:
+        return {
+            "endpoint": self.endpoint,
+            "user_name": self.user_name,
+            "model": self.model,
+            "time": time.time(),
+            "queue_wait": self.queue_wait,
+            "connect": self.connect,
+            "ttfb": self.first_byte,
+            "ttft": self.first_token,
+            "total": time.perf_counter()-self.start,
+            "frames": self.frames,
+            "bytes": self.bytes
+        }
+
+
+class StreamStats:
+    """Keep the timings of the last streams and aggregated values (thread-safe)"""
+    def __init__(self, size: int = 200):
+        self.lock=threading.Lock()
+        self.recent=deque(maxlen=size)
+        self.count=0
+        self.ttfb_sum=0.0
+        self.ttft_sum=0.0
+        self.ttft_count=0
+        self.ttft_max=0.0
+
+    def record(self, timer: StreamTimer) -> dict:
+        item=timer.to_dict()
+        with self.lock:
+            self.recent.append(item)
+            self.count+=1
+            self.ttfb_sum+=item["ttfb"] or 0
+            if item["ttft"] is not None:
+                self.ttft_sum+=item["ttft"]
+                self.ttft_count+=1
+                self.ttft_max=max(self.ttft_max, item["ttft"])
+        return item
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "streams": self.count,
+                "avg_ttfb": self.ttfb_sum/self.count if self.count else None,
+                "avg_ttft": self.ttft_sum/self.ttft_count if self.ttft_count else None,
+                "max_ttft": self.ttft_max,
+                "recent": list(self.recent)
+            }
+
+
+def iter_frames(body: bytes, sse: bool):
+    """Yield the frames of a stored stream one by one, to replay it with its original framing"""
+    separator=b"\n\n" if sse else b"\n"
+    start=0
+    while start<len(body):
+        end=body.find(separator, start)
+        if end<0:
+            yield body[start:]
+            return
+        end+=len(separator)
+        yield body[start:end]
+        start=end
@@ -0,0 +1,239 @@
+"""
+Device telemetry sampled in the background: the static facts of the device (CPU model, cache sizes, arch, OS,
+hostname) are read once, and a thread samples the dynamic values (RAM, disk, GPU load, memory and temperature)
+every interval seconds. /info/device answers with the latest snapshot, already serialized, so its cost does not
+depend on the number of dashboards polling it.
+The samples are also kept in a ring buffer of fixed size (one array of doubles per value), and a time range is
+returned downsampled to a number of points with the min, max and average of each point. The min, max and sum of
+each group of ROLLUP_SIZE samples are kept up to date as the samples are added: a query reads the rollups of the
+groups inside its points, and only the samples at the edges of the points.
+"""
+import bisect
+import json
+import math
+import threading
+import time
+import traceback
+from array import array
+from src import device
+
+# Values kept in the history: percents of CPU, RAM, disk and GPU load, MB of GPU memory used, GPU temperature
+HISTORY_SERIES=["cpu", "ram", "disk", "gpu_load", "vram_mb", "gpu_temperature"]
+MAX_POINTS=1000
+# Samples of a group of the history with their min, max and sum precomputed
+ROLLUP_SIZE=64
+
+
+def get_history_values(snapshot: dict) -> dict:
+    """Return the values of a device snapshot kept in the history. With several GPUs: max load and temperature,
+    sum of the memory used. Values not known are NaN
+    """
+    values=dict.fromkeys(HISTORY_SERIES, math.nan)
+    if not snapshot or not snapshot.get("detected"):
+        return values
+    values["cpu"]=snapshot.get("cpu_load", math.nan)
+    ram_installed=snapshot.get("ram_installed") or 0
+    if ram_installed>0:
+        values["ram"]=(ram_installed-snapshot.get("ram_available", 0))/ram_installed*100
+    if snapshot.get("hdd_total"):
+        values["disk"]=snapshot.get("hdd_used", 0)/snapshot["hdd_total"]*100
+    gpus=snapshot.get("gpus")
+    if gpus:
+        values["gpu_load"]=max(gpu.get("load") or 0 for gpu in gpus)*100
+        # GPUtil reports MB, scaled to bytes in the snapshot by device.get_gpu_info(): back to MB
+        values["vram_mb"]=sum(gpu.get("memoryUsed") or 0 for gpu in gpus)/(1024*1024)
+        values["gpu_temperature"]=max(gpu.get("temperature") or 0 for gpu in gpus)
+    return values
+
+
+def aggregate(values: array) -> tuple:
+    """Return (min, max, sum, count) of the values, without the NaN values"""
+    if len(values)==0:
+        return math.inf, -math.inf, 0.0, 0
+    total=sum(values)
+    if total!=total:
+        # Rare NaN values (a GPU not read): only then the values are filtered one by one
+        values=[value for value in values if value==value]
+        if not values:
+            return math.inf, -math.inf, 0.0, 0
+        total=sum(values)
+    return min(values), max(values), total, len(values)
+
+
+class TelemetryHistory:
+    """Ring buffer of the last capacity samples: the memory used is fixed, whatever the uptime (thread-safe)"""
+    def __init__(self, capacity: int = 17280):
+        self.capacity=max(capacity, 1)
+        self.lock=threading.Lock()
+        self.times=array("d", [0.0])*self.capacity
+        self.series={name: array("d", [math.nan])*self.capacity for name in HISTORY_SERIES}
+        self.next=0                         # index of the next sample written
+        self.count=0
+        self.added=0                        # samples added since the start: sample number n is at index n%capacity
+        # Rollups of the groups of ROLLUP_SIZE samples (numbered since the start), in a ring of groups long enough for every sample kept
+        self.groups=self.capacity//ROLLUP_SIZE+2
+        self.group_ids=array("q", [-1])*self.groups
+        self.rollups={name: (array("d", [math.inf])*self.groups, array("d", [-math.inf])*self.groups, array("d", [0.0])*self.groups, array("d", [0.0])*self.groups)
+                      for name in HISTORY_SERIES}
+
+    def add(self, timestamp: float, values: dict) -> None:
+        with self.lock:
+            group=self.added//ROLLUP_SIZE
+            slot=group%self.groups
+            if self.group_ids[slot]!=group:
+                # First sample of a group: its slot held a group of samples already overwritten
+                self.group_ids[slot]=group
+                for mins, maxs, sums, counts in self.rollups.values():
+                    mins[slot], maxs[slot], sums[slot], counts[slot]=math.inf, -math.inf, 0.0, 0.0
+            self.times[self.next]=timestamp
+            for name, series in self.series.items():
+                value=values.get(name)
+                value=value if value is not None else math.nan
+                series[self.next]=value
+                if value==value:
+                    mins, maxs, sums, counts=self.rollups[name]
+                    mins[slot]=min(mins[slot], value)
+                    maxs[slot]=max(maxs[slot], value)
+                    sums[slot]+=value
+                    counts[slot]+=1
+            self.next=(self.next+1)%self.capacity
+            self.count=min(self.count+1, self.capacity)
+            self.added+=1
+
+    def get_samples(self, values: array, first: int, last: int) -> array:
+        """Return the samples first to last (excluded, numbered since the start) of a series (called with the lock held)"""
+        start=first%self.capacity
+        end=start+last-first
+        if end<=self.capacity:
+            return values[start:end]
+        return values[start:]+values[:end-self.capacity]
+
+    def aggregate_range(self, name: str, first: int, last: int) -> tuple:
+        """Return (min, max, sum, count) of the samples first to last (excluded, numbered since the start) of a series:
+        rollups of the groups inside the range, samples of the edges (called with the lock held)
+        """
+        values=self.series[name]
+        first_group=-(-first//ROLLUP_SIZE)
+        last_group=last//ROLLUP_SIZE
+        if first_group>=last_group:
+            return aggregate(self.get_samples(values, first, last))
+        mins, maxs, sums, counts=self.rollups[name]
+        low, high, total, count=math.inf, -math.inf, 0.0, 0
+        for group in range(first_group, last_group):
+            slot=group%self.groups
+            low=min(low, mins[slot])
+            high=max(high, maxs[slot])
+            total+=sums[slot]
+            count+=counts[slot]
+        for edge in (self.get_samples(values, first, first_group*ROLLUP_SIZE), self.get_samples(values, last_group*ROLLUP_SIZE, last)):
+            edge_low, edge_high, edge_total, edge_count=aggregate(edge)
+            low, high, total, count=min(low, edge_low), max(high, edge_high), total+edge_total, count+edge_count
+        return low, high, total, count
+
+    def query(self, since: float|None = None, until: float|None = None, points: int = 100) -> dict:
+        """Return the samples between since and until downsampled to points time buckets of the same duration,
+        with the min, max and average of each series in each bucket (None for a bucket without samples)
+        """
+        points=min(max(int(points), 1), MAX_POINTS)
+        with self.lock:
+            # Only the times are copied, oldest first, to find the samples of each point. The values are read in place
+            oldest=self.added-self.count
+            times=self.get_samples(self.times, oldest, self.added)
+            start=bisect.bisect_left(times, since) if since is not None else 0
+            end=bisect.bisect_right(times, until) if until is not None else len(times)
+            if start>=end:
+                return {"since": since, "until": until, "samples": 0, "interval": None, "times": [], "series": {name: {"min": [], "max": [], "avg": []} for name in self.series}}
+            since=since if since is not None else times[start]
+            until=until if until is not None else times[end-1]
+            interval=max(until-since, 1e-9)/points
+            # Index of the first sample of each bucket, then of the end of the last one
+            bounds=[bisect.bisect_left(times, since+interval*point, start, end) for point in range(points)]+[end]
+            result={"since": since, "until": until, "samples": end-start, "interval": interval, "times": [since+interval*point for point in range(points)], "series": {}}
+            # Points of a few samples: the range is copied once and each slice reduced, else the rollups are read
+            use_rollups=end-start>=points*ROLLUP_SIZE*2
+            for name, values in self.series.items():
+                samples=None if use_rollups else self.get_samples(values, oldest+start, oldest+end)
+                mins, maxs, avgs=[], [], []
+                for point in range(points):
+                    if use_rollups:
+                        low, high, total, count=self.aggregate_range(name, oldest+bounds[point], oldest+bounds[point+1])
+                    else:
+                        low, high, total, count=aggregate(samples[bounds[point]-start:bounds[point+1]-start])
+                    mins.append(low if count>0 else None)
+                    maxs.append(high if count>0 else None)
+                    avgs.append(total/count if count>0 else None)
+                result["series"][name]={"min": mins, "max": maxs, "avg": avgs}
+        return result
+
+    def get_stats(self) -> dict:
+        return {"capacity": self.capacity, "samples": self.count, "bytes": ((len(self.series)+1)*self.capacity+(len(self.rollups)*4+1)*self.groups)*8}
+
+
+class DeviceSampler:
+    """Latest device information, sampled by a background thread (thread-safe).
+    With interval 0, no thread is started and the device is sampled by each call of get_snapshot()
+    """
+    def __init__(self, log_file: str, interval: float = 5, history_size: int = 17280):
+        self.log_file=log_file
+        self.interval=interval
+        self.history=TelemetryHistory(history_size) if history_size>0 else None
+        self.static=None                    # result of device.get_static_info(), read by the first sample
+        self.latest=(None, b"null", 0.0)    # (snapshot, JSON body, time.time() of the sample), replaced as a whole
+        self.lock=threading.Lock()
+        self.thread=None
+        self.stopping=threading.Event()
+        self.samples=0
+        self.sample_time=0.0                # seconds taken by the last sample
+
+    def start(self) -> None:
+        """Start the sampling thread of this process (again after a fork: threads are not inherited)"""
+        if self.interval<=0 or self.is_running():
+            return
+        self.stopping=threading.Event()
+        self.thread=threading.Thread(target=self.run, name="infollama-telemetry", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopping.set()
+
+    def is_running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def run(self) -> None:
+        while not self.stopping.is_set():
+            self.sample()
+            self.stopping.wait(self.interval)
+
+    def sample(self) -> dict:
+        """Read the dynamic values of the device, and the static facts if they are not known yet"""
+        with self.lock:
+            started=time.perf_counter()
+            if self.static is None:
+                try:
+                    self.static=device.get_static_info()
+                except Exception:
+                    # Read again by the next sample, get_device_info() reports the device as not detected
+                    traceback.print_exc()
+            snapshot=device.get_device_info(self.log_file, self.static)
+            self.latest=(snapshot, json.dumps(snapshot, default=str).encode(), time.time())
+            if self.history is not None:
+                self.history.add(self.latest[2], get_history_values(snapshot))
+            self.samples+=1
+            self.sample_time=time.perf_counter()-started
+            return snapshot
+
+    def get_latest(self) -> tuple:
+        """Return (snapshot, JSON body, sample time) of the latest sample, sampled now if there is none or no sampling thread"""
+        if not self.is_running() or self.latest[0] is None:
+            self.sample()
+        return self.latest
+
+    def get_snapshot(self) -> dict:
+        return self.get_latest()[0]
+
+    def get_body(self) -> bytes:
+        return self.get_latest()[1]
+
+    def get_stats(self) -> dict:
+        return {"interval": self.interval, "running": self.is_running(), "samples": self.samples, "sample_time": self.sample_time, "sampled_at": self.latest[2],
+                "history": self.history.get_stats() if self.history is not None else None}
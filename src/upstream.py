@@ -0,0 +1,150 @@
+"""
+Upstream HTTP client used by the proxy to reach the Ollama servers.
+Each backend gets its own pooled keep-alive session, so forwarded calls and token streams
+reuse open TCP connections instead of doing a new handshake on every request.
+"""
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+class IdleExpiryMixin:
+    """urllib3 connection pool closing the connections idle for more than keep_alive seconds when they are taken
+    out of the pool: the server may have closed them. The other connections and the pool counters are kept
+    """
+    keep_alive=60
+    upstream=None
+
+    def _get_conn(self, timeout=None):
+        conn=super()._get_conn(timeout)
+        released_at=getattr(conn, "released_at", None)
+        if released_at is not None and time.monotonic()-released_at>self.keep_alive:
+            conn.close()
+            conn=self._new_conn()
+            self.upstream.count_recycled()
+        return conn
+
+    def _put_conn(self, conn) -> None:
+        if conn is not None:
+            conn.released_at=time.monotonic()
+        super()._put_conn(conn)
+
+
+class UpstreamPool:
+    """Pooled keep-alive session to one Ollama backend (thread-safe, shared by all request threads)"""
+    def __init__(self, base_url: str, pool_size: int = 32, keep_alive: int = 60, pool_block: bool = False, timeout=None):
+        self.base_url=base_url
+        self.timeout=timeout
+        self.pool_size=pool_size
+        self.keep_alive=keep_alive
+        self.pool_block=pool_block
+        self.lock=threading.Lock()
+        self.recycled=0
+        # urllib3 keeps at most pool_size idle connections. Extra connections are opened when all are busy
+        # (long streams) and discarded on release, unless pool_block is set: then callers wait for a free one.
+        self.adapter=HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=pool_block)
+        if keep_alive>0:
+            # Idle connections expire one by one, in the pool of their host
+            self.adapter.poolmanager.pool_classes_by_scheme={
+                "http": type("IdleExpiryHTTPConnectionPool", (IdleExpiryMixin, HTTPConnectionPool), {"keep_alive": keep_alive, "upstream": self}),
+                "https": type("IdleExpiryHTTPSConnectionPool", (IdleExpiryMixin, HTTPSConnectionPool), {"keep_alive": keep_alive, "upstream": self})}
+        self.session=requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        if keep_alive<=0:
+            # keep_alive=0 disables connection reuse
+            self.session.headers["Connection"]="close"
+
+    def __str__(self):
+        return f"UpstreamPool(base_url={self.base_url}, pool_size={self.pool_size}, keep_alive={self.keep_alive})"
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Send a request to the backend through the pooled session"""
+        # A dead or hung backend must not hold the caller forever: (connect, read) timeout unless set by the caller
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def count_recycled(self) -> None:
+        """Count a connection closed after keep_alive idle seconds"""
+        with self.lock:
+            self.recycled+=1
+
+    def get_stats(self) -> dict:
+        """Return the pool statistics: new connections opened, requests sent and connections reused"""
+        new_connections=0
+        requests_sent=0
+        idle_connections=0
+        pools=self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool=pools.get(key)
+            if pool is None:
+                continue
+            new_connections+=pool.num_connections
+            requests_sent+=pool.num_requests
+            if pool.pool is not None:
+                # The urllib3 queue is pre-filled with None placeholders: count only the open connections
+                idle_connections+=sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        return {
+            "base_url": self.base_url,
+            "pool_size": self.pool_size,
+            "pool_block": self.pool_block,
+            "keep_alive": self.keep_alive,
+            "requests": requests_sent,
+            "new_connections": new_connections,
+            "reused_connections": max(requests_sent-new_connections, 0),
+            "idle_connections": idle_connections,
+            "recycled": self.recycled
+        }
+
+
+class UpstreamClient:
+    """Manage one UpstreamPool per backend (scheme://host:port) and route each request to its pool"""
+    def __init__(self, pool_size: int = 32, keep_alive: int = 60, pool_block: bool = False, timeout=None):
+        self.pool_size=pool_size
+        self.keep_alive=keep_alive
+        self.pool_block=pool_block
+        self.timeout=timeout
+        self.pools: dict[str, UpstreamPool]={}
+        self.lock=threading.Lock()
+
+    def get_pool(self, url: str) -> UpstreamPool:
+        """Return the pool of the backend serving url, created on first use"""
+        parts=urlsplit(url)
+        base_url=f"{parts.scheme}://{parts.netloc}"
+        pool=self.pools.get(base_url)
+        if pool is None:
+            with self.lock:
+                pool=self.pools.get(base_url)
+                if pool is None:
+                    pool=UpstreamPool(base_url, pool_size=self.pool_size, keep_alive=self.keep_alive, pool_block=self.pool_block, timeout=self.timeout)
+                    self.pools[base_url]=pool
+        return pool
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        return self.get_pool(url).request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def get_stats(self) -> dict:
+        """Return the statistics of every backend pool"""
+        backends=[pool.get_stats() for pool in list(self.pools.values())]
+        return {
+            "requests": sum(b["requests"] for b in backends),
+            "new_connections": sum(b["new_connections"] for b in backends),
+            "reused_connections": sum(b["reused_connections"] for b in backends),
+            "backends": backends
+        }
+
+    def close(self) -> None:
+        """Close every pooled connection"""
+        with self.lock:
+            for pool in self.pools.values():
+                pool.session.close()
+            self.pools.clear()
@@ -0,0 +1,123 @@
+"""
+Token usage of the model calls, read from the answers of Ollama: prompt_eval_count, eval_count and the durations
+(Ollama API, final done:true chunk of a stream), or the usage object (OpenAI compatible API).
+The values are searched in the raw bytes, without parsing large answers like embeddings nor buffering streams.
+Usage is aggregated per user and per model for capacity planning.
+"""
+import re
+import threading
+import time
+from collections import deque
+
+# The lookbehind skips the same names escaped inside a generated text
+PATTERNS={name: re.compile(rb'(?<!\\)"'+name.encode()+rb'"\s*:\s*(\d+)') for name in (
+    "prompt_eval_count", "eval_count", "prompt_eval_duration", "eval_duration", "load_duration", "total_duration",
+    "prompt_tokens", "completion_tokens")}
+# Usage fields are at the end of the answers: the tail is searched first
+TAIL_SIZE=4096
+# Ollama durations are in nanoseconds
+NANOSECONDS=1e9
+
+
+def find_fields(data: bytes) -> dict[str, int]:
+    """Return the usage fields found in data (last value of each field)"""
+    fields={}
+    for name, pattern in PATTERNS.items():
+        matches=pattern.findall(data)
+        if matches:
+            fields[name]=int(matches[-1])
+    return fields
+
+
+def find_usage(data: bytes) -> dict|None:
+    """Return the usage of an answer, or of the final frames of a stream, None if not found:
+    prompt_tokens, completion_tokens, and with the Ollama API the durations in seconds
+    """
+    if b"eval_count" not in data and b"_tokens" not in data:
+        return None
+    fields=find_fields(data[-TAIL_SIZE:])
+    if not fields and len(data)>TAIL_SIZE:
+        fields=find_fields(data)
+    if "prompt_eval_count" in fields or "eval_count" in fields:
+        found={"prompt_tokens": fields.get("prompt_eval_count", 0), "completion_tokens": fields.get("eval_count", 0)}
+        for name in ("prompt_eval_duration", "eval_duration", "load_duration", "total_duration"):
+            if name in fields:
+                found[name]=fields[name]/NANOSECONDS
+        return found
+    if "prompt_tokens" in fields or "completion_tokens" in fields:
+        return {"prompt_tokens": fields.get("prompt_tokens", 0), "completion_tokens": fields.get("completion_tokens", 0)}
+    return None
+
+
+def get_total_tokens(found: dict) -> int:
+    return found.get("prompt_tokens", 0)+found.get("completion_tokens", 0)
+
+
+class UsageTotals:
+    """Usage summed over many calls"""
+    def __init__(self):
+        self.requests=0
+        self.prompt_tokens=0
+        self.completion_tokens=0
+        self.timed_prompt_tokens=0          # tokens of the calls reporting their durations
+        self.timed_completion_tokens=0
+        self.prompt_eval_duration=0.0
+        self.eval_duration=0.0
+        self.load_duration=0.0
+        self.load_max=0.0
+
+    def add(self, found: dict) -> None:
+        self.requests+=1
+        self.prompt_tokens+=found.get("prompt_tokens", 0)
+        self.completion_tokens+=found.get("completion_tokens", 0)
+        if "prompt_eval_duration" in found:
+            self.timed_prompt_tokens+=found.get("prompt_tokens", 0)
+            self.prompt_eval_duration+=found["prompt_eval_duration"]
+        if "eval_duration" in found:
+            self.timed_completion_tokens+=found.get("completion_tokens", 0)
+            self.eval_duration+=found["eval_duration"]
+        if "load_duration" in found:
+            self.load_duration+=found["load_duration"]
+            self.load_max=max(self.load_max, found["load_duration"])
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.prompt_tokens+self.completion_tokens,
+            "prompt_tokens_per_second": self.timed_prompt_tokens/self.prompt_eval_duration if self.prompt_eval_duration else None,
+            "tokens_per_second": self.timed_completion_tokens/self.eval_duration if self.eval_duration else None,
+            "load_time": self.load_duration,
+            "max_load_time": self.load_max
+        }
+
+
+class UsageStats:
+    """Usage of the model calls per user and per model, and the usage of the last calls (thread-safe)"""
+    def __init__(self, history: int = 200):
+        self.lock=threading.Lock()
+        self.users: dict[str, UsageTotals]={}
+        self.models: dict[str, UsageTotals]={}
+        self.recent=deque(maxlen=history)
+
+    def record(self, user_name: str, model, endpoint: str, found: dict) -> None:
+        model=model if isinstance(model, str) else "unknown"
+        with self.lock:
+            self.users.setdefault(user_name, UsageTotals()).add(found)
+            self.models.setdefault(model, UsageTotals()).add(found)
+            self.recent.append({"time": time.time(), "user_name": user_name, "model": model, "endpoint": endpoint, **found})
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "users": {user_name: totals.to_dict() for user_name, totals in self.users.items()},
+                "models": {model: totals.to_dict() for model, totals in self.models.items()},
+                "recent": list(self.recent)
+            }
+
+    def clear(self) -> None:
+        with self.lock:
+            self.users.clear()
+            self.models.clear()
+            self.recent.clear()
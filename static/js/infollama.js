@@ -27,6 +27,8 @@ const proxy = {
   lastOllamaPingSuccess: 0,
   nbPing: 0,
   validToken: false,
+  events: null /* EventSource of the dashboard updates pushed by /info/events */,
+  snapshotETag: null /* ETag of the last /info/snapshot, sent back in If-None-Match */,
 };
 
 class UsageSynthese {
@@ -125,28 +127,89 @@ function ping(token = "") {
         /* A response is received. Proxy pings successfully. Update the last ping success date and status */
         proxy.lastPingSuccess = new Date();
         proxy.ping = data;
-        if (proxy.ping.ping) {
-          /* Means ollama is pinging */
-          proxy.lastOllamaPingSuccess = new Date();
-          const iconHeart = document.getElementById("icon-heart");
-          iconHeart.classList.add("green-heart");
-          iconHeart.classList.remove("broken-heart");
-          updateTooltipTitle("icon-heart", "Proxy and Ollama servers are up");
-        } else {
-          /* Means ollama is not pinging */
-          const iconHeart = document.getElementById("icon-heart");
-          iconHeart.classList.add("broken-heart");
-          iconHeart.classList.remove("green-heart");
-          updateTooltipTitle("icon-heart", "Ollama server is down");
+        updateHeart();
+        resolve(data);
+      })
+      .catch((error) => {
+        /* Proxy does not respond */
+        updateHeart(false);
+        reject(error);
+      });
+  });
+}
+
+/* Update the heart icon with the state of the last ping. proxyUp is false when the proxy does not respond */
+function updateHeart(proxyUp = true) {
+  const iconHeart = document.getElementById("icon-heart");
+  if (proxyUp && proxy.ping.ping) {
+    /* Means ollama is pinging */
+    proxy.lastOllamaPingSuccess = new Date();
+    iconHeart.classList.add("green-heart");
+    iconHeart.classList.remove("broken-heart");
+    updateTooltipTitle("icon-heart", "Proxy and Ollama servers are up");
+  } else {
+    iconHeart.classList.add("broken-heart");
+    iconHeart.classList.remove("green-heart");
+    updateTooltipTitle(
+      "icon-heart",
+      proxyUp ? "Ollama server is down" : "Proxy is down"
+    );
+  }
+}
+
+/* Get the ping, models, running models and device in one call. Resolves null if nothing changed since the last call (304) */
+function getSnapshot() {
+  return new Promise((resolve, reject) => {
+    const token = getCookie("proxy-token");
+    const headers = {
+      "Content-Type": "application/json",
+      Authorization: "Bearer " + token,
+    };
+    if (proxy.snapshotETag) {
+      headers["If-None-Match"] = proxy.snapshotETag;
+    }
+    proxy.lastPing = new Date();
+    proxy.nbPing++;
+    fetch("/info/snapshot", {
+      method: "GET",
+      headers: headers,
+      cache: "no-store",
+    })
+      .then((response) => {
+        proxy.lastPingSuccess = new Date();
+        if (response.status == 304) {
+          return null;
         }
+        proxy.snapshotETag = response.headers.get("ETag");
+        return response.json();
+      })
+      .then((data) => {
+        if (data) {
+          proxy.ping = data.ping;
+          if (data.models) {
+            if (
+              JSON.stringify(proxy.models) != JSON.stringify(data.models.models)
+            ) {
+              proxy.needModelDisplayUpdate = true;
+            } else {
+              proxy.needModelDisplayUpdate = false;
+            }
+            proxy.models = data.models.models;
+          }
+          if (data.ps) {
+            proxy.ps = data.ps.models;
+          }
+          if (data.device) {
+            proxy.device = data.device;
+          }
+        }
+        updateHeart();
         resolve(data);
       })
       .catch((error) => {
         /* Proxy does not respond */
-        const iconHeart = document.getElementById("icon-heart");
-        iconHeart.classList.remove("green-heart");
-        iconHeart.classList.add("broken-heart");
-        updateTooltipTitle("icon-heart", "Proxy is down");
+        proxy.snapshotETag = null;
+        updateHeart(false);
         reject(error);
       });
   });
@@ -1016,6 +1079,7 @@ function startUIWhenLogin() {
       updateFlowContainer();
       getAllShowModels();
       activateTooltips();
+      startEvents();
     })
     .catch((error) => {
       console.error("Error on startUIWhenLogin() :", error);
@@ -1023,15 +1087,67 @@ function startUIWhenLogin() {
     });
 }
 
+/* Open the push channel of the dashboard: the proxy sends the ping, models, running models and device
+   when they change, read by one poller on the server whatever the number of open pages */
+function startEvents() {
+  if (
+    !window.EventSource ||
+    (proxy.events && proxy.events.readyState != EventSource.CLOSED)
+  ) {
+    return;
+  }
+  proxy.events = new EventSource("/info/events");
+  proxy.events.addEventListener("ping", (event) => {
+    /* The user and the config are only sent by /info/ping */
+    proxy.lastPing = new Date();
+    proxy.lastPingSuccess = new Date();
+    proxy.ping = { ...proxy.ping, ...JSON.parse(event.data) };
+    updateHeart();
+  });
+  proxy.events.addEventListener("models", (event) => {
+    const data = JSON.parse(event.data);
+    if (JSON.stringify(proxy.models) != JSON.stringify(data.models)) {
+      proxy.needModelDisplayUpdate = true;
+    } else {
+      proxy.needModelDisplayUpdate = false;
+    }
+    proxy.models = data.models;
+    displayModels();
+    activateTooltips();
+  });
+  proxy.events.addEventListener("ps", (event) => {
+    proxy.ps = JSON.parse(event.data).models;
+    displayPS();
+    activateTooltips();
+  });
+  proxy.events.addEventListener("device", (event) => {
+    proxy.device = JSON.parse(event.data);
+    displayDevice();
+  });
+  proxy.events.onerror = () => {
+    /* The browser opens the stream again, the heart beat polls meanwhile */
+    if (proxy.events.readyState != EventSource.OPEN) {
+      updateHeart(false);
+    }
+  };
+}
+
 /* Heart Beat of the UI app to check connexion and LLM server usage */
 function heartBeat() {
   setInterval(() => {
-    Promise.all([ping(), getModels(), getPS(), getDevice()])
+    if (proxy.events && proxy.events.readyState == EventSource.OPEN) {
+      /* Updates are pushed by /info/events */
+      return;
+    }
+    getSnapshot()
       .then((data) => {
-        displayPS();
-        displayModels();
-        displayDevice();
-        activateTooltips();
+        /* Nothing to display if unchanged, or if the user can not read the running models and the device */
+        if (data && data.ps && data.device) {
+          displayPS();
+          displayModels();
+          displayDevice();
+          activateTooltips();
+        }
       })
       .catch((error) => {
         console.error("Error on heartBeat() :", error);
@@ -0,0 +1,68 @@
+import multiprocessing
+import threading
+from src import admission
+
+
+def test_calls_over_the_limit_wait_for_a_release():
+    controller=admission.AdmissionController(max_in_flight=1)
+    first=controller.acquire("user1", "api/chat", timeout=1)
+    admitted=[]
+    second=controller.submit("user2", "api/chat", 1, lambda: admitted.append("user2"))
+    assert first is not None and admitted==[]
+    controller.release(first)
+    assert admitted==["user2"] and second.admitted_at is not None
+    controller.release(second)
+    assert controller.get_stats()["in_flight"]==0
+
+
+def test_fair_queue_interleaves_the_users():
+    controller=admission.AdmissionController(max_in_flight=1)
+    holder=controller.acquire("holder", "api/chat")
+    order=[]
+    tickets=[controller.submit("heavy", "api/chat", 1, lambda: order.append("heavy")) for _ in range(3)]
+    tickets.append(controller.submit("light", "api/chat", 1, lambda: order.append("light")))
+    controller.release(holder)
+    for ticket in tickets:
+        controller.release(ticket)
+    assert order[:2]==["heavy", "light"]
+
+
+def test_per_user_limit():
+    controller=admission.AdmissionController(max_per_user=1)
+    assert controller.acquire("user1", "api/chat") is not None
+    assert controller.acquire("user1", "api/chat", timeout=0.01) is None
+    assert controller.acquire("user2", "api/chat", timeout=0.01) is not None
+    assert controller.get_stats()["timeouts"]==1
+
+
+def test_full_queue_is_rejected():
+    controller=admission.AdmissionController(max_in_flight=1, max_queue=1)
+    controller.acquire("user1", "api/chat")
+    assert controller.submit("user2", "api/chat", 1, lambda: None) is not None
+    assert controller.submit("user3", "api/chat", 1, lambda: None) is None
+    assert controller.get_stats()["rejected"]==1
+
+
+def test_workers_share_the_slots():
+    slots=admission.SharedSlots(multiprocessing.get_context("fork"), workers=2)
+    workers=[admission.AdmissionController(max_in_flight=1, max_per_user=1) for _ in range(2)]
+    for worker_id, controller in enumerate(workers):
+        controller.share(slots, worker_id)
+    first=workers[0].acquire("user1", "api/chat")
+    assert workers[1].acquire("user2", "api/chat", timeout=0.1) is None
+    admitted=threading.Event()
+    second=workers[1].submit("user2", "api/chat", 1, admitted.set)
+    # The slot given back by the first worker is found by the other one
+    workers[0].release(first)
+    assert admitted.wait(1) and second.admitted_at is not None
+    assert workers[0].get_stats()["in_flight"]==1 and workers[0].get_stats()["worker_in_flight"]==0
+
+
+def test_slots_of_a_stopped_worker_are_given_back():
+    slots=admission.SharedSlots(multiprocessing.get_context("fork"), workers=2)
+    workers=[admission.AdmissionController(max_in_flight=1) for _ in range(2)]
+    for worker_id, controller in enumerate(workers):
+        controller.share(slots, worker_id)
+    assert workers[0].acquire("user1", "api/chat") is not None
+    slots.reset(0)
+    assert workers[1].acquire("user1", "api/chat", timeout=0.1) is not None
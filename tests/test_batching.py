@@ -0,0 +1,67 @@
+import json
+import threading
+from src import batching
+
+
+class Answer:
+    def __init__(self, status, data):
+        self.status=status
+        self.data=data
+
+    def json(self):
+        return self.data
+
+
+def make_batcher(fail_batches=False):
+    sent=[]
+    def send(endpoint, json_data, params):
+        inputs=json_data["input"] if isinstance(json_data["input"], list) else [json_data["input"]]
+        sent.append(inputs)
+        if fail_batches and len(inputs)>1:
+            return Answer(500, {"error": "bad input"})
+        return Answer(200, {"model": json_data["model"], "embeddings": [[float(len(text))] for text in inputs], "prompt_eval_count": len(inputs)})
+    return batching.EmbeddingBatcher(send, lambda answer: answer, window_ms=50, max_inputs=64), sent
+
+
+def embed_concurrently(batcher, texts):
+    results={}
+    def call(text):
+        results[text]=batcher.embed("api/embed", {"model": "m1", "input": text})
+    threads=[threading.Thread(target=call, args=(text,)) for text in texts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_requests_are_sent_in_one_call_and_split_back():
+    batcher, sent=make_batcher()
+    results=embed_concurrently(batcher, ["a", "bb", "ccc"])
+    assert len(sent)==1 and sorted(sent[0])==["a", "bb", "ccc"]
+    assert {text: answer["embeddings"] for text, answer in results.items()}=={"a": [[1.0]], "bb": [[2.0]], "ccc": [[3.0]]}
+    assert sum(answer["prompt_eval_count"] for answer in results.values())==3
+    assert batcher.get_stats()["batches"]==1
+
+
+def test_failed_batch_sends_each_request_alone():
+    batcher, sent=make_batcher(fail_batches=True)
+    results=embed_concurrently(batcher, ["a", "bb"])
+    assert results["a"].data["embeddings"]==[[1.0]] and results["bb"].data["embeddings"]==[[2.0]]
+    assert len(sent)==3 and batcher.get_stats()["fallbacks"]==1
+
+
+def test_requests_with_other_options_are_not_batched_together():
+    batcher, sent=make_batcher()
+    key=batcher.get_batch_key("api/embed", {"model": "m1", "input": ["a"]}, None)
+    assert key!=batcher.get_batch_key("api/embed", {"model": "m1", "input": ["a"], "dimensions": 2}, None)
+    assert batcher.get_batch_key("v1/embeddings", {"model": "m1", "input": ["a"], "encoding_format": "base64"}, None) is None
+    assert batcher.get_batch_key("api/embed", {"model": "m1", "input": [1, 2]}, None) is None
+    assert batcher.get_batch_key("api/embed", ["a"], None) is None
+
+
+def test_split_answer_of_the_openai_endpoint():
+    answers=batching.split_answer("v1/embeddings", {"model": "m1"}, {"usage": {"prompt_tokens": 10}}, [["aaa"], ["b", "c"]], [[1.0], [2.0], [3.0]])
+    assert [[item["embedding"] for item in answer["data"]] for answer in answers]==[[[1.0]], [[2.0], [3.0]]]
+    assert [answer["usage"]["prompt_tokens"] for answer in answers]==[6, 4]
+    json.dumps(answers)
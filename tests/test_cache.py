@@ -0,0 +1,52 @@
+import time
+from src import cache
+
+
+def test_ttl_cache_hit_and_expiry():
+    entries=cache.TTLCache(max_size=4)
+    entries.set("tags", b"{}", ttl=0.05)
+    assert entries.get("tags")==b"{}"
+    time.sleep(0.06)
+    assert entries.get("tags") is None
+    stats=entries.get_stats()
+    assert (stats["hits"], stats["misses"], stats["size"])==(1, 1, 0)
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    entries=cache.TTLCache(max_size=2)
+    entries.set("a", 1, ttl=60)
+    entries.set("b", 2, ttl=60)
+    entries.get("a")
+    entries.set("c", 3, ttl=60)
+    assert entries.get("b") is None
+    assert entries.get("a")==1 and entries.get("c")==3
+
+
+def test_ttl_cache_skips_zero_ttl_and_counts_clear():
+    entries=cache.TTLCache(max_size=2)
+    entries.set("a", 1, ttl=0)
+    assert len(entries)==0
+    entries.set("b", 2, ttl=60)
+    entries.clear()
+    assert len(entries)==0 and entries.get_stats()["invalidations"]==1
+
+
+def test_sized_cache_is_bounded_in_bytes():
+    entries=cache.SizedLRUCache(max_bytes=10)
+    entries.set("a", "a", size=4)
+    entries.set("b", "b", size=4)
+    entries.get("a")
+    entries.set("c", "c", size=4)
+    assert entries.get("b") is None
+    assert entries.get("a")=="a" and entries.get("c")=="c"
+    stats=entries.get_stats()
+    assert (stats["size"], stats["evictions"])==(8, 1)
+
+
+def test_sized_cache_replaces_and_skips_too_large_values():
+    entries=cache.SizedLRUCache(max_bytes=10)
+    entries.set("a", "first", size=4)
+    entries.set("a", "second", size=6)
+    entries.set("big", "big", size=11)
+    assert entries.get("a")=="second" and entries.get("big") is None
+    assert entries.get_stats()["size"]==6
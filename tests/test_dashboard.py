@@ -0,0 +1,33 @@
+from src import dashboard
+
+
+def test_subscribers_only_get_the_changed_parts():
+    values={"ping": {"ping": True}, "ps": {"models": []}}
+    feed=dashboard.DashboardFeed({name: (lambda name=name: values[name]) for name in values})
+    notified=[]
+    subscription=dashboard.Subscription(lambda: notified.append(1))
+    feed.subscriptions.append(subscription)
+    feed.poll()
+    assert [name for name, body in feed.get_changes(subscription)]==["ping", "ps"]
+    feed.poll()
+    assert feed.get_changes(subscription)==[] and len(notified)==1
+    values["ps"]={"models": [{"name": "m1"}]}
+    feed.poll()
+    assert feed.get_changes(subscription)==[("ps", b'{"models": [{"name": "m1"}]}')]
+
+
+def test_failing_or_unavailable_parts_keep_their_last_value():
+    values={"ping": {"ping": True}}
+    def failing():
+        raise ConnectionError("down")
+    feed=dashboard.DashboardFeed({"ping": lambda: values["ping"], "ps": failing})
+    feed.poll()
+    values["ping"]=None
+    feed.poll()
+    assert feed.parts["ping"][2]==b'{"ping": true}'
+    assert feed.get_stats()["errors"]==2
+
+
+def test_event_frames():
+    assert dashboard.format_event("ps", b"{}")==b"event: ps\ndata: {}\n\n"
+    assert dashboard.format_retry()==b"retry: 5000\n\n"
@@ -0,0 +1,50 @@
+from src import embedcache
+
+
+def test_key_depends_on_model_options_and_normalized_text():
+    key=embedcache.get_key("digest1", "café")
+    assert key==embedcache.get_key("digest1", "café")
+    assert key!=embedcache.get_key("digest2", "café")
+    assert key!=embedcache.get_key("digest1", "café", "dimensions=2")
+    assert len(key)==embedcache.KEY_SIZE
+
+
+def test_vectors_are_read_back_exactly_after_a_restart(tmp_path):
+    path=str(tmp_path/"embed.bin")
+    vector=[0.1, -1/3, 1e-12]
+    cache=embedcache.EmbeddingCache(max_items=10, disk_path=path)
+    cache.set_many([b"k"*16], [vector])
+    restarted=embedcache.EmbeddingCache(max_items=10, disk_path=path)
+    assert restarted.get_many([b"k"*16, b"x"*16])==[vector, None]
+    stats=restarted.get_stats()
+    assert (stats["disk_hits"], stats["misses"], stats["disk"]["items"])==(1, 1, 1)
+    assert restarted.get_many([b"k"*16])==[vector]
+    assert restarted.get_stats()["memory_hits"]==1
+
+
+def test_memory_tier_is_bounded():
+    cache=embedcache.EmbeddingCache(max_items=2)
+    cache.set_many([b"a", b"b", b"c"], [[1.0], [2.0], [3.0]])
+    assert cache.get_many([b"a", b"b", b"c"])==[None, [2.0], [3.0]]
+
+
+def test_clear_empties_both_tiers_and_the_other_processes_see_it(tmp_path, monkeypatch):
+    path=str(tmp_path/"embed.bin")
+    cache=embedcache.EmbeddingCache(disk_path=path)
+    other=embedcache.EmbeddingCache(disk_path=path)
+    cache.set_many([b"k"*16], [[1.0, 2.0]])
+    assert other.get_many([b"k"*16])==[[1.0, 2.0]]
+    cache.clear()
+    assert cache.get_many([b"k"*16])==[None]
+    other.entries.clear()
+    monkeypatch.setattr(embedcache, "CHECK_INTERVAL", 0)
+    assert other.get_many([b"k"*16])==[None]
+
+
+def test_file_of_another_format_is_not_used(tmp_path):
+    path=tmp_path/"embed.bin"
+    path.write_bytes(b"\x01"*64)
+    cache=embedcache.EmbeddingCache(disk_path=str(path))
+    cache.set_many([b"k"*16], [[1.0]])
+    assert cache.get_stats()["disk"]["disabled"]
+    assert path.read_bytes()==b"\x01"*64
@@ -0,0 +1,46 @@
+import time
+from src import backends, health
+
+
+def test_breaker_opens_after_the_threshold_and_half_opens_after_the_reset():
+    breaker=health.CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.on_failure()
+    assert breaker.allow()
+    breaker.on_failure()
+    assert breaker.state=="open" and not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state=="half_open" and not breaker.allow()
+    breaker.on_success()
+    assert breaker.state=="closed" and breaker.allow()
+
+
+def test_failed_trial_opens_the_breaker_again():
+    breaker=health.CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.on_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.on_failure()
+    assert breaker.state=="open" and breaker.to_dict()["opened"]==2
+
+
+def test_aborted_trial_goes_to_the_next_call():
+    breaker=health.CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.on_failure()
+    time.sleep(0.06)
+    assert breaker.allow() and not breaker.is_available()
+    breaker.on_abort()
+    assert breaker.state=="half_open" and breaker.allow()
+
+
+def test_health_checker_sets_the_health_of_the_backends():
+    pool=backends.BackendPool(["http://up:11434", "http://down:11434"], fetch=lambda backend, endpoint: None, failure_threshold=1)
+    def probe(backend):
+        if "down" in backend.base_url:
+            raise ConnectionError("refused")
+        return {"version": "0.5.7"}
+    health.HealthChecker(pool, probe, interval=0).check_all()
+    up, down=pool.backends
+    assert (up.health, up.version)==("up", "0.5.7")
+    assert (down.health, down.error)==("down", "refused")
+    assert pool.available()==[up]
@@ -0,0 +1,51 @@
+import json
+import time
+import pytest
+from src import logindex
+
+
+# Records of the last minutes: older ones are removed by the retention
+START=int(time.time())-3600
+
+
+@pytest.fixture
+def index(tmp_path):
+    index=logindex.LogIndex(str(tmp_path/"infollama.db"))
+    lines=[json.dumps({"time": logindex.format_time(START+i) if i%2 else START+i, "request_id": str(i), "user": "user1" if i%2 else "user2", "endpoint": "api/chat",
+                       "model": "m1:latest", "status": 500 if i%5==0 else 200, "latency": 1.0, "prompt_tokens": 10, "completion_tokens": 20})
+           for i in range(50)]
+    index.add_lines(lines+["not json"])
+    return index
+
+
+def test_pages_are_read_with_the_cursor(index):
+    ids=[]
+    before=None
+    while True:
+        page=index.query({"limit": 7, "before": before})
+        ids+=[record["request_id"] for record in page["records"]]
+        if not page["more"]:
+            break
+        before=page["next"]
+    assert ids==[str(i) for i in range(49, -1, -1)]
+    assert index.get_stats()["errors"]==1
+
+
+def test_filters(index):
+    assert len(index.query({"user": "user1"})["records"])==25
+    assert len(index.query({"status": "5xx"})["records"])==10
+    assert len(index.query({"status": "errors", "user": "user2"})["records"])==5
+    page=index.query({"since": START+40, "until": logindex.format_time(START+50)})
+    assert [record["request_id"] for record in page["records"]]==[str(i) for i in range(49, 39, -1)]
+
+
+def test_wrong_cursor_is_a_value_error(index):
+    with pytest.raises(ValueError):
+        index.query({"before": "junk"})
+
+
+def test_totals_per_user(index):
+    groups={group["user"]: group for group in index.aggregate("user", {})["groups"]}
+    assert (groups["user1"]["calls"], groups["user1"]["errors"], groups["user1"]["completion_tokens"])==(25, 5, 500)
+    with pytest.raises(ValueError):
+        index.aggregate("ip", {})
@@ -0,0 +1,43 @@
+import glob
+import time
+from src import logwriter
+
+
+def test_lines_are_written_and_indexed_on_close(tmp_path):
+    path=str(tmp_path/"access.jsonl")
+    batches=[]
+    writer=logwriter.LogWriter(path, on_write=batches.append)
+    for i in range(5):
+        assert writer.write(f"line {i}\n")
+    writer.close()
+    with open(path) as file:
+        assert file.read().splitlines()==[f"line {i}" for i in range(5)]
+    assert sum(batches, [])==[f"line {i}\n" for i in range(5)]
+    assert not writer.write("late\n")
+
+
+def test_full_queue_drops_the_new_or_the_oldest_line(tmp_path):
+    for overflow, kept in (("drop", ["0", "1"]), ("drop_oldest", ["1", "2"])):
+        writer=logwriter.LogWriter(str(tmp_path/f"{overflow}.log"), max_queue=2, overflow=overflow, flush_interval=60)
+        # The thread is not started: the lines stay queued
+        writer.thread=object()
+        results=[writer.write(f"{i}\n") for i in range(3)]
+        assert results==[True, True, False]
+        assert [line.strip() for line in writer.lines]==kept
+        assert writer.get_stats()["dropped"]==1
+
+
+def test_rotation_on_size_keeps_the_last_segments(tmp_path):
+    path=str(tmp_path/"proxy.log")
+    writer=logwriter.LogWriter(path, max_size=10, keep=2)
+    for i in range(4):
+        writer.write("0123456789\n")
+        writer.flush()
+    writer.close()
+    for _ in range(50):
+        segments=glob.glob(path+".*")
+        if len(segments)==2 and all(segment.endswith(".gz") for segment in segments):
+            break
+        time.sleep(0.05)
+    assert writer.rotations==3
+    assert len(segments)==2 and all(segment.endswith(".gz") for segment in segments)
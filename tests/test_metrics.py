@@ -0,0 +1,37 @@
+from src import metrics
+
+
+def test_render_counts_the_calls_and_the_streams():
+    counters=metrics.Metrics()
+    counters.record_request("api/tags", 200, "", 0.02, bytes_in=0, bytes_out=100)
+    counters.stream_started()
+    counters.record_stream("api/chat", 200, "user", 1.5, ttft=0.3, connect=0.01, bytes_in=50, bytes_out=400)
+    text=counters.render([("cache_hit_rate", "Hit rate", ("cache",), {("metadata",): 0.5, ("generation",): None})])
+    assert 'infollama_requests_total{endpoint="api/tags",status="200",user_type="anonymous"} 1' in text
+    assert 'infollama_time_to_first_token_seconds_bucket{endpoint="api/chat",le="0.5"} 1' in text
+    assert 'infollama_request_duration_seconds_count{endpoint="api/chat"} 1' in text
+    assert "infollama_streams_in_flight 0" in text
+    assert "infollama_sent_bytes_total 500" in text
+    assert 'infollama_cache_hit_rate{cache="metadata"} 0.5' in text
+    assert "generation" not in text
+
+
+def test_snapshots_of_the_workers_are_summed(tmp_path):
+    worker=metrics.Metrics()
+    worker.record_request("api/tags", 200, "user", 0.02, bytes_out=10)
+    worker.stream_started()
+    path=str(tmp_path/"worker-1.json")
+    metrics.write_snapshot(worker, path)
+    total=metrics.Metrics()
+    total.record_request("api/tags", 200, "user", 0.2, bytes_out=5)
+    total.add(metrics.read_snapshot(path), in_flight=False)
+    snapshot=total.to_dict()
+    assert snapshot["requests"]==[["api/tags", 200, "user", 2]]
+    assert snapshot["histograms"]["request_duration"]["api/tags"][2]==2
+    assert (snapshot["streams_in_flight"], snapshot["bytes_out"])==(0, 15)
+
+
+def test_missing_or_partial_snapshot_is_none(tmp_path):
+    assert metrics.read_snapshot(str(tmp_path/"missing.json")) is None
+    (tmp_path/"partial.json").write_text('{"requests": [')
+    assert metrics.read_snapshot(str(tmp_path/"partial.json")) is None
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import os
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+import proxy as infollama
+
+ADMIN_TOKEN="pro_4478123456789"
+USER_TOKEN="pro_12345678900000"
+
+
+class FakeOllama(BaseHTTPRequestHandler):
+    """Ollama answering the calls of the proxy, counting the calls per endpoint"""
+    protocol_version="HTTP/1.1"
+    calls={}
+
+    def send_json(self, data, status=200):
+        body=json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        endpoint=self.path.split("?")[0].strip("/")
+        self.calls[endpoint]=self.calls.get(endpoint, 0)+1
+        if endpoint=="api/version":
+            return self.send_json({"version": "0.5.7"})
+        if endpoint=="api/tags":
+            return self.send_json({"models": [{"name": "m1:latest", "model": "m1:latest", "digest": "abc123", "size": 100, "details": {}}]})
+        if endpoint.startswith("v1/models/"):
+            return self.send_json({"id": endpoint[len("v1/models/"):], "object": "model", "created": 1, "owned_by": "library"})
+        if endpoint=="api/ps":
+            return self.send_json({"models": [{"name": "m1:latest", "model": "m1:latest", "expires_at": "2030-01-01T00:00:00Z", "size": 100, "size_vram": 100}]})
+        self.send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        endpoint=self.path.split("?")[0].strip("/")
+        self.calls[endpoint]=self.calls.get(endpoint, 0)+1
+        body=json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not isinstance(body, dict):
+            return self.send_json({"error": "invalid request"}, 400)
+        if endpoint=="api/embed":
+            inputs=[body["input"]] if isinstance(body["input"], str) else body["input"]
+            return self.send_json({"model": body["model"], "embeddings": [[float(len(text)), 1.0] for text in inputs], "prompt_eval_count": len(inputs)})
+        if endpoint=="api/chat":
+            return self.send_json({"model": "m1:latest", "message": {"role": "assistant", "content": "hello"}, "done": True, "prompt_eval_count": 5, "eval_count": 2})
+        self.send_json({"error": "not found"}, 404)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def ollama():
+    server=ThreadingHTTPServer(("127.0.0.1", 0), FakeOllama)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope="module")
+def proxy(ollama, tmp_path_factory):
+    folder=tmp_path_factory.mktemp("proxy")
+    user_file=folder/"users.conf"
+    user_file.write_text(f"admin:admin1:{ADMIN_TOKEN}\nuser:user1:{USER_TOKEN}\n")
+    proxy=infollama.InfollamaProxy(base_url=ollama, host="127.0.0.1", port=11430, cors_policy="", user_file=str(user_file), log_file=str(folder/"infollama.log"),
+                                   access_log_file=str(folder/"infollama.jsonl"), gen_cache_size=1, health_interval=0, device_interval=0, dashboard_interval=0)
+    proxy.load_user_file()
+    infollama.add_routes(proxy, os.path.dirname(os.path.abspath(infollama.__file__)))
+    return proxy
+
+
+@pytest.fixture
+def client(proxy):
+    return proxy.server.test_client()
+
+
+def bearer(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_routes_check_the_role_of_the_token(client):
+    assert client.get("/api/tags").status_code==200
+    assert client.get("/api/ps").status_code==403
+    assert client.get("/api/ps", headers=bearer(USER_TOKEN)).status_code==200
+    assert client.get("/info/admin_api/pool", headers=bearer(USER_TOKEN)).status_code==403
+    assert client.get("/info/admin_api/pool", headers=bearer(ADMIN_TOKEN)).status_code==200
+    assert client.get("/info/admin_api/streams", headers=bearer(ADMIN_TOKEN)).status_code==200
+    assert client.get("/api/blobs/sha256:abc", headers=bearer(USER_TOKEN)).status_code==403
+    # Endpoints without a route are never forwarded
+    assert client.get("/v1/models/m1/extra", headers=bearer(ADMIN_TOKEN)).status_code==403
+
+
+def test_model_details_are_served_to_the_users(client):
+    assert client.get("/v1/models/llama3").status_code==403
+    answer=client.get("/v1/models/llama3", headers=bearer(USER_TOKEN))
+    assert answer.status_code==200 and answer.get_json()["id"]=="llama3"
+
+
+def test_metadata_calls_are_answered_from_the_cache(client, proxy):
+    proxy.metadata_cache.clear()
+    calls=FakeOllama.calls.get("api/tags", 0)
+    hits=proxy.metadata_cache.get_stats()["hits"]
+    answers=[client.get("/api/tags") for _ in range(3)]
+    assert all(answer.get_json()["models"][0]["name"]=="m1:latest" for answer in answers)
+    assert FakeOllama.calls["api/tags"]==calls+1
+    assert proxy.metadata_cache.get_stats()["hits"]==hits+2
+
+
+def test_running_models_are_not_changed_in_the_cache(client, proxy):
+    answers=[client.get("/info/ps", headers=bearer(USER_TOKEN)).get_json() for _ in range(2)]
+    assert all("expires_in" in answer["models"][0] for answer in answers)
+    assert "expires_in" not in proxy.get_cached("GET", "api/ps").json()["models"][0]
+
+
+def test_deterministic_generations_are_replayed_and_counted(client, proxy):
+    request={"model": "m1", "messages": [{"role": "user", "content": "hi"}], "stream": False, "options": {"temperature": 0}}
+    calls=FakeOllama.calls.get("api/chat", 0)
+    answers=[client.post("/api/chat", json=request, headers=bearer(USER_TOKEN)) for _ in range(2)]
+    assert [answer.status_code for answer in answers]==[200, 200]
+    assert answers[0].data==answers[1].data
+    assert FakeOllama.calls["api/chat"]==calls+1
+    assert proxy.generation_cache.get_stats()["hits"]>=1
+    assert 'infollama_requests_total{endpoint="api/chat",status="200",user_type="user"} 2' in proxy.metrics.render()
+
+
+def test_snapshot_is_not_modified_with_its_etag(client, proxy):
+    first=client.get("/info/snapshot", headers=bearer(USER_TOKEN))
+    etag=first.headers["ETag"]
+    assert first.status_code==200 and first.get_json()["ps"]["models"][0]["name"]=="m1:latest"
+    not_modified=proxy.snapshots_not_modified
+    second=client.get("/info/snapshot", headers={**bearer(USER_TOKEN), "If-None-Match": f"W/{etag}"})
+    assert second.status_code==304 and second.data==b"" and second.headers["ETag"]==etag
+    assert proxy.snapshots_not_modified==not_modified+1
+    # The running models and the device are not sent to the anonymous users: other body, other ETag
+    anonymous=client.get("/info/snapshot", headers={"If-None-Match": etag})
+    assert anonymous.status_code==200 and anonymous.get_json()["ps"] is None
+
+
+def test_requests_with_wrong_options_are_forwarded_to_ollama(client, proxy):
+    for body in ({"model": "m1", "messages": [], "stream": False, "options": "x"}, {"model": "m1", "messages": [], "stream": False, "options": [0]}, [1, 2]):
+        assert proxy.get_generation_cache_key("api/chat", body, "user1") is None
+    answer=client.post("/api/chat", json={"model": "m1", "messages": [], "stream": False, "options": "x"}, headers=bearer(USER_TOKEN))
+    assert answer.status_code==200
+
+
+def test_embeddings_that_are_not_an_object_are_forwarded(client):
+    for body in ([1, 2], "text"):
+        answer=client.post("/api/embed", json=body, headers=bearer(USER_TOKEN))
+        assert answer.status_code==400 and answer.get_json()["error"]=="invalid request"
+    answers=[client.post("/api/embed", json={"model": "m1", "input": ["ab", "abc"]}, headers=bearer(USER_TOKEN)).get_json() for _ in range(2)]
+    assert answers[0]["embeddings"]==answers[1]["embeddings"]==[[2.0, 1.0], [3.0, 1.0]]
+
+
+def test_async_engine_checks_the_rate_limits_before_the_admission(ollama, tmp_path):
+    aiohttp=pytest.importorskip("aiohttp")
+    from aiohttp.test_utils import TestClient, TestServer
+    from src import aioproxy
+    user_file=tmp_path/"users.conf"
+    user_file.write_text(f"user:user1:{USER_TOKEN}:rps=1\n")
+    proxy=infollama.InfollamaProxy(base_url=ollama, host="127.0.0.1", port=11430, cors_policy="", user_file=str(user_file), log_file=str(tmp_path/"infollama.log"),
+                                   access_log_file=str(tmp_path/"infollama.jsonl"), max_in_flight=1, health_interval=0, device_interval=0, dashboard_interval=0)
+    proxy.load_user_file()
+    app_path=os.path.dirname(os.path.abspath(infollama.__file__))
+    infollama.add_routes(proxy, app_path)
+    request={"model": "m1", "messages": [{"role": "user", "content": "hi"}], "stream": False}
+
+    async def run():
+        async with TestClient(TestServer(aioproxy.AioProxy(proxy, "test", app_path).create_app())) as client:
+            first=await client.post("/api/chat", json=request, headers=bearer(USER_TOKEN))
+            assert first.status==200
+            submitted=proxy.admission.get_stats()
+            second=await client.post("/api/chat", json=request, headers=bearer(USER_TOKEN))
+            assert second.status==429 and int(second.headers["Retry-After"])>0
+            # Refused by the rate limit: no admission slot was asked for
+            assert proxy.admission.get_stats()==submitted
+
+    asyncio.run(run())
+
+
+def test_streams_closed_before_their_first_chunk_give_back_the_backend(proxy):
+    backend=next(iter(proxy.backends))
+    streams=proxy.metrics.streams_in_flight
+    with proxy.server.test_request_context("/api/chat", method="POST", json={"model": "m1", "messages": []}, headers=bearer(USER_TOKEN)):
+        answer=proxy.stream("api/chat", bearer(USER_TOKEN))
+        assert answer.status_code==200 and backend.outstanding==1
+        # Client gone before the body is read: the generator never started
+        answer.close()
+    assert backend.outstanding==0 and proxy.metrics.streams_in_flight==streams
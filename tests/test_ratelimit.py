@@ -0,0 +1,45 @@
+import multiprocessing
+from src import ratelimit
+
+
+def test_parse_limits_keeps_the_known_limits():
+    assert ratelimit.parse_limits("rps=2, TPM=60000,burst=3,bad")=={"rps": 2.0, "tpm": 60000.0}
+
+
+def test_rps_allows_a_burst_then_asks_to_wait():
+    limiter=ratelimit.RateLimiter()
+    limits={"rps": 2}
+    assert [limiter.check("user1", limits) for _ in range(3)]==[0, 0, 1]
+    assert limiter.check("user2", limits)==0
+    assert limiter.get_stats()["limited"]==1
+
+
+def test_tokens_are_taken_after_the_call():
+    limiter=ratelimit.RateLimiter()
+    limits={"tpm": 60}
+    assert limiter.check("user1", limits)==0
+    # 90 tokens for a bucket of 60 refilled at 1 per second: 30 seconds of debt
+    limiter.record_tokens("user1", limits, 90)
+    assert 29<=limiter.check("user1", limits)<=30
+
+
+def test_no_limits_never_waits():
+    limiter=ratelimit.RateLimiter()
+    assert all(limiter.check("user1", {})==0 for _ in range(100))
+    assert limiter.get_stats()=={"limited": 0, "users": {}}
+
+
+def test_workers_take_from_the_same_buckets():
+    context=multiprocessing.get_context("fork")
+    shared=ratelimit.create_shared_table(context)
+    workers=[ratelimit.RateLimiter() for _ in range(2)]
+    for limiter in workers:
+        limiter.share(shared)
+    limits={"rps": 2, "tpm": 60}
+    assert [workers[0].check("user1", limits), workers[1].check("user1", limits)]==[0, 0]
+    assert workers[1].check("user1", limits)==1
+    # The tokens of a call served by another process are taken from the same bucket
+    process=context.Process(target=workers[0].record_tokens, args=("user1", limits, 90))
+    process.start()
+    process.join(5)
+    assert 29<=workers[1].check("user1", {"tpm": 60})<=30
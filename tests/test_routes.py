@@ -0,0 +1,39 @@
+import pytest
+from src import routes
+
+
+def test_exact_path_then_pattern_then_longest_prefix():
+    table=routes.RouteTable([routes.parse_policy(line) for line in ["api/*:user", "api/admin/*:admin", "api/{name}/show:anonymous", "api/tags:anonymous:cache=30"]])
+    assert table.match("api/tags").cache_ttl==30
+    assert table.match("api/m1/show").role=="anonymous"
+    assert table.match("api/admin/pull").role=="admin"
+    assert table.match("api/chat").role=="user"
+    assert table.match("v1/models") is None
+
+
+def test_pattern_part_matches_one_segment():
+    table=routes.RouteTable([routes.parse_policy("v1/models/{model}:user")])
+    assert table.match("v1/models/m1") is not None
+    assert table.match("v1/models/m1/extra") is None
+
+
+def test_later_policy_replaces_the_same_pattern():
+    table=routes.RouteTable([routes.parse_policy("api/pull:admin"), routes.parse_policy("api/pull:none")])
+    assert len(table.policies)==1
+    assert not table.match("api/pull").allows("admin")
+
+
+def test_roles_allow_the_roles_before_them():
+    policy=routes.parse_policy("api/chat:user:log=0,timeout=600,priority=2")
+    assert policy.allows("admin") and policy.allows("user") and not policy.allows("anonymous")
+    assert (policy.log_level, policy.timeout, policy.priority)==(0, 600, 2)
+
+
+def test_wrong_routes_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        routes.parse_policy("api/chat")
+    with pytest.raises(ValueError):
+        routes.parse_policy("api/chat:root")
+    path=tmp_path/"routes.conf"
+    path.write_text("# comment\n\napi/chat:user\n")
+    assert [policy.pattern for policy in routes.read_policies(str(path))]==["api/chat"]
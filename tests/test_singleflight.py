@@ -0,0 +1,44 @@
+import threading
+import time
+import pytest
+from src import singleflight
+
+
+def test_concurrent_calls_share_one_execution():
+    flight=singleflight.SingleFlight()
+    calls=[]
+    def slow():
+        calls.append(1)
+        time.sleep(0.1)
+        return "tags"
+    results=[]
+    threads=[threading.Thread(target=lambda: results.append(flight.do("api/tags", slow))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results==["tags"]*8 and len(calls)==1
+    assert flight.get_stats()=={"in_flight": 0, "executed": 1, "shared": 7}
+
+
+def test_error_is_raised_to_every_waiter_and_not_kept():
+    flight=singleflight.SingleFlight()
+    started=threading.Event()
+    def failing():
+        started.set()
+        time.sleep(0.05)
+        raise ConnectionError("down")
+    errors=[]
+    def wait():
+        started.wait()
+        try:
+            flight.do("api/ps", failing)
+        except ConnectionError as e:
+            errors.append(e)
+    waiter=threading.Thread(target=wait)
+    waiter.start()
+    with pytest.raises(ConnectionError):
+        flight.do("api/ps", failing)
+    waiter.join()
+    assert len(errors)==1
+    assert flight.do("api/ps", lambda: "up")=="up"
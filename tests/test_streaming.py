@@ -0,0 +1,29 @@
+from src import streaming, usage
+
+
+def test_frames_are_never_split():
+    splitter=streaming.FrameSplitter(sse=False)
+    assert splitter.feed(b'{"response":"a"}\n{"resp')==b'{"response":"a"}\n'
+    assert splitter.feed(b'onse":"b"}\n')==b'{"response":"b"}\n'
+    assert splitter.feed(b'{"done":true}')==b""
+    assert splitter.flush()==b'{"done":true}'
+
+
+def test_sse_events_with_crlf():
+    splitter=streaming.FrameSplitter(sse=True)
+    assert splitter.feed(b"data: {}\r\n\r\ndata: [DO")==b"data: {}\r\n\r\n"
+    assert splitter.feed(b"NE]\r\n\r\n")==b"data: [DONE]\r\n\r\n"
+
+
+def test_first_token_detection():
+    assert not streaming.frame_has_token(b'{"message":{"content":""}}\n', sse=False)
+    assert streaming.frame_has_token(b'{"message":{"content":"Hi"}}\n', sse=False)
+    assert not streaming.frame_has_token(b'data: {"choices":[{"delta":{"role":"assistant"}}]}\n\n', sse=True)
+    assert streaming.frame_has_token(b"data: [DONE]\n\n", sse=True)
+
+
+def test_usage_of_the_ollama_and_openai_answers():
+    found=usage.find_usage(b'{"response":"\\"eval_count\\": 99","done":true,"prompt_eval_count":5,"eval_count":2,"eval_duration":1000000000}')
+    assert found=={"prompt_tokens": 5, "completion_tokens": 2, "eval_duration": 1.0}
+    assert usage.find_usage(b'{"usage":{"prompt_tokens":3,"completion_tokens":4}}')=={"prompt_tokens": 3, "completion_tokens": 4}
+    assert usage.find_usage(b'{"embeddings":[[1.0]]}') is None
@@ -0,0 +1,40 @@
+import math
+from src import telemetry
+
+
+def test_history_values_of_a_snapshot():
+    values=telemetry.get_history_values({"detected": True, "cpu_load": 12.5, "ram_installed": 16, "ram_available": 4, "hdd_total": 100, "hdd_used": 25,
+                                         "gpus": [{"load": 0.5, "memoryUsed": 2048*1024*1024, "temperature": 60}, {"load": 0.9, "memoryUsed": 1024*1024*1024, "temperature": 70}]})
+    assert values=={"cpu": 12.5, "ram": 75.0, "disk": 25.0, "gpu_load": 90.0, "vram_mb": 3072.0, "gpu_temperature": 70}
+    assert all(math.isnan(value) for value in telemetry.get_history_values({"detected": False}).values())
+
+
+def test_ring_buffer_keeps_the_last_samples():
+    history=telemetry.TelemetryHistory(capacity=3)
+    for second in range(5):
+        history.add(float(second), {"cpu": second*10.0})
+    result=history.query(points=3)
+    assert (result["since"], result["until"], result["samples"])==(2.0, 4.0, 3)
+    assert history.get_stats()["samples"]==3
+
+
+def test_query_downsamples_with_min_max_and_average():
+    history=telemetry.TelemetryHistory(capacity=100)
+    for second in range(10):
+        history.add(float(second), {"cpu": float(second), "gpu_load": math.nan if second<5 else 50.0})
+    result=history.query(since=0, until=10, points=2)
+    assert result["series"]["cpu"]=={"min": [0.0, 5.0], "max": [4.0, 9.0], "avg": [2.0, 7.0]}
+    assert result["series"]["gpu_load"]["avg"]==[None, 50.0]
+    assert history.query(since=20, until=30)["samples"]==0
+
+
+def test_rollups_follow_the_ring_buffer():
+    history=telemetry.TelemetryHistory(capacity=300)
+    for second in range(1000):
+        history.add(float(second), {"cpu": float(second), "gpu_load": math.nan if second%2 else 10.0})
+    # Points of many samples are read from the rollups of the groups kept, and the samples of their edges
+    result=history.query(points=2)
+    assert result["samples"]==300
+    assert result["series"]["cpu"]=={"min": [700.0, 850.0], "max": [849.0, 999.0], "avg": [774.5, 924.5]}
+    assert result["series"]["gpu_load"]["avg"]==[10.0, 10.0]
+    assert history.query(since=0, until=650, points=1)["samples"]==0
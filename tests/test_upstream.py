@@ -0,0 +1,51 @@
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+from src import upstream
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version="HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    server=ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_connections_are_reused(server_url):
+    client=upstream.UpstreamClient(keep_alive=60)
+    for _ in range(3):
+        assert client.get(server_url+"/api/version").status_code==200
+    stats=client.get_stats()
+    assert (stats["requests"], stats["new_connections"], stats["reused_connections"])==(3, 1, 2)
+
+
+def test_idle_connections_expire_without_resetting_the_counters(server_url):
+    client=upstream.UpstreamClient(keep_alive=0.2)
+    client.get(server_url+"/api/version")
+    client.get(server_url+"/api/version")
+    time.sleep(0.3)
+    client.get(server_url+"/api/version")
+    backend=client.get_stats()["backends"][0]
+    assert (backend["requests"], backend["new_connections"], backend["reused_connections"], backend["recycled"])==(3, 2, 1, 1)
+
+
+def test_one_pool_per_backend(server_url):
+    client=upstream.UpstreamClient()
+    assert client.get_pool(server_url+"/api/tags") is client.get_pool(server_url+"/api/ps")
+    assert client.get_pool("http://other:11434/api/tags") is not client.get_pool(server_url)